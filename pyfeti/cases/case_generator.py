@@ -103,7 +103,8 @@ class FETIcase_builder():
         for j in range(self.domains_y):
             for i in range(self.domains_x):
                 
-                K = copy.deepcopy(self.K)
+                # subdomains without Dirichlet B.C share the same K
+                K = self.K
                 f = copy.deepcopy(self.f)
                 global_id = self.two2one_map((i,j))
                 
@@ -134,7 +135,7 @@ class FETIcase_builder():
 
                 if i==0:
                     #apply dirichelt B.C
-                    K_dir_obj = Matrix(K,self.s.selection_dict)
+                    K_dir_obj = Matrix(copy.deepcopy(K),self.s.selection_dict)
                     try:
                         K = sparse.csr_matrix(K_dir_obj.eliminate_by_identity('left'))
                     except:
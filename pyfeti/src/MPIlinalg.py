@@ -8,7 +8,8 @@ import time
 from mpi4py import MPI
 from pyfeti.src.utils import MPILauncher, getattr_mpi_attributes, pyfeti_dir
 from scipy.sparse.linalg import LinearOperator
-from pyfeti.src.linalg import RetangularLinearOperator, vector2localdict, array2localdict
+from pyfeti.src.linalg import RetangularLinearOperator, vector2localdict, array2localdict, coldot, ReductionRequest
+from pyfeti.src.telemetry import telemetry
 
 comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
@@ -36,25 +37,30 @@ def exchange_info(local_var,sub_id,nei_id,tag_id=15,isnumpy=False):
 
     #init neighbor variable
     var_nei = None
+    t0 = telemetry.start()
     if nei_id>0:
         #checking data type
         if isnumpy:
             
-                # sending message to neighbors
-                comm.Send(local_var, dest = nei_id-1)
-                # receiving messages from neighbors
+                # combined send and receive, blocks of right hand sides can exceed
+                # the eager limit of MPI, then a Send before the Recv on both sides
+                # would dead lock
+                local_var = np.ascontiguousarray(local_var,dtype=float)
                 var_nei = np.empty(local_var.shape)
-                comm.Recv(var_nei,source=nei_id-1)
+                comm.Sendrecv(local_var, dest=nei_id-1, recvbuf=var_nei, source=nei_id-1)
         else:
             
             var_nei  = comm.sendrecv(local_var,dest=nei_id-1,source=nei_id-1)
+        telemetry.stop('exchange',t0)
 
     logging.debug('End exchange_info')
     return var_nei
 
 def exchange_global_dict(local_dict,local_id,partitions_list):
     
+    t0 = telemetry.start()
     list_of_dicts = comm.allgather(local_dict)
+    telemetry.stop('exchange',t0)
     
     global_dict = {}
     for item in list_of_dicts:
@@ -65,6 +71,21 @@ def exchange_global_dict(local_dict,local_id,partitions_list):
     
     return global_dict
 
+def gather_global_dict(local_dict,comm=comm,root=0):
+    ''' gather the dicts of the ranks of comm in the root rank, the
+    other ranks receive None
+    '''
+    t0 = telemetry.start()
+    list_of_dicts = comm.gather(local_dict,root=root)
+    telemetry.stop('exchange',t0)
+    if list_of_dicts is None:
+        return None
+
+    global_dict = {}
+    for item in list_of_dicts:
+        global_dict.update(item)
+    return global_dict
+
 def exchange_global_dict_of_arrays(local_dict,local_id,partitions_list):
     
     logging.debug('Init exchange_global_dict')
@@ -113,11 +134,11 @@ def All2Allreduce(local_var):
     ''' sum up all local_var in all mpi ranks
 
     Parameters:
-        local_var : float or 0D np.array
+        local_var : float or np.array
 
     returns:
-        global_var : 0D np.array
-            summation of all local variables
+        global_var : np.array
+            summation of all local variables with the shape of local_var
 
     '''
     try:
@@ -128,20 +149,60 @@ def All2Allreduce(local_var):
         local_var = np.array(local_var, dtype=dtype)
         
 
-    global_var = np.array(0.0, dtype=dtype)
+    global_var = np.zeros(np.shape(local_var), dtype=dtype)
     # sending message to neighbors
+    t0 = telemetry.start()
     comm.Allreduce(local_var, global_var, op=MPI.SUM)
+    telemetry.stop('reduction',t0)
     return global_var
 
+class IAllreduceRequest(ReductionRequest):
+    ''' non-blocking summation of local arrays in all mpi ranks. 
+    The reduction starts in the constructor and wait() returns 
+    scale*global_var, where global_var is the summation of all local_var
+
+    Parameters:
+        local_var : np.array
+            local array to be reduced
+        scale : float, Default = 1.0
+            scale factor of the reduced array
+    '''
+    def __init__(self,local_var,scale=1.0):
+        self.local_var = np.ascontiguousarray(local_var,dtype=np.float64)
+        self.global_var = np.zeros(self.local_var.shape, dtype=np.float64)
+        self.scale = scale
+        self.values = None
+        self.request = comm.Iallreduce(self.local_var, self.global_var, op=MPI.SUM)
+
+    def wait(self):
+        if self.values is None:
+            t0 = telemetry.start()
+            self.request.Wait()
+            telemetry.stop('reduction',t0)
+            self.values = self.scale*self.global_var
+        return self.values
+
+def All2Iallreduce(local_var):
+    ''' non-blocking version of All2Allreduce
+
+    Parameters:
+        local_var : np.array
+
+    returns:
+        IAllreduceRequest
+            request object, wait() returns the summation of all local variables
+    '''
+    return IAllreduceRequest(local_var)
+
 def All2All_array(local_array,size_list,global_array_length,dtype=np.float):
     ''' Exchange numpy array with all mpi ranks
     Paramenters:
 
     local_array : np.array
-        local numpy array
+        local numpy array, 2D arrays are exchanged row-wise
 
     size_list : list
-        list of expected mpi array lenghts
+        list of expected mpi array lenghts (number of rows)
 
     global_array_length : int
         global array
@@ -154,17 +215,20 @@ def All2All_array(local_array,size_list,global_array_length,dtype=np.float):
             a global numpy array
     '''
     
-    sizes = size_list
+    trailing_shape = np.shape(local_array)[1:]
+    n_columns = int(np.prod(trailing_shape))
+    sizes = [n_columns*size for size in size_list]
 
     # build the displacement of the buffer vector
     disp = [0]
     disp.extend(list(np.cumsum(sizes)[:-1]))
     
     # build global buffer array
-    global_array = np.zeros(global_array_length, dtype=dtype)
+    global_array = np.zeros((global_array_length,) + trailing_shape, dtype=dtype)
+    local_array = np.ascontiguousarray(local_array, dtype=dtype)
     
     # Global exchange
-    comm.Allgatherv([local_array,sizes[rank]],[global_array,(size_list,disp)])
+    comm.Allgatherv([local_array,sizes[rank]],[global_array,(sizes,disp)])
     
     return global_array
 
@@ -188,19 +252,45 @@ def pardot(v,w,local_id,neighbors_id,global2local_map,partitions_list=None):
     
     returns
         float
-            dot product of vector v and w
+            dot product of vector v and w, if v and w are 2D arrays
+            an array with the dot product of every column
 
     '''
     t1 = time.time()
     logging.info('starting pardot')
-    local_var = np.dot(v,w)
+    local_var = coldot(v,w)
     # global Reduce 
 
     v_dot_w = All2Allreduce(local_var)
-    logging.info('elaspsed_time_All2Allreduce %2.4f' %(time.time() - t1))
+    logging.info('elaspsed_time_All2Allreduce %2.4f', time.time() - t1)
     
     return 0.5*v_dot_w
 
+def parblockdot(V,W,local_id,neighbors_id,global2local_map,partitions_list=None):
+    ''' This function computes the parallel matrix V^T W of the columns 
+    of the 2D arrays V and W with a single reduction of the local 
+    matrix, see pardot
+
+    returns
+        np.array
+            array (V.shape[1], W.shape[1]) with the dot products of 
+            all the columns of V and W
+    '''
+    local_var = np.asarray(V.T.dot(W))
+    return 0.5*All2Allreduce(local_var)
+
+def parivdot(pairs,local_id=None,neighbors_id=None,global2local_map=None,partitions_list=None):
+    ''' This function computes fused parallel dot products of a list of pairs 
+    [(v1,w1), (v2,w2), ...] with a single non-blocking reduction, such that
+    local computation can be done while the message is in flight, see pardot
+
+    returns
+        IAllreduceRequest
+            request object, wait() returns the array [v1.dot(w1), v2.dot(w2), ...]
+    '''
+    local_var = np.array([coldot(v,w) for v,w in pairs])
+    return IAllreduceRequest(local_var,scale=0.5)
+
 def get_chunks(number_of_chuncks,size):
     ''' create chuncks based on number of mpi process
     '''
@@ -320,7 +410,7 @@ class ParallelRetangularLinearOperator(RetangularLinearOperator):
         local_id = self.local_id
         # convert vector to dict    
         v_dict = self.vec2dict(v, **kwargs)
-        a = np.zeros(self.shape[0])
+        a = np.zeros((self.shape[0],) + np.shape(v)[1:])
         for nei_id in self.neighbors_id:
             if nei_id>=local_id:
                 pair = (local_id,nei_id)
@@ -346,7 +436,7 @@ class ParallelRetangularLinearOperator(RetangularLinearOperator):
         try:       
             if isinstance(list(self.row_map_dict.keys())[0],int):
                 vec2dict = array2localdict(a, self.row_map_dict)
-                local_array = np.empty(0) 
+                local_array = np.empty((0,) + a.shape[1:]) 
                 if self.local_id in vec2dict:
                     local_array = vec2dict[self.local_id]
                 a = All2All_array(local_array, size_list = self.row_size_list ,global_array_length=self.shape[0])
@@ -378,6 +468,118 @@ class ParallelRetangularLinearOperator(RetangularLinearOperator):
                                         shape=(self.shape[1],self.shape[0]),dtype=self.dtype,**self.kwargs)
 
 
+class ParallelCoarseSolver():
+    ''' Coarse solve x = GGT^-1 b, where b is replicated in all the ranks of comm.
+    The root rank of comm owns the factorization of GGT and broadcasts the 
+    solution, e.g. the first rank of COMM_WORLD or the first rank of every node.
+    Without comm every rank owns a factorization and no message is sent.
+
+    Parameters:
+        solve : callable
+            function which solves GGT x = b, None in the ranks which are not the root
+        comm : MPI communicator, Default = None
+            communicator of the ranks which share the factorization
+        root : int, Default = 0
+            rank of comm which owns the factorization
+    '''
+    def __init__(self,solve,comm=None,root=0):
+        self.solve = solve
+        self.comm = comm
+        self.root = root
+
+    def dot(self,b):
+        t0 = telemetry.start()
+        if self.comm is None:
+            x = self.solve(b)
+        else:
+            x = np.empty(np.shape(b))
+            if self.comm.Get_rank()==self.root:
+                x[:] = self.solve(b)
+            self.comm.Bcast(x,root=self.root)
+        telemetry.stop('coarse_solve',t0)
+        return x
+
+
+class IterativeCoarseSolver():
+    ''' Coarse solve x = GGT^-1 b by the conjugate gradient method with the
+    distributed operator G G^T and a block Jacobi preconditioner, then GGT is
+    neither assembled nor factorized. b and x are replicated in all ranks, 
+    because G.dot returns replicated arrays, such that the dot products of 
+    the conjugate gradient do not need reductions.
+
+    Parameters:
+        G : ParallelRetangularLinearOperator
+            distributed G operator
+        M : sparse matrix
+            block diagonal inverse of GGT
+        tolerance : float, Default = 1.0E-12
+            tolerance of the residual relative to the norm of b
+        max_iterations : int, Default = None
+            maximum number of iterations, if None the size of GGT
+
+    The right hand sides of a 2D b are solved with a block conjugate gradient. 
+    iterations is the number of iterations of the last solve and iteration_history
+    the ones of all the solves since the last reset.
+    '''
+    def __init__(self,G,M,tolerance=1.0E-12,max_iterations=None):
+        self.G = G
+        self.M = M
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations if max_iterations is not None else M.shape[0]
+        self.iterations = 0
+        self.iteration_history = []
+
+    def reset(self):
+        ''' clear the iterations of the previous coarse solves
+        '''
+        self.iterations = 0
+        self.iteration_history = []
+
+    def dot(self,b):
+        t0 = telemetry.start()
+        x = self.cg(b)
+        telemetry.stop('coarse_solve',t0)
+        return x
+
+    def cg(self,b):
+        ''' block conjugate gradient, the columns of b have their own alpha and beta,
+        but share one G G^T action per iteration. Converged columns are not updated.
+        self.iterations is the number of iterations of this solve
+        '''
+        B = np.array(b,dtype=float).reshape(np.shape(b)[0],-1)
+        X = np.zeros(B.shape)
+        norm_b = np.linalg.norm(B,axis=0)
+        active = norm_b>0.0
+
+        R = B
+        Z = self.M.dot(R)
+        P = np.array(Z)
+        rz = np.einsum('ij,ij->j',R,Z)
+        self.iterations = 0
+        for k in range(self.max_iterations):
+            if not active.any():
+                break
+            self.iterations += 1
+            idx = np.flatnonzero(active)
+            Ap = self.G.dot(self.G.T.dot(P[:,idx]))
+            alpha = rz[idx]/np.einsum('ij,ij->j',P[:,idx],Ap)
+            X[:,idx] += alpha*P[:,idx]
+            R[:,idx] -= alpha*Ap
+
+            converged = np.linalg.norm(R[:,idx],axis=0)<=self.tolerance*norm_b[idx]
+            active[idx[converged]] = False
+            idx = idx[~converged]
+            Z = self.M.dot(R[:,idx])
+            rz_new = np.einsum('ij,ij->j',R[:,idx],Z)
+            P[:,idx] = Z + (rz_new/rz[idx])*P[:,idx]
+            rz[idx] = rz_new
+
+        if active.any():
+            logging.warning('Coarse conjugate gradient did not converge in %i iterations' %self.max_iterations)
+        self.iteration_history.append(self.iterations)
+        return X.reshape(np.shape(b))
+
+
 class ParallelMatrix():
     '''
     Paramenters
@@ -425,7 +627,7 @@ class ParallelMatrix():
             self.isserialize = True
         
         elapsed_time = time.time() - start_time
-        logging.info('Matrix serialization, Elapsed time : %4.5f ' %elapsed_time)
+        logging.info('Matrix serialization, Elapsed time : %4.5f ', elapsed_time)
         return None
 
     def load_columns_matrix(self,rank):
@@ -497,7 +699,7 @@ class ParallelVector():
             self.isserialize = True
 
         elapsed_time = time.time() - start_time
-        logging.info('vector serialization, Elapsed time : %4.5f ' %elapsed_time)
+        logging.info('vector serialization, Elapsed time : %4.5f ', elapsed_time)
         return None
 
     def load_vector_chunck(self,rank):
@@ -580,6 +782,29 @@ class  Test_Parallel(TestCase):
 
         np.testing.assert_almost_equal(u_target,u,decimal=10)
 
+    def test_iterative_coarse_solver(self):
+        G = sparse.csr_matrix(sparse.rand(10,30,density=0.5,random_state=1) + sparse.eye(10,30))
+        GGT = G.dot(G.T).toarray()
+        M = sparse.diags(1.0/np.diag(GGT))
+        b = np.random.RandomState(2).rand(10,3)
+        b[:,2] = 0.0
+
+        coarse_solver = IterativeCoarseSolver(G,M,tolerance=1.0E-12,max_iterations=50)
+        x = coarse_solver.dot(b)
+        np.testing.assert_almost_equal(GGT.dot(x),b,decimal=10)
+        block_iterations = coarse_solver.iterations
+
+        # one G G^T action per iteration for all the columns
+        column_iterations = []
+        for i in range(2):
+            np.testing.assert_almost_equal(coarse_solver.dot(b[:,i]),x[:,i],decimal=10)
+            column_iterations.append(coarse_solver.iterations)
+        self.assertEqual(block_iterations,max(column_iterations))
+        self.assertEqual(coarse_solver.iteration_history,[block_iterations] + column_iterations)
+
+        coarse_solver.reset()
+        self.assertEqual(coarse_solver.iteration_history,[])
+
 
 
 if __name__=='__main__':
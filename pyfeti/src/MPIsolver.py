@@ -19,13 +19,24 @@ import time
 from pyfeti.src.utils import save_object, load_object, Log, getattr_mpi_attributes
 from pyfeti.src.feti_solver import CoarseProblem, Solution, SolverManager, vector2localdict
 from pyfeti.src import solvers
-from pyfeti.src.MPIlinalg import exchange_info, exchange_global_dict, pardot, RetangularLinearOperator, ParallelRetangularLinearOperator
+from pyfeti.src.telemetry import telemetry, aggregate
+from pyfeti.src.cache import array_hash, FactorizationCache
+from pyfeti.src.MPIlinalg import exchange_info, exchange_global_dict, gather_global_dict, pardot, parivdot, parblockdot, RetangularLinearOperator, \
+                                 ParallelRetangularLinearOperator, ParallelCoarseSolver, IterativeCoarseSolver
 
 from mpi4py import MPI
 import os
 
 
 class LocalSolverManager(SolverManager):
+    # setup variables reused by a restart, see save_setup_cache
+    setup_cache_variables = ['course_problem','e_dict','GGT_dict','local_alpha_length_dict','local_lambda_length_dict',
+                             'local_primal_length_dict','local2global_lambda_dofs','global2local_lambda_dofs',
+                             'local2global_alpha_dofs','global2local_alpha_dofs','local2global_primal_dofs',
+                             'global2local_primal_dofs','lambda_size','alpha_size','primal_size','GGT']
+    # options of the key arg coarse_strategy, see GGT_inv
+    list_of_coarse_strategies = ['redundant','master','node','iterative']
+
     def __init__(self,obj_id, local_problem, **kwargs):
         
 
@@ -71,11 +82,71 @@ class LocalSolverManager(SolverManager):
         self.partitions_list = list(range(1,self.num_partitions+1))
         self.neighbors_id = self.local_problem.neighbors_id
         self.dual_interface_algorithm = 'PCPG'
+        self.telemetry_file = 'telemetry.npz'
+        self.last_local_solution = {}
+        self.primal_iterates = None
         # transform key args in object variables
         self.__dict__.update(kwargs)
+        if 'coarse_method' in kwargs:
+            self.course_problem.coarse_method = kwargs['coarse_method']
 
         logging.info('local length = %i' %self.local_problem.length)
         
+    @property
+    def rhs_shape(self):
+        return self.local_problem.f_local.data.shape[1:]
+
+    def get_recycle_file(self):
+        ''' every mpi rank has its own recycle store file, 
+        recycle_file + '_<obj_id>.npz'
+        '''
+        try:
+            return self.recycle_file + '_' + str(self.obj_id) + '.npz'
+        except AttributeError:
+            return None
+
+    def get_checkpoint_file(self):
+        ''' every mpi rank has its own checkpoint file, 
+        checkpoint_file + '_<obj_id>.npz'
+        '''
+        try:
+            return self.checkpoint_file + '_' + str(self.obj_id) + '.npz'
+        except AttributeError:
+            return None
+
+    def get_setup_cache_file(self):
+        try:
+            return self.checkpoint_file + '_setup_' + str(self.obj_id) + '.pkl'
+        except AttributeError:
+            return None
+
+    def save_setup_cache(self):
+        ''' save the assembled coarse problem and the local to global maps,
+        such that a restart does not repeat the setup and its exchanges
+        '''
+        setup_cache_file = self.get_setup_cache_file()
+        if setup_cache_file is not None:
+            save_object({key : getattr(self,key) for key in self.setup_cache_variables},setup_cache_file)
+
+    def load_setup_cache(self):
+        ''' load the setup saved by save_setup_cache, all ranks must
+        find their cache, otherwise the setup is computed again
+
+        return 
+            Boolean : True if the setup was loaded
+        '''
+        setup_cache_file = self.get_setup_cache_file()
+        setup_cache = None
+        if setup_cache_file is not None and os.path.exists(setup_cache_file):
+            setup_cache = load_object(setup_cache_file,tries=1,sleep_delay=0)
+        
+        if self.global_min(int(setup_cache is not None))==0:
+            return False
+
+        self.__dict__.update(setup_cache)
+        self.is_local_G_GGT_and_e_computed = True
+        return True
+
     def _exchange_global_size(self):
         local_id = self.obj_id
         for nei_id in self.local_problem.neighbors_id:
@@ -94,46 +165,27 @@ class LocalSolverManager(SolverManager):
         return None
         
     def mpi_solver(self):
-        ''' solve linear FETI problem with PCGP with partial reorthogonalization
+        ''' solve linear FETI problem with PCGP, full reorthogonalization of the search
+        directions is enabled with the key arg full_reorthogonalization=True,
+        Krylov recycling between sequential solves with the key arg recycle_file and
+        checkpointing of the PCPG with the key arg checkpoint_file. With restart=True
+        the setup and the PCPG are resumed from the files of a previous run
         '''
 
         start_time = time.time()
+        telemetry.reset()
 
-        logging.info('Assembling  local G, GGT, and e')
-        self.assemble_local_G_GGT_and_e()
-        build_local_matrix_time = time.time() - start_time
-        logging.info('{"elaspsed_time_local_matrix_preprocessing" : %2.4f} # Elapsed time [s]' %(build_local_matrix_time))
-
-        logging.info('Exchange local G_dict and  local e_dict')
-        t1 = time.time()
-        #G_dict = exchange_global_dict(self.course_problem.G_dict,self.obj_id,self.partitions_list)
-        logging.info('{"elaspsed_time_exchange_G_dict" : %2.4f} # Elapsed time [s]' %(time.time() - t1))
-        t1 = time.time()
-        e_dict = exchange_global_dict(self.course_problem.e_dict,self.obj_id,self.partitions_list)
-        logging.info('{"elaspsed_time_exchange_e_dict" : %2.4f} # Elapsed time [s]' %(time.time() - t1))
-
-        #self.course_problem.G_dict = G_dict
-        self.course_problem.e_dict = e_dict
-
-        logging.info('Exchange global size')
-        t1 = time.time()
-        self._exchange_global_size()
-        logging.info('{"elaspsed_time_exchange_global_size" : %2.4f} # Elapsed time [s]' %(time.time() - t1))
-
-        t1 = time.time()
-        self.assemble_cross_GGT()
-        self.GGT_dict = self.course_problem.GGT_dict
-        GGT_dict = exchange_global_dict(self.GGT_dict,self.obj_id,self.partitions_list)
-        self.course_problem.GGT_dict = GGT_dict
-        logging.info('{"elaspsed_time_assemble_GGT_dict" : %2.4f} # Elapsed time [s]' %(time.time() - t1))
-
-        t1 = time.time()
-        self.build_local_to_global_mapping()
-        logging.info('{"elaspsed_time_build_global_map": %2.4f} # Elapsed time [s]' %(time.time() - t1))
+        try:
+            restart = self.restart
+        except AttributeError:
+            restart = False
 
-        t1 = time.time()
-        GGT = self.assemble_GGT()
-        logging.info('{"elaspsed_time_assemble_GGT": %2.4f} # Elapsed time [s]' %(time.time() - t1))
+        if restart and self.load_setup_cache():
+            build_local_matrix_time = time.time() - start_time
+            logging.info('{"elaspsed_time_load_setup_cache" : %2.4f} # Elapsed time [s]' %(build_local_matrix_time))
+        else:
+            build_local_matrix_time = self.setup_coarse_problem()
+            self.save_setup_cache()
 
         t1 = time.time()
         G = self.G = G = ParallelRetangularLinearOperator(self.course_problem.G_dict,
@@ -170,19 +222,228 @@ class LocalSolverManager(SolverManager):
         except:
             pass
         
+        # telemetry records of all ranks are gathered in the first rank
+        telemetry_summary_list = MPI.COMM_WORLD.gather(telemetry.summary(),root=0)
+        telemetry.export(self.telemetry_file,comm=MPI.COMM_WORLD,root=0)
+
         elapsed_time = time.time() - start_time
         if self.obj_id == 1:
             sol_obj = Solution({}, lambda_dict, {}, rk, proj_r_hist, lambda_hist, lambda_map=self.local2global_lambda_dofs,
                                 alpha_map=self.local2global_alpha_dofs, u_map=self.local2global_primal_dofs,lambda_size=self.lambda_size,
                                 alpha_size=self.alpha_size,solver_time=elapsed_time,
-                                local_matrix_time = build_local_matrix_time, time_PCPG = elaspsed_time_PCPG, tolerance = self.tolerance,
-                                precond = self.precond_type, info_dict = info_dict)
+                                local_matrix_time = build_local_matrix_time, time_PCPG = elaspsed_time_PCPG, tolerance = self.absolute_tolerance,
+                                precond = self.precond_type, info_dict = info_dict,
+                                telemetry = aggregate(telemetry_summary_list))
 
             save_object(sol_obj,'solution.pkl')
 
         logging.info('{"serialization_time":%2.4f}' %(time.time() - t1))
         logging.info('{"Total_mpisolver_elaspsed_time":%2.4f}' %(time.time() - start_time))
         
+    def setup_coarse_problem(self):
+        ''' assemble the coarse problem G, GGT and e and the local to global maps,
+        which requires exchanges between the ranks
+
+        return
+            build_local_matrix_time : float
+                elapsed time of the local matrix preprocessing
+        '''
+        start_time = time.time()
+        self.share_node_factorization()
+        logging.info('Assembling  local G, GGT, and e')
+        self.assemble_local_G_GGT_and_e()
+        build_local_matrix_time = time.time() - start_time
+        logging.info('{"elaspsed_time_local_matrix_preprocessing" : %2.4f} # Elapsed time [s]' %(build_local_matrix_time))
+
+        logging.info('Exchange local G_dict and  local e_dict')
+        t1 = time.time()
+        #G_dict = exchange_global_dict(self.course_problem.G_dict,self.obj_id,self.partitions_list)
+        logging.info('{"elaspsed_time_exchange_G_dict" : %2.4f} # Elapsed time [s]' %(time.time() - t1))
+        t1 = time.time()
+        e_dict = exchange_global_dict(self.course_problem.e_dict,self.obj_id,self.partitions_list)
+        logging.info('{"elaspsed_time_exchange_e_dict" : %2.4f} # Elapsed time [s]' %(time.time() - t1))
+
+        #self.course_problem.G_dict = G_dict
+        self.course_problem.e_dict = e_dict
+
+        logging.info('Exchange global size')
+        t1 = time.time()
+        self._exchange_global_size()
+        logging.info('{"elaspsed_time_exchange_global_size" : %2.4f} # Elapsed time [s]' %(time.time() - t1))
+
+        t1 = time.time()
+        self.assemble_cross_GGT()
+        self.GGT_dict = self.course_problem.GGT_dict
+        t0 = telemetry.start()
+        self.course_problem.GGT_dict = self.gather_GGT_dict(self.GGT_dict)
+        telemetry.stop('coarse_setup',t0)
+        logging.info('{"elaspsed_time_assemble_GGT_dict" : %2.4f} # Elapsed time [s]' %(time.time() - t1))
+
+        t1 = time.time()
+        self.build_local_to_global_mapping()
+        logging.info('{"elaspsed_time_build_global_map": %2.4f} # Elapsed time [s]' %(time.time() - t1))
+
+        t1 = time.time()
+        if self.is_coarse_owner():
+            t0 = telemetry.start()
+            GGT = self.assemble_GGT()
+            telemetry.stop('coarse_setup',t0)
+        logging.info('{"elaspsed_time_assemble_GGT": %2.4f} # Elapsed time [s]' %(time.time() - t1))
+
+        return build_local_matrix_time
+
+    def get_coarse_strategy(self):
+        ''' coarse strategy given by the key arg coarse_strategy, one of 
+        list_of_coarse_strategies, Default = 'redundant'
+        '''
+        try:
+            coarse_strategy = self.coarse_strategy
+        except AttributeError:
+            coarse_strategy = 'redundant'
+
+        if coarse_strategy not in self.list_of_coarse_strategies:
+            raise ValueError('Coarse strategy %s is not supported, select one of %s' %(coarse_strategy,self.list_of_coarse_strategies))
+        return coarse_strategy
+
+    def get_node_comm(self):
+        ''' communicator of the ranks of the node, which share memory
+        '''
+        try:
+            return self._node_comm
+        except AttributeError:
+            self._node_comm = MPI.COMM_WORLD.Split_type(MPI.COMM_TYPE_SHARED)
+            return self._node_comm
+
+    def is_coarse_owner(self):
+        ''' True if the rank assembles and factorizes GGT, all ranks with 'redundant',
+        the first rank with 'master', the first rank of every node with 'node' and
+        no rank with 'iterative'
+        '''
+        coarse_strategy = self.get_coarse_strategy()
+        if coarse_strategy=='redundant':
+            return True
+        elif coarse_strategy=='master':
+            return MPI.COMM_WORLD.Get_rank()==0
+        elif coarse_strategy=='node':
+            return self.get_node_comm().Get_rank()==0
+        return False
+
+    def gather_GGT_dict(self,GGT_dict):
+        ''' gather the local blocks of GGT in the ranks which own the coarse problem, 
+        with 'iterative' all ranks receive the diagonal blocks of the preconditioner
+        '''
+        coarse_strategy = self.get_coarse_strategy()
+        if coarse_strategy=='redundant':
+            return exchange_global_dict(GGT_dict,self.obj_id,self.partitions_list)
+
+        elif coarse_strategy=='iterative':
+            diagonal_dict = {key : value for key, value in GGT_dict.items() if key[0]==key[1]}
+            return exchange_global_dict(diagonal_dict,self.obj_id,self.partitions_list)
+
+        elif coarse_strategy=='master':
+            global_dict = gather_global_dict(GGT_dict,MPI.COMM_WORLD)
+            return global_dict if global_dict is not None else {}
+
+        # the first ranks of the nodes gather the blocks of their node and exchange them 
+        node_dict = gather_global_dict(GGT_dict,self.get_node_comm())
+        color = 0 if node_dict is not None else MPI.UNDEFINED
+        leaders_comm = MPI.COMM_WORLD.Split(color,MPI.COMM_WORLD.Get_rank())
+        if node_dict is None:
+            return {}
+
+        global_dict = {}
+        for item in leaders_comm.allgather(node_dict):
+            global_dict.update(item)
+        leaders_comm.Free()
+        return global_dict
+
+    @property
+    def GGT_inv(self):
+        ''' coarse solver of the key arg coarse_strategy:
+
+            'redundant' : every rank factorizes GGT
+            'master' : the first rank factorizes GGT and broadcasts the coarse solutions
+            'node' : the first rank of every node factorizes GGT and broadcasts 
+                     the coarse solutions to the ranks of its node
+            'iterative' : conjugate gradient with the distributed G G^T, where the 
+                          tolerance is given by the key arg coarse_tolerance
+
+        the factorization of GGT is selected by the key arg coarse_method, see
+        CoarseProblem.compute_GGT_inv, G is distributed then 'qr' uses the Cholesky factor.
+        the setup and the solves are recorded as coarse_setup and coarse_solve in the telemetry
+        '''
+        try:
+            return self._coarse_solver
+        except AttributeError:
+            pass
+
+        t0 = telemetry.start()
+        coarse_strategy = self.get_coarse_strategy()
+        if coarse_strategy=='iterative':
+            try:
+                coarse_tolerance = self.coarse_tolerance
+            except AttributeError:
+                coarse_tolerance = 1.0E-12
+            self._coarse_solver = IterativeCoarseSolver(self.G,self.assemble_GGT_block_inverse(),tolerance=coarse_tolerance)
+        else:
+            solve = None
+            if self.is_coarse_owner():
+                solve = self.course_problem.compute_GGT_inv().dot
+            comm = {'redundant' : None, 'master' : MPI.COMM_WORLD, 'node' : self.get_node_comm()}[coarse_strategy]
+            self._coarse_solver = ParallelCoarseSolver(solve,comm)
+        telemetry.stop('coarse_setup',t0)
+        return self._coarse_solver
+
+    def assemble_GGT_block_inverse(self):
+        ''' block diagonal inverse of GGT, the preconditioner of the iterative coarse solver
+        '''
+        inverse_dict = {}
+        for (local_id, nei_id), GGT_block in self.course_problem.GGT_dict.items():
+            if local_id==nei_id and np.size(GGT_block)>0:
+                inverse_dict[local_id,nei_id] = np.linalg.inv(GGT_block)
+        return self.course_problem.assemble_block_matrix(inverse_dict,self.local2global_alpha_dofs,
+                                                         self.local2global_alpha_dofs,(self.alpha_size,self.alpha_size))
+
+    def share_node_factorization(self):
+        ''' the ranks of a node with the same local matrix share its factorization
+        through a FactorizationCache, the first of these ranks factorizes the matrix
+        and the others load the factors after a node barrier. The cache is the one 
+        given in pseudoinverse_kargs, or the folder 'factorizations' in the
+        temporary folder. Ranks with a matrix which is unique in the node do not 
+        use the cache. Sharing is disabled by share_local_matrices=False.
+
+        Only the factorization time is shared, not the memory. The factors are
+        shared through the files of the cache, not through an MPI shared memory
+        window, and every rank holds its own solver objects which are built 
+        from the loaded L and U factors, see TriangularFactors. The memory of 
+        the factors per rank is the same as without sharing.
+        '''
+        try:
+            share_local_matrices = self.share_local_matrices
+        except AttributeError:
+            share_local_matrices = True
+
+        if not share_local_matrices:
+            return
+
+        K_local = self.local_problem.K_local
+        node_comm = self.get_node_comm()
+        matrix_hash = array_hash(K_local.data,K_local.rigid_body_modes,K_local.interface_dofs)
+        hash_list = node_comm.allgather(matrix_hash)
+        if len(set(hash_list))==len(hash_list):
+            # no matrix is shared in the node, the factorizations are not written
+            return
+
+        n_shared = hash_list.count(matrix_hash)
+        if n_shared>1:
+            pseudoinverse = K_local.psudeoinverve
+            if pseudoinverse.cache is None:
+                pseudoinverse.cache = FactorizationCache('factorizations')
+            if hash_list.index(matrix_hash)==node_comm.Get_rank():
+                K_local.kernel
+        node_comm.Barrier()
+        logging.info('Local matrix shared by %i ranks of the node' %n_shared)
+
     def assemble_local_G_GGT_and_e(self):
         problem_id = self.obj_id
         local_problem = self.local_problem
@@ -298,13 +559,17 @@ class LocalSolverManager(SolverManager):
         G = self.G 
         GGT_inv = self.GGT_inv
         GT = G.T
-        return lambda r : r - GT.dot(GGT_inv.dot(G.dot(r)))
+
+        def projection(r,out=None):
+            return np.subtract(r,GT.dot(GGT_inv.dot(G.dot(r))),out=out)
+
+        return projection
 
     def compute_lambda_im(self):
         GGT_inv = self.compute_GGT_inverse()
         return  self.G.T.dot((GGT_inv).dot(self.e))
 
-    def apply_F(self, v,  external_force=False, global_exchange=False):
+    def apply_F(self, v,  external_force=False, global_exchange=False, out=None):
                
         v_dict = self.vector2localdict(v, self.global2local_lambda_dofs)
         gap_dict = self.solve_interface_gap(v_dict,external_force)
@@ -314,16 +579,16 @@ class LocalSolverManager(SolverManager):
             all_gap_dict = exchange_global_dict(gap_dict,self.obj_id,self.partitions_list)
             gap_dict.update(all_gap_dict)
 
-        d = np.zeros(self.lambda_size)
+        d = self.lambda_zeros(v,out)
         for interface_id,global_index in self.local2global_lambda_dofs.items():
             try:
                 d[global_index] += gap_dict[interface_id]
             except:
                 pass
 
-        return -d
+        return np.negative(d,out=d)
 
-    def apply_F_inv(self,v,global_exchange=False,**kwargs):
+    def apply_F_inv(self,v,global_exchange=False,out=None,**kwargs):
 
         # map array to domains dict and then solve force gap
         v_dict = self.vector2localdict(v, self.global2local_lambda_dofs)
@@ -335,7 +600,7 @@ class LocalSolverManager(SolverManager):
             gap_dict.update(all_gap_dict)
 
         # assemble vector based on dict
-        d = np.zeros(self.lambda_size)
+        d = self.lambda_zeros(v,out)
         for interface_id,global_index in self.local2global_lambda_dofs.items():
             try:
                 d[global_index] += gap_dict[interface_id]
@@ -350,11 +615,25 @@ class LocalSolverManager(SolverManager):
         '''
         return lambda v,w : pardot(v,w,self.obj_id,self.neighbors_id, self.global2local_lambda_dofs,self.partitions_list)
 
+    def global_max(self,value):
+        return MPI.COMM_WORLD.allreduce(value,op=MPI.MAX)
+
+    def get_ivdot(self):
+        ''' This function wraps the fused non-blocking parallel 
+        dot products used by the PipelinedPCPG.
+        '''
+        return lambda pairs : parivdot(pairs,self.obj_id,self.neighbors_id, self.global2local_lambda_dofs,self.partitions_list)
+
+    def get_block_vdot(self):
+        ''' This function wraps the parallel V^T W of two 2D arrays
+        with one reduction, used by the Krylov recycling.
+        '''
+        return lambda V,W : parblockdot(V,W,self.obj_id,self.neighbors_id, self.global2local_lambda_dofs,self.partitions_list)
+
     def solve_interface_gap(self,v_dict=None, external_force=False):
         local_problem = self.local_problem
         u_dict = {}
-        ui = local_problem.solve(v_dict,external_force)
-        u_dict_local = local_problem.get_interface_dict(ui)
+        u_dict_local = self.local_interface_gap(self.obj_id,local_problem,v_dict,external_force)
         u_dict.update(u_dict_local)
         for nei_id in local_problem.neighbors_id:
             nei_dict = {}
@@ -428,7 +707,11 @@ class LocalSolverManager(SolverManager):
         local_problem = self.local_problem
         problem_id = self.obj_id
         lambda_dict[problem_id] = self.vector2localdict(lambda_sol, self.global2local_lambda_dofs)
-        u_local = local_problem.solve(lambda_dict[problem_id],external_force_bool=True)
+        if self.primal_iterates is not None:
+            # carried by the dual interface algorithm, see carry_primal_iterates
+            u_local = self.primal_iterates[problem_id].copy()
+        else:
+            u_local = local_problem.solve(lambda_dict[problem_id],external_force_bool=True)
 
         if local_problem.kernel.shape[0]>0:
             alpha_dict.update(self.vector2localdict(alpha_sol, self.global2local_alpha_dofs))
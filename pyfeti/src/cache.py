@@ -0,0 +1,208 @@
+from unittest import TestCase, main
+import numpy as np
+from scipy import sparse
+import hashlib
+import logging
+import shutil
+import tempfile
+import time
+import os
+
+
+def array_hash(*args):
+    ''' sha1 hex digest of the given arrays, sparse matrices, strings
+    and numbers. Sparse matrices are hashed in canonical csc format,
+    such that the same matrix gives the same hash in any sparse format.
+    '''
+    h = hashlib.sha1()
+    for obj in args:
+        if obj is None:
+            h.update(b'None')
+        elif sparse.issparse(obj):
+            A = sparse.csc_matrix(obj,copy=True)
+            A.sum_duplicates()
+            A.sort_indices()
+            h.update(('sparse%s%s' %(A.shape,A.dtype)).encode())
+            for array in [A.indptr,A.indices,A.data]:
+                h.update(np.ascontiguousarray(array).tobytes())
+        elif isinstance(obj,(np.ndarray,list,tuple)):
+            array = np.ascontiguousarray(obj)
+            h.update(('dense%s%s' %(array.shape,array.dtype)).encode())
+            h.update(array.tobytes())
+        else:
+            h.update(repr(obj).encode())
+    return h.hexdigest()
+
+
+class FactorizationCache():
+    ''' Content-addressed on-disk cache of factorizations. Every entry is a
+    folder with one .npy file per array, such that the arrays are loaded as
+    memory maps. Sparse matrices are stored as name.data, name.indices,
+    name.indptr and name.shape arrays.
+
+    The size of the cache is bounded, when it is exceeded the least recently
+    used entries are removed. Entries are written in a temporary folder and
+    renamed, then several processes, e.g. mpi ranks, can share a cache folder.
+
+    Parameters:
+        cache_dir : str
+            folder of the cache, it is stored as an absolute path because the
+            mpi ranks run in the temporary folder of the ParallelSolverManager
+        max_size : int, Default = 2**30
+            maximum size of the cache in bytes
+        mmap : Boolean, Default = True
+            load the arrays as read-only memory maps
+    '''
+    sparse_suffixes = ['.data','.indices','.indptr','.shape']
+
+    def __init__(self,cache_dir,max_size=2**30,mmap=True):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self.mmap = mmap
+        os.makedirs(self.cache_dir,exist_ok=True)
+
+    def key(self,*args):
+        return array_hash(*args)
+
+    def entry_path(self,key):
+        return os.path.join(self.cache_dir,key)
+
+    def __contains__(self,key):
+        return os.path.isdir(self.entry_path(key))
+
+    def load(self,key):
+        ''' load the dict of arrays of the entry key and mark it as
+        recently used, return None if the entry is not in the cache
+        '''
+        path = self.entry_path(key)
+        mmap_mode = 'r' if self.mmap else None
+        try:
+            arrays = {}
+            for filename in os.listdir(path):
+                name = filename[:-len('.npy')]
+                try:
+                    arrays[name] = np.load(os.path.join(path,filename),mmap_mode=mmap_mode)
+                except ValueError:
+                    # empty arrays can not be memory mapped
+                    arrays[name] = np.load(os.path.join(path,filename))
+            os.utime(path)
+        except OSError:
+            # missing entry, or entry removed by another process
+            return None
+
+        for name in [name[:-len('.data')] for name in arrays if name.endswith('.data')]:
+            # scipy sorts the indices in place, the sparse arrays are not memory mapped
+            data, indices, indptr, shape = [np.array(arrays.pop(name + suffix)) for suffix in self.sparse_suffixes]
+            arrays[name] = sparse.csc_matrix((data,indices,indptr),shape=tuple(shape))
+
+        logging.info('Factorization %s loaded from the cache' %key)
+        return arrays
+
+    def save(self,key,arrays):
+        ''' save a dict of arrays and sparse matrices as the entry key
+        and evict the least recently used entries
+        '''
+        if key in self:
+            return
+
+        tmp_path = tempfile.mkdtemp(prefix=key + '.tmp',dir=self.cache_dir)
+        for name, array in arrays.items():
+            if sparse.issparse(array):
+                array = sparse.csc_matrix(array)
+                for suffix, value in zip(self.sparse_suffixes,[array.data,array.indices,array.indptr,np.array(array.shape)]):
+                    np.save(os.path.join(tmp_path,name + suffix + '.npy'),value)
+            else:
+                np.save(os.path.join(tmp_path,name + '.npy'),np.asarray(array))
+
+        try:
+            os.rename(tmp_path,self.entry_path(key))
+        except OSError:
+            # the entry was saved by another process
+            shutil.rmtree(tmp_path,ignore_errors=True)
+
+        self.evict()
+
+    def entries(self):
+        ''' list of (last access time, size in bytes, key) of the entries
+        '''
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            path = self.entry_path(key)
+            if '.tmp' in key or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path,filename)) for filename in os.listdir(path))
+                entries.append((os.path.getmtime(path),size,key))
+            except OSError:
+                pass
+        return entries
+
+    @property
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        ''' remove the least recently used entries until the size
+        of the cache is smaller than max_size
+        '''
+        if self.max_size is None:
+            return
+        entries = sorted(self.entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total_size<=self.max_size:
+                break
+            shutil.rmtree(self.entry_path(key),ignore_errors=True)
+            total_size -= size
+            logging.info('Factorization %s evicted from the cache' %key)
+
+    def clear(self):
+        for _, _, key in self.entries():
+            shutil.rmtree(self.entry_path(key),ignore_errors=True)
+
+
+class  Test_cache(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir,ignore_errors=True)
+
+    def test_array_hash(self):
+        A = sparse.random(20,20,density=0.2,random_state=0)
+        self.assertEqual(array_hash(A.tocsr(),'svd'),array_hash(A.tocsc(),'svd'))
+        self.assertNotEqual(array_hash(A,'svd'),array_hash(A,'spkernel'))
+        self.assertNotEqual(array_hash(A),array_hash(2.0*A))
+        self.assertEqual(array_hash(A.toarray()),array_hash(A.toarray()))
+
+    def test_save_load_and_evict(self):
+        cache = FactorizationCache(self.cache_dir,max_size=None)
+        A = sparse.random(20,20,density=0.2,random_state=0)
+        R = np.ones((20,3))
+        cache.save('a',{'L' : A, 'R' : R, 'idf' : np.array([1,2])})
+        self.assertTrue('a' in cache)
+        arrays = cache.load('a')
+        self.assertTrue(isinstance(arrays['R'],np.memmap))
+        np.testing.assert_array_equal(arrays['L'].toarray(),A.toarray())
+        np.testing.assert_array_equal(arrays['R'],R)
+        self.assertEqual(arrays['idf'].tolist(),[1,2])
+        self.assertIsNone(cache.load('b'))
+
+        # the least recently used entry is evicted
+        cache.save('empty',{'R' : np.array([])})
+        self.assertEqual(cache.load('empty')['R'].size,0)
+        cache.save('b',{'R' : R})
+        cache.save('c',{'R' : R})
+        os.utime(cache.entry_path('a'),(time.time()-10,time.time()-10))
+        os.utime(cache.entry_path('b'),(time.time()-20,time.time()-20))
+        cache.max_size = cache.size - 1
+        cache.evict()
+        self.assertFalse('b' in cache)
+        self.assertTrue('a' in cache and 'c' in cache)
+
+        cache.clear()
+        self.assertEqual(cache.entries(),[])
+
+
+if __name__ == '__main__':
+    main()
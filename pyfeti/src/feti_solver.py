@@ -11,14 +11,18 @@ import logging
 import time
 import subprocess
 import shutil
+import copy
 
 sys.path.append('../..')
 from pyfeti.src.utils import OrderedSet, Get_dofs, save_object, load_object, pyfeti_dir, MPILauncher
-from pyfeti.src.linalg import Matrix, Vector, elimination_matrix_from_map_dofs, \
+from pyfeti.src.linalg import Matrix, Vector, SchurFactors, elimination_matrix_from_map_dofs, \
                               expansion_matrix_from_map_dofs, ProjLinearSys, ProjPrecondLinearSys, \
-                              vector2localdict
+                              vector2localdict, get_trailing_shape, coldot, blockdot, ivdot, block_coo_matrix, \
+                              select_fixing_dofs, spkernel
+from pyfeti.src.cache import array_hash
 
 from pyfeti.src import solvers
+from pyfeti.src.telemetry import telemetry, aggregate
 
 
 # geting path of MPI executable
@@ -42,8 +46,24 @@ except:
 
 class FETIsolver():
     def __init__(self,K_dict,B_dict,f_dict,**kwargs):
+        ''' FETI solver interface
+
+        Parameters:
+            K_dict : dict
+                dict with local stiffness matrices
+            B_dict : dict
+                dict with dicts of local B matrices
+            f_dict : dict or list
+                dict with local force vectors or a list of f_dicts, in the last case
+                the multiple right hand sides are solved together by the Block PCPG
+                and solve returns a list of Solution objects
+        '''
         self.K_dict = K_dict
         self.B_dict = B_dict
+        self.n_rhs = None
+        if isinstance(f_dict,(list,tuple)):
+            self.n_rhs = len(f_dict)
+            f_dict = stack_f_dict_list(f_dict)
         self.f_dict = f_dict
         self.x_dict = None
         self.lambda_dict = None
@@ -62,37 +82,123 @@ class FETIsolver():
 class SerialFETIsolver(FETIsolver):
     def __init__(self,K_dict,B_dict,f_dict,**kwargs):
         super().__init__(K_dict,B_dict,f_dict,**kwargs)
-        self.manager = SerialSolverManager(self.K_dict,self.B_dict,self.f_dict,**kwargs) 
+        self.manager = self.create_manager(**kwargs)
+        self.is_setup = False
+        self.setup_time = None
+
+    def create_manager(self,**kwargs):
+        return SerialSolverManager(self.K_dict,self.B_dict,self.f_dict,**kwargs) 
+
+    def setup(self):
+        ''' compute everything which does not depend on the loads, the local
+        kernels (and the local factorizations), G, GGT, the GGT factorization
+        and the local to global maps. It is called by the first solve, further 
+        solves with new loads reuse it.
+        '''
+        manager = self.manager
+        start_time = time.time()
+        manager.assemble_local_G_GGT_and_e()
+        manager.assemble_cross_GGT()
+        manager.build_local_to_global_mapping()
+        manager.assemble_G()
+        manager.assemble_GGT()
+        manager.GGT_inv # coarse factorization
+        self.setup_time = time.time() - start_time
+        self.is_setup = True
         
-    def solve(self):
+    def solve(self,f_dict=None,lambda0=None):
+       ''' solve the FETI problem
+
+       Parameters:
+            f_dict : dict or list, Default = None
+                new local forces, see FETIsolver. If None the forces of the 
+                previous solve are used
+            lambda0 : np.array, Default = None
+                initial lambda for a warm start, e.g. Solution.interface_lambda
+                of a previous solve
+       
+       return 
+            sol_obj : Solution or list of Solution objects
+       '''
        manager = self.manager
+       telemetry.reset()
 
-       start_time = time.time()
-       manager.assemble_local_G_GGT_and_e()
-       manager.assemble_cross_GGT()
-       manager.build_local_to_global_mapping()
-       build_local_matrix_time = time.time() - start_time
+       if not self.is_setup:
+           self.setup()
+
+       if f_dict is not None:
+           self.update_forces(f_dict)
 
-       G = manager.assemble_G()
-       GGT = manager.assemble_GGT()
        e = manager.assemble_e()
        
        start_time = time.time()
-       lambda_sol,alpha_sol, rk, proj_r_hist, lambda_hist, info_dict = manager.solve_dual_interface_problem()
+       lambda_sol,alpha_sol, rk, proj_r_hist, lambda_hist, info_dict = manager.solve_dual_interface_problem(lambda_init=lambda0)
        elaspsed_time_PCPG = time.time() - start_time
 
        u_dict, lambda_dict, alpha_dict = manager.assemble_solution_dict(lambda_sol,alpha_sol)
 
        elapsed_time = time.time() - start_time
-       return Solution(u_dict, lambda_dict, alpha_dict,rk, proj_r_hist, lambda_hist,
+       sol_obj = Solution(u_dict, lambda_dict, alpha_dict,rk, proj_r_hist, lambda_hist,
                        lambda_map=self.manager.local2global_lambda_dofs,alpha_map=self.manager.local2global_alpha_dofs,
                        u_map=self.manager.local2global_primal_dofs,lambda_size=self.manager.lambda_size,
                        alpha_size=self.manager.alpha_size,
-                       solver_time=elapsed_time,local_matrix_time = build_local_matrix_time, 
-                       time_PCPG = elaspsed_time_PCPG)
+                       solver_time=elapsed_time,local_matrix_time = self.setup_time, 
+                       time_PCPG = elaspsed_time_PCPG, info_dict=info_dict,
+                       telemetry=aggregate([telemetry.summary()]))
+
+       try:
+           telemetry.export(self.telemetry_file)
+       except AttributeError:
+           pass
+
+       if self.n_rhs is not None:
+           return sol_obj.split()
+       return sol_obj
+
+    def update_forces(self,f_dict):
+        ''' set new local forces, a list of f_dicts is solved
+        with multiple right hand sides
+        '''
+        self.n_rhs = None
+        if isinstance(f_dict,(list,tuple)):
+            self.n_rhs = len(f_dict)
+            f_dict = stack_f_dict_list(f_dict)
+        self.f_dict = f_dict
+        self.manager.update_forces(f_dict)
         
+class SerialFETIDPsolver(SerialFETIsolver):
+    ''' serial FETI-DP solver, where the crosspoint dofs are primal unknowns,
+    see FETIDPSolverManager. The solutions have no alphas.
+    '''
+    def create_manager(self,**kwargs):
+        return FETIDPSolverManager(self.K_dict,self.B_dict,self.f_dict,**kwargs)
+
+    def setup(self):
+        ''' compute the factorization of the primal coarse problem and the 
+        local to global maps, the local factorizations are computed by the
+        manager with the selection of the primal dofs
+        '''
+        manager = self.manager
+        start_time = time.time()
+        manager.build_local_to_global_mapping()
+        manager.GGT_inv # coarse factorization
+        self.setup_time = time.time() - start_time
+        self.is_setup = True
+
+
 class SolverManager():
-    def __init__(self,K_dict,B_dict,f_dict,pseudoinverse_kargs={'method':'svd','tolerance':1.0E-8},dual_interface_algorithm='PCPG',**kwargs):
+    # optional key args forwarded to the dual interface algorithm
+    dual_interface_kwargs_list = ['full_reorthogonalization','max_stored_directions','directions_memory_budget']
+    # candidates of precond_type='auto', see select_preconditioner
+    list_of_preconditioners = ['Lumped','Dirichlet','LumpedDirichlet','SuperLumped']
+    # algorithms which return the residual d - F lambda_ker carried by their recurrences
+    residual_algorithms = ['PCPG','WorkspacePCPG','BlockPCPG']
+    # algorithms which support the primal_update callback, see carry_primal_iterates
+    primal_update_algorithms = ['PCPG','WorkspacePCPG']
+    # algorithms whose multiple right hand sides are solved by the BlockPCPG
+    block_algorithms = ['PCPG','WorkspacePCPG','PipelinedPCPG']
+
+    def __init__(self,K_dict,B_dict,f_dict,pseudoinverse_kargs={'method':'spkernel','tolerance':1.0E-8},dual_interface_algorithm='PCPG',**kwargs):
         self.local_problem_dict = {}
         self.course_problem = CoarseProblem()
         self.local2global_lambda_dofs = {}
@@ -117,27 +223,116 @@ class SolverManager():
         self.pseudoinverse_kargs = pseudoinverse_kargs
         self.dual_interface_algorithm = dual_interface_algorithm
         self.is_local_G_GGT_and_e_computed = False
+        self.last_local_solution = {}
+        self.primal_iterates = None
         
         # transform key args in object variables
         self.__dict__.update(kwargs)
         self.kwargs = kwargs
+        if 'coarse_method' in kwargs:
+            self.course_problem.coarse_method = kwargs['coarse_method']
 
         self._create_local_problems(K_dict,B_dict,f_dict)
         
     @property
     def GGT_inv(self):
-        return self.course_problem.compute_GGT_inv()
+        return self.course_problem.compute_GGT_inv(G=self.G)
+
+    @property
+    def rhs_shape(self):
+        ''' trailing shape of the local forces, () for a single 
+        right hand side and (n_rhs,) for a block of right hand sides
+        '''
+        local_problem = self.local_problem_dict[self.local_problem_id_list[0]]
+        return local_problem.f_local.data.shape[1:]
 
     def _create_local_problems(self,K_dict,B_dict,f_dict):
         
+        shared_matrix_dict = {}
         for key, obj in K_dict.items():
             B_local_dict = B_dict[key]
             self.local_problem_id_list.append(key)
-            self.local_problem_dict[key] = LocalProblem(obj,B_local_dict,f_dict[key],id=key,pseudoinverse_kargs=self.pseudoinverse_kargs)
+            K_local = self.get_shared_matrix(key,obj,shared_matrix_dict,B_local_dict)
+            self.local_problem_dict[key] = LocalProblem(K_local,B_local_dict,f_dict[key],id=key,pseudoinverse_kargs=self.pseudoinverse_kargs,
+                                                        **self.get_rigid_body_kwargs(key),**self.get_local_operator_kwargs())
             for interface_id, B in B_local_dict.items():
                 self.local_lambda_length_dict[interface_id] = B.shape[0]
         
         self.local_problem_id_list.sort()
+        logging.info('%i local matrices shared by %i local problems' %(len(shared_matrix_dict),len(K_dict)))
+
+    def get_shared_matrix(self,key,K,shared_matrix_dict,B_local_dict={}):
+        ''' return the Matrix of the local problem key, local problems with 
+        the same matrix share one Matrix object, then its kernel and
+        factorization are computed once. The matrices are identified by the
+        optional key arg matrix_tags, a dict with a tag per local problem, or
+        by the hash of the matrix. Sharing is disabled by share_local_matrices=False.
+
+        Parameters:
+            key : int
+                local problem id
+            K : np.array or sparse matrix
+                local matrix
+            shared_matrix_dict : dict
+                dict with the tags and the shared Matrix objects, which is updated
+            B_local_dict : dict, Default = {}
+                local B matrices, the 'schur' pseudoinverse method only shares 
+                matrices with the same interface dofs
+
+        return 
+            K_local : Matrix or the given K if sharing is disabled
+        '''
+        try:
+            share_local_matrices = self.share_local_matrices
+        except AttributeError:
+            share_local_matrices = True
+
+        if not share_local_matrices or isinstance(K,Matrix):
+            return K
+
+        rigid_body_kwargs = self.get_rigid_body_kwargs(key)
+        try:
+            tag = self.matrix_tags[key]
+        except (AttributeError, KeyError):
+            dof_map = rigid_body_kwargs.get('dof_map')
+            tag = array_hash(K,rigid_body_kwargs.get('coordinates'),getattr(dof_map,'values',dof_map))
+
+        if self.pseudoinverse_kargs.get('method')=='schur':
+            interface_dofs = set()
+            for B in B_local_dict.values():
+                interface_dofs.update(B.nonzero()[1])
+            tag = (tag, array_hash(sorted(interface_dofs)))
+
+        if tag not in shared_matrix_dict:
+            if not isinstance(K,csc_matrix):
+                K = sparse.csc_matrix(K)
+            shared_matrix_dict[tag] = Matrix(K,pseudoinverse_kargs=self.pseudoinverse_kargs,**rigid_body_kwargs)
+        return shared_matrix_dict[tag]
+
+    def get_rigid_body_kwargs(self,key):
+        ''' nodal coordinates and dof map of the local problem key given by the
+        optional key args coordinates_dict and dof_map_dict. The kernels of
+        local problems with coordinates are built from the rigid body modes.
+        '''
+        rigid_body_kwargs = {}
+        for kwarg, dict_name in [('coordinates','coordinates_dict'),('dof_map','dof_map_dict')]:
+            try:
+                rigid_body_kwargs[kwarg] = getattr(self,dict_name)[key]
+            except (AttributeError, KeyError):
+                pass
+        return rigid_body_kwargs
+
+    def get_local_operator_kwargs(self):
+        ''' optional key args local_operator, expected_iterations and dense_schur 
+        of the local problems, see LocalProblem
+        '''
+        local_operator_kwargs = {}
+        for kwarg in ['local_operator','expected_iterations','dense_schur']:
+            try:
+                local_operator_kwargs[kwarg] = getattr(self,kwarg)
+            except AttributeError:
+                pass
+        return local_operator_kwargs
 
     def dict2array(self,A_dict):
         ''' This function transform a local dictionary 
@@ -207,6 +402,20 @@ class SolverManager():
         
         self.is_local_G_GGT_and_e_computed = True
 
+    def update_forces(self,f_dict):
+        ''' replace the local forces and the coarse right hand side e_i = -R_i^T f_i,
+        the local factorizations, kernels, G and GGT are kept
+        '''
+        for problem_id, local_problem in self.local_problem_dict.items():
+            f_local = f_dict[problem_id]
+            if not isinstance(f_local,Vector):
+                f_local = Vector(f_local)
+            local_problem.f_local = f_local
+            R = local_problem.get_kernel()
+            if R.shape[0]>0:
+                self.e_dict[problem_id] = -R.T.dot(f_local.data)
+        self.course_problem.update_e_dict(self.e_dict)
+
     def assemble_cross_GGT(self):
         GGT_local_dict = {}
         for (local_i, nei_i) , Gi in self.course_problem.G_dict.items():
@@ -221,7 +430,7 @@ class SolverManager():
                     
     def assemble_e(self):
         try:
-            self.e = self.course_problem.assemble_e(self.local2global_alpha_dofs,self.alpha_size)
+            self.e = self.course_problem.assemble_e(self.local2global_alpha_dofs,(self.alpha_size,) + self.rhs_shape)
             return  self.e
         except:
             raise('Build local to global mapping before calling this function')
@@ -244,22 +453,62 @@ class SolverManager():
         return  self.G.T.dot(self.GGT_inv.dot(self.e))
         
     def get_vdot(self):
-        return lambda v,w : np.dot(v,w)
+        return coldot
+
+    def get_ivdot(self):
+        return ivdot
+
+    def get_block_vdot(self):
+        return blockdot
 
     def get_projection(self):
         G = self.G
         GGT_inv = self.GGT_inv
+        Q = self.course_problem.Q
+
+        if Q is not None:
+            # orthonormal basis of the range of G.T, see CoarseProblem.compute_GGT_inv
+            def projection(r,out=None):
+                return np.subtract(r,Q.dot(Q.T.dot(r)),out=out)
+        else:
+            def projection(r,out=None):
+                return np.subtract(r,G.T.dot(GGT_inv.dot(G.dot(r))),out=out)
+
+        return projection
 
-        return lambda r : r - G.T.dot(GGT_inv.dot(G.dot(r)))
+    def lambda_zeros(self,v,out=None):
+        ''' zero lambda array with the column shape of v,
+        the caller-provided buffer out is used if given
+        '''
+        if out is None:
+            return np.zeros((self.lambda_size,) + np.shape(v)[1:])
+        out.fill(0.0)
+        return out
+
+    def local_interface_gap(self,problem_id,local_problem,v_dict=None,external_force=False):
+        ''' local interface displacements B_i u_i, with u_i = K_i^+ (f_i - B_i^T v).
+        The explicit local operator F_i is applied if the local solution
+        is not needed, i.e. without external forces and primal iterates
+        '''
+        if v_dict is not None and not external_force and self.primal_iterates is None \
+           and local_problem.use_explicit_operator():
+            return local_problem.apply_local_F(v_dict)
+
+        u = local_problem.solve(v_dict,external_force)
+        self.last_local_solution[problem_id] = u
+        return local_problem.get_interface_dict(u)
 
     def solve_interface_gap(self,v_dict=None, external_force=False):
         u_dict = {}
         for problem_id, local_problem in self.local_problem_dict.items():
-            u = local_problem.solve(v_dict,external_force)
-            u_dict_local = local_problem.get_interface_dict(u)
+            u_dict_local = self.local_interface_gap(problem_id,local_problem,v_dict,external_force)
             u_dict.update(u_dict_local)
 
-        # compute gap
+        return self.combine_interface_gap(u_dict)
+
+    def combine_interface_gap(self,u_dict):
+        ''' gap of the local interface displacements u_dict[local_id,nei_id]
+        '''
         gap_dict = {}
         for interface_id in u_dict:
             local_id, nei_id = interface_id
@@ -296,32 +545,35 @@ class SolverManager():
 
         return f_dict
 
-    def solve_dual_interface_problem(self,algorithm=None):
-        
+    def solve_dual_interface_problem(self,algorithm=None,lambda_init=None):
+        ''' solve the dual interface problem with lambda = lambda_im + lambda_ker,
+        where lambda_ker is computed by the dual interface algorithm
+
+        Parameters:
+            algorithm : str, Default = None
+                name of the function in solvers, if None self.dual_interface_algorithm
+            lambda_init : np.array, Default = None
+                initial lambda, e.g. the solution of a previous load (warm start).
+                The iterations start from lambda_ker0 = P(lambda_init - lambda_im)
+        '''
         if algorithm is None:
             algorithm = self.dual_interface_algorithm
 
+        try:
+            # iterative coarse solvers count the iterations of this solve
+            self.GGT_inv.reset()
+        except AttributeError:
+            pass
+
         logging.info('Solving lambda image')
         t1 = time.time()
         lambda_im = self.compute_lambda_im()
         logging.info('elapsed_time_lambda_im = %2.4f' %(time.time() - t1) )
 
         Projection_action = self.get_projection()
-        F_action = lambda lambda_ker : self.apply_F(lambda_ker)
+        F_action = lambda lambda_ker, out=None : self.apply_F(lambda_ker,out=out)
         vdot = self.get_vdot()
 
-        Precondicioner_action = None
-        try:
-            precond_type = self.precond_type
-            if self.precond_type is not None:
-                Precondicioner_action = lambda gap_u : self.apply_F_inv(gap_u,precond_type=precond_type )
-                logging.info('Preconditioner type = %s' %precond_type)
-            else:
-                logging.info('Preconditioner type = Identity')
-        except:
-            self.precond_type = None
-            
-
         logging.info('Computing global residual')
         t1 = time.time()
         residual = -self.apply_F(lambda_im, external_force=True,global_exchange=False)
@@ -329,57 +581,407 @@ class SolverManager():
         t1 = time.time()
         logging.info('{"elaspsed_global_residual" : %2.2e} # Elapsed time [s]' %(time.time() - t1))
 
-        logging.info('Dual Interface algorithm = %s' %algorithm)
-        method_to_call = getattr(solvers, algorithm)
+        if residual.ndim>1 and algorithm!='BlockPCPG':
+            # multiple right hand sides are solved together
+            if algorithm not in self.block_algorithms:
+                raise ValueError('Multiple right hand sides are not supported by %s, please select one of %s' 
+                                 %(algorithm,self.block_algorithms + ['BlockPCPG']))
+            if algorithm!='PCPG':
+                logging.warning('Multiple right hand sides are solved by the BlockPCPG instead of the %s' %algorithm)
+            algorithm = 'BlockPCPG'
+
+        self.primal_iterates = None
+        if self.get_carry_primal_iterates() and algorithm in self.primal_update_algorithms:
+            # local solutions of lambda_im with the external forces
+            self.primal_iterates = {problem_id : u.copy() for problem_id, u in self.last_local_solution.items()}
 
         try:
-            self.tolerance = norm_d*self.tolerance 
+            # self.tolerance is relative to the norm of the residual and is kept for the next solves
+            self.absolute_tolerance = norm_d*self.tolerance 
         except:
-            self.tolerance = None # using default tolerance of the choosen interface algorithm
+            self.absolute_tolerance = None # using default tolerance of the choosen interface algorithm
            
         try:
             max_int = self.max_int
         except:
             max_int = None # using default max_int of the choosen interface algorithm
 
-        lambda_ker, rk, proj_r_hist, lambda_hist, info_dict = method_to_call(F_action,residual,
+        lambda_ker0 = None
+        residual_ker = residual
+        if lambda_init is not None:
+            # the algorithm computes the correction of lambda_ker0 with the updated residual
+            lambda_ker0 = Projection_action(lambda_init - lambda_im)
+            residual_ker = residual - F_action(lambda_ker0)
+            if self.primal_iterates is not None:
+                self.update_primal_iterates(1.0)
+
+        precond_probe = None
+        try:
+            if self.precond_type=='auto':
+                precond_probe = self.select_preconditioner(F_action,residual_ker,Projection_action,vdot)
+        except AttributeError:
+            self.precond_type = None
+
+        Precondicioner_action = None
+        precond_type = self.precond_type
+        if precond_type is not None:
+            Precondicioner_action = self.get_precondicioner_action(precond_type)
+            logging.info('Preconditioner type = %s' %precond_type)
+        else:
+            logging.info('Preconditioner type = Identity')
+
+        logging.info('Dual Interface algorithm = %s' %algorithm)
+        method_to_call = getattr(solvers, algorithm)
+
+        dual_interface_kwargs = self.get_dual_interface_kwargs()
+        if algorithm=='PipelinedPCPG':
+            # fused and non-blocking dot products
+            dual_interface_kwargs['ivdot'] = self.get_ivdot()
+        recycle_store = self.get_recycle_store()
+        if recycle_store is not None:
+            dual_interface_kwargs['recycle_store'] = recycle_store
+            dual_interface_kwargs['block_vdot'] = self.get_block_vdot()
+        if self.primal_iterates is not None:
+            dual_interface_kwargs['primal_update'] = self.update_primal_iterates
+        if Precondicioner_action is not None and self.get_combined_projection():
+            if algorithm=='PCPG':
+                dual_interface_kwargs['ProjectionPrecond_action'] = self.get_projected_preconditioner(precond_type)
+            else:
+                logging.warning('The combined projection is only supported by the PCPG, %s projects twice per iteration' %algorithm)
+        checkpoint = self.get_checkpoint()
+        if checkpoint is not None:
+            if algorithm=='PCPG':
+                dual_interface_kwargs['checkpoint'] = checkpoint
+            else:
+                logging.warning('Checkpoint is only supported by the PCPG, %s will not be checkpointed' %algorithm)
+
+        lambda_ker, rk, proj_r_hist, lambda_hist, info_dict = method_to_call(F_action,residual_ker,
                                                                              Projection_action=Projection_action,
                                                                              lambda_init=None,
                                                                              Precondicioner_action=Precondicioner_action,
-                                                                             tolerance=self.tolerance,
+                                                                             tolerance=self.absolute_tolerance,
                                                                              max_int=max_int,
-                                                                             vdot=vdot)
+                                                                             vdot=vdot,
+                                                                             **dual_interface_kwargs)
+
+        if recycle_store is not None:
+            self.save_recycle_store()
+
+        if precond_probe is not None:
+            info_dict['precond_probe'] = precond_probe
+
+        try:
+            info_dict['coarse_iterations'] = list(self.GGT_inv.iteration_history)
+        except AttributeError:
+            pass
+
+        if lambda_ker0 is not None:
+            lambda_ker = lambda_ker0 + lambda_ker
+
+        if 'restart_iteration' in info_dict or 'recycled_directions' in info_dict:
+            # lambda was not only updated by the F actions of this solve
+            self.primal_iterates = None
 
         lambda_sol = lambda_im + lambda_ker
-        
+        alpha_sol = self.compute_alpha(algorithm,rk,residual,lambda_ker)
+
+        return lambda_sol,alpha_sol, rk, proj_r_hist, lambda_hist, info_dict
+
+    def compute_alpha(self,algorithm,rk,residual,lambda_ker):
+        ''' alpha = (G G^T)^-1 G (d - F lambda_ker)
+        '''
         G = self.G
         GGT_inv = self.GGT_inv
+        if algorithm in self.residual_algorithms:
+            # rk = d - F lambda_ker, no extra F action is needed
+            return GGT_inv.dot(G.dot(rk))
+        
         Fdot_lambda_ker = self.apply_F(lambda_ker, external_force=False,global_exchange=False)
-        alpha_sol = GGT_inv.dot(G.dot(residual - Fdot_lambda_ker))
+        return GGT_inv.dot(G.dot(residual - Fdot_lambda_ker))
 
-        return lambda_sol,alpha_sol, rk, proj_r_hist, lambda_hist, info_dict
+    def get_carry_primal_iterates(self):
+        ''' the local primal solutions are carried through the PCPG iterations 
+        with the key arg carry_primal_iterates=True, such that the displacements
+        are assembled without solving the local problems again
+        '''
+        try:
+            return self.carry_primal_iterates
+        except AttributeError:
+            return False
+
+    def get_combined_projection(self):
+        ''' the two projections of a preconditioned PCPG iteration share one 
+        coarse reduction with the key arg combined_projection=True, see 
+        get_projected_preconditioner. The setup applies the preconditioner to 
+        the alpha_size columns of G^T, in chunks of projected_precond_chunk_size
+        (Default = 64) columns, and stores the sparse M G^T and the dense 
+        alpha_size x alpha_size matrix H
+        '''
+        try:
+            return self.combined_projection
+        except AttributeError:
+            return False
+
+    def get_projected_preconditioner(self,precond_type):
+        ''' return the action r -> (P r, P M P r), where M is the preconditioner 
+        precond_type. With Z = M G^T and H = (G G^T)^-1 G Z:
+
+            a = (G G^T)^-1 G r,  c = (G G^T)^-1 G M r
+            P r = r - G^T a
+            P M P r = M r - Z a - G^T (c - H a)
+
+        G is applied to the block [r, M r] and G^T to the block [a, c - H a], then
+        every iteration needs one coarse reduction and one coarse solve with two
+        columns instead of two of each. Z and H are computed once per preconditioner
+        with alpha_size preconditioner columns, which are applied in chunks of
+        projected_precond_chunk_size columns, such that the dense memory is 
+        lambda_size x chunk size, and Z is stored as a sparse matrix.
+        '''
+        try:
+            if self._projected_preconditioner[0]==precond_type:
+                return self._projected_preconditioner[1]
+        except AttributeError:
+            pass
+
+        G = self.G
+        GT = G.T
+        GGT_inv = self.GGT_inv
+        M = self.get_precondicioner_action(precond_type)
+
+        try:
+            chunk_size = self.projected_precond_chunk_size
+        except AttributeError:
+            chunk_size = 64
+
+        t0 = telemetry.start()
+        Z_list = []
+        H_list = []
+        for start in range(0,self.alpha_size,chunk_size):
+            stop = min(start + chunk_size,self.alpha_size)
+            E = np.zeros((self.alpha_size,stop - start))
+            E[np.arange(start,stop),np.arange(stop - start)] = 1.0
+            Z_chunk = M(GT.dot(E))
+            H_list.append(GGT_inv.dot(G.dot(Z_chunk)))
+            Z_list.append(sparse.csr_matrix(Z_chunk))
+        Z = sparse.hstack(Z_list,format='csr')
+        H = np.hstack(H_list)
+        telemetry.stop('coarse_setup',t0)
+
+        def projected_preconditioner(r):
+            Mr = M(r)
+            a, c = GGT_inv.dot(G.dot(np.column_stack([r,Mr]))).T
+            w, y = GT.dot(np.column_stack([a,c - H.dot(a)])).T
+            return r - w, Mr - Z.dot(a) - y
+
+        self._projected_preconditioner = (precond_type,projected_preconditioner)
+        return projected_preconditioner
+
+    def update_primal_iterates(self,alpha_k):
+        ''' u_i += alpha_k * u_i(pk), where u_i(pk) is the local solution
+        of the last F action
+        '''
+        for problem_id, u in self.last_local_solution.items():
+            self.primal_iterates[problem_id] += alpha_k*u
+
+    def get_precondicioner_action(self,precond_type):
+        return lambda gap_u, out=None : self.apply_F_inv(gap_u,precond_type=precond_type,out=out)
+
+    def global_max(self,value):
+        ''' max of a value over the processes sharing the solve,
+        such that all of them take the same decision
+        '''
+        return value
+
+    def global_min(self,value):
+        return -self.global_max(-value)
+
+    def select_preconditioner(self,F_action,residual,Projection_action,vdot):
+        ''' select the preconditioner with the smallest predicted solve time.
+        Each candidate of list_of_preconditioners runs precond_probe_iterations
+        iterations of the PCPG, which give a condition number estimate and a
+        predicted number of iterations from the Lanczos coefficients, see
+        solvers.lanczos_spectrum_estimate. The predicted time is the predicted
+        number of iterations times the mean time of a probe iteration.
+
+        Candidates and probe length are set with the key args
+            list_of_preconditioners : list
+            precond_probe_iterations : int, Default = 10
+
+        return
+            precond_probe : dict
+                dict with the precond_type as key and a dict with condition_number,
+                predicted_iterations, iteration_time and predicted_time as value
+        '''
+        try:
+            probe_iterations = self.precond_probe_iterations
+        except AttributeError:
+            probe_iterations = 10
+
+        if residual.ndim>1:
+            # the first right hand side is enough to estimate the spectrum
+            residual = residual[:,0]
+
+        precond_probe = {}
+        for precond_type in self.list_of_preconditioners:
+            t1 = time.time()
+            lambda_ker, rk, proj_r_hist, lambda_hist, info_dict = solvers.PCPG(F_action,residual,
+                                                                              Projection_action=Projection_action,
+                                                                              Precondicioner_action=self.get_precondicioner_action(precond_type),
+                                                                              tolerance=self.absolute_tolerance,
+                                                                              max_int=probe_iterations,
+                                                                              vdot=vdot)
+            iterations = max(info_dict['PCPG_iterations'],1)
+            iteration_time = self.global_max((time.time() - t1)/iterations)
+            predicted = info_dict.get('predicted_iterations',np.inf)
+            precond_probe[precond_type] = {'condition_number' : info_dict.get('condition_number',np.inf),
+                                           'predicted_iterations' : predicted,
+                                           'iteration_time' : iteration_time,
+                                           'predicted_time' : predicted*iteration_time}
+            logging.info('Preconditioner probe %s : condition number = %2.4e, predicted iterations = %s',
+                         precond_type,precond_probe[precond_type]['condition_number'],predicted)
+
+        self.precond_type = min(precond_probe, key=lambda precond_type : precond_probe[precond_type]['predicted_time'])
+        return precond_probe
+
+    def get_dual_interface_kwargs(self):
+        ''' collect the optional arguments of the dual interface algorithm
+        which were given as key args to the solver manager, e.g.
+        full_reorthogonalization=True
+        '''
+        kwargs = {}
+        for key in self.dual_interface_kwargs_list:
+            try:
+                kwargs[key] = getattr(self,key)
+            except AttributeError:
+                pass
+        return kwargs
+
+    def get_checkpoint_file(self):
+        try:
+            return self.checkpoint_file
+        except AttributeError:
+            return None
+
+    def get_checkpoint(self):
+        ''' get the checkpoint of the PCPG state. Checkpointing is enabled 
+        with the key arg checkpoint_file and controlled by:
+
+            checkpoint_interval : int, Default = 10
+                number of iterations between two checkpoints
+            restart : Boolean, Default = False
+                if True the PCPG is resumed from the last checkpoint, the
+                problem must be the same of the checkpointed solve
+
+        The restart iteration is the last iteration checkpointed by all processes,
+        if one of them has no checkpoint of it the solve starts from scratch
+        '''
+        checkpoint_file = self.get_checkpoint_file()
+        if checkpoint_file is None:
+            return None
+
+        try:
+            interval = self.checkpoint_interval
+        except AttributeError:
+            interval = 10
+
+        checkpoint = solvers.PCPGCheckpoint(checkpoint_file,interval=interval)
+        try:
+            restart = self.restart
+        except AttributeError:
+            restart = False
+
+        if restart:
+            iteration = self.global_min(checkpoint.latest_iteration())
+            restored = iteration>=0 and checkpoint.restore(iteration) is not None
+            if self.global_min(int(restored))==0:
+                logging.warning('No consistent checkpoint in %s, the PCPG starts from scratch' %checkpoint_file)
+                checkpoint.state = None
+            else:
+                logging.info('Restarting from the checkpoint of iteration %i' %iteration)
+
+        return checkpoint
+
+    def get_recycle_file(self):
+        try:
+            return self.recycle_file
+        except AttributeError:
+            return None
+
+    def get_recycle_store(self):
+        ''' get the Krylov recycling store of the solver manager. 
+        Recycling is enabled with one of the key args:
+
+            recycle_store : solvers.KrylovRecycleStore
+                store object shared between sequential solves
+            recycle_capacity : int
+                max number of stored directions of a new store
+            recycle_file : str
+                file to load the store from, if it exists, and to save it after the solve
+
+        and the optional key args recycle_eviction ('fifo' or 'lru') and recycle_mode 
+        ('deflation' or 'initial_guess')
+        
+        return
+            solvers.KrylovRecycleStore or None if recycling is not enabled
+        '''
+        try:
+            if isinstance(self.recycle_store,solvers.KrylovRecycleStore):
+                return self.recycle_store
+        except AttributeError:
+            pass
+
+        recycle_file = self.get_recycle_file()
+        try:
+            capacity = self.recycle_capacity
+        except AttributeError:
+            if recycle_file is None:
+                return None
+            capacity = 100
+
+        options = {'capacity' : capacity}
+        try:
+            options['eviction'] = self.recycle_eviction
+        except AttributeError:
+            pass
+        try:
+            options['mode'] = self.recycle_mode
+        except AttributeError:
+            pass
+
+        if recycle_file is not None and os.path.isfile(recycle_file):
+            logging.info('Loading Krylov recycle store from %s' %recycle_file)
+            self.recycle_store = solvers.KrylovRecycleStore.load(recycle_file,**options)
+        else:
+            self.recycle_store = solvers.KrylovRecycleStore(**options)
+        return self.recycle_store
+
+    def save_recycle_store(self):
+        recycle_file = self.get_recycle_file()
+        if recycle_file is not None:
+            logging.info('Saving Krylov recycle store in %s' %recycle_file)
+            self.recycle_store.save(recycle_file)
 
     def vector2localdict(self,v,map_dict):
         return vector2localdict(v,map_dict)
 
-    def apply_F(self, v,  external_force=False, **kwargs):
+    def apply_F(self, v,  external_force=False, out=None, **kwargs):
        
         v_dict = self.vector2localdict(v, self.global2local_lambda_dofs)
         gap_dict = self.solve_interface_gap(v_dict,external_force)
         
-        d = np.zeros(self.lambda_size)
+        d = self.lambda_zeros(v,out)
         for interface_id,global_index in self.local2global_lambda_dofs.items():
             d[global_index] += gap_dict[interface_id]
 
-        return -d
+        return np.negative(d,out=d)
 
-    def apply_F_inv(self,v,**kwargs):
+    def apply_F_inv(self,v,out=None,**kwargs):
         # map array to domains dict and then solve force gap
         v_dict = self.vector2localdict(v, self.global2local_lambda_dofs)
         gap_dict = self.solve_interface_force(v_dict,**kwargs)
 
         # assemble vector based on dict
-        d = np.zeros(self.lambda_size)
+        d = self.lambda_zeros(v,out)
         for interface_id,global_index in self.local2global_lambda_dofs.items():
             d[global_index] += gap_dict[interface_id]
 
@@ -470,7 +1072,11 @@ class SolverManager():
         for problem_id, local_problem in self.local_problem_dict.items():
 
             lambda_dict[problem_id] = self.vector2localdict(lambda_sol, self.global2local_lambda_dofs)
-            u_local = local_problem.solve(lambda_dict[problem_id],external_force_bool=True)
+            if self.primal_iterates is not None:
+                # carried by the dual interface algorithm, see carry_primal_iterates
+                u_local = self.primal_iterates[problem_id].copy()
+            else:
+                u_local = local_problem.solve(lambda_dict[problem_id],external_force_bool=True)
 
             if local_problem.kernel.shape[0]>0:
                 alpha_dict.update(self.vector2localdict(alpha_sol, self.global2local_alpha_dofs))
@@ -488,12 +1094,10 @@ class SolverManager():
         B_global = [B_local(1,2)  - B_local(2,1) ]
 
         '''
-        try:
-            B = scipy.sparse.lil_matrix((self.lambda_size,self.primal_size),dtype=np.int)
-        except:
+        if self.lambda_size is None:
             self.build_local_to_global_mapping()
-            B = scipy.sparse.lil_matrix((self.lambda_size,self.primal_size),dtype=np.int)
 
+        block_list = []
         for local_id in self.local_problem_id_list:
             local_problem = self.local_problem_dict[local_id]
             Bi_dict = local_problem.B_local
@@ -505,10 +1109,9 @@ class SolverManager():
                     idy =  self.local2global_lambda_dofs[nei_id,local_id]
 
                 Bij = Bi_dict[local_id, nei_id]
-                #B[np.ix_(idy,idx)] = np.sign(nei_id - local_id)*Bij
-                B[np.ix_(idy,idx)] = Bij
+                block_list.append((idy,idx,Bij))
 
-        return B.tocsc()
+        return block_coo_matrix(block_list,(self.lambda_size,self.primal_size),dtype=int)
 
     def build_dof_map(self):
         
@@ -605,25 +1208,14 @@ class SolverManager():
         if not self.local2global_alpha_dofs:
             self.build_local_to_global_mapping()
 
-        try:
-            R = scipy.sparse.lil_matrix((self.primal_size,self.alpha_size))
-        except:
-            self.build_local_to_global_mapping()
-            R = scipy.sparse.lil_matrix((self.alpha_size,self.primal_size))
-
+        block_list = []
         for local_id in self.local_problem_id_list:
-            local_problem = self.local_problem_dict[local_id]
-            
-            
-            idx = self.local2global_primal_dofs[local_id]
-            try:
+            if local_id in self.local2global_alpha_dofs:
+                idx = self.local2global_primal_dofs[local_id]
                 idy =  self.local2global_alpha_dofs[local_id]
-                R_local = local_problem.kernel
-                R[np.ix_(idx,idy)] = R_local
-            except:
-                continue
+                block_list.append((idx,idy,self.local_problem_dict[local_id].kernel))
 
-        return R.tocsc()
+        return block_coo_matrix(block_list,(self.primal_size,self.alpha_size))
 
     def assemble_global_F(self):
         ''' This function return F as a linear operator
@@ -651,8 +1243,324 @@ class SolverManager():
         return -self.apply_F(np.array(self.lambda_size*[0.0]), external_force=True)
 
 
+class FETIDPSolverManager(SolverManager):
+    ''' solver manager of the dual-primal FETI method (FETI-DP). The crosspoint dofs, 
+    shared by more than two subdomains (see LocalProblem.crosspoints_detection),
+    are the primal dofs of a global coarse problem, and the multipliers are kept
+    on the remaining interface dofs. If the crosspoints do not fix the rigid body
+    motions of a subdomain, e.g. of the corner subdomains of a grid, interface dofs 
+    selected by linalg.select_fixing_dofs are added to the primal dofs, and so are
+    the interface dofs which fix the mechanisms of the partially assembled problem, 
+    e.g. of groups of floating subdomains linked by one crosspoint.
+
+    The local problems hold the matrices K_rr of the remaining dofs and the B matrices
+    of the remaining multipliers, such that the local solves, the interface gaps and
+    the preconditioners of the SolverManager are reused. With u_c = L u_p, where L 
+    maps the global primal dofs u_p to the local primal dofs:
+
+        K_rr u_r = f_r - B_r^T lambda - K_rc L u_p
+        S_pp u_p = sum L^T (f_c - K_cr K_rr^-1 (f_r - B_r^T lambda))
+        S_pp = sum L^T (K_cc - K_cr K_rr^-1 K_rc) L
+
+    The dual interface problem has no kernel, then there are neither alphas nor 
+    a projection. S_pp is factorized by the CoarseProblem, see coarse_method.
+    '''
+    # maximum number of passes adding the fixing dofs of the local kernels
+    max_primal_passes = 5
+
+    def _create_local_problems(self,K_dict,B_dict,f_dict):
+        self.K_dict = K_dict
+        self.B_dict = B_dict
+        self.local_length_dict = {key : K.shape[0] for key, K in K_dict.items()}
+        self.local_problem_id_list = sorted(K_dict.keys())
+        self.is_local_G_GGT_and_e_computed = True
+        self.build_dof_classes()
+
+        primal_classes = self.detect_crosspoint_classes(f_dict)
+        shared_matrix_dict = {}
+        for n_pass in range(self.max_primal_passes):
+            self.set_primal_dofs(primal_classes)
+            for key in self.local_problem_id_list:
+                self.local_problem_dict[key] = self.create_local_problem(key,f_dict[key],shared_matrix_dict)
+
+            fixing_classes = self.select_fixing_classes()
+            if not fixing_classes:
+                self.assemble_primal_coarse_problem()
+                fixing_classes = self.select_mechanism_classes()
+                if not fixing_classes:
+                    break
+            primal_classes.update(fixing_classes)
+        else:
+            raise ValueError('The primal dofs do not fix the rigid body motions after %i passes, ' \
+                             'FETI-DP requires a problem without global rigid body motions' %self.max_primal_passes)
+
+        for key, local_problem in self.local_problem_dict.items():
+            for interface_id, B in local_problem.B_local.items():
+                self.local_lambda_length_dict[interface_id] = B.shape[0]
+
+        self.update_forces(f_dict)
+        logging.info('FETI-DP with %i primal dofs and %i local matrices' %(self.primal_coarse_size,len(shared_matrix_dict)))
+
+    def build_dof_classes(self):
+        ''' classes of local dofs connected by the rows of the B matrices, 
+        self.dof_class[local_id,dof] is the class of a local interface dof
+        '''
+        parent = {}
+        def find(node):
+            while parent.setdefault(node,node)!=node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        for local_id, B_local_dict in self.B_dict.items():
+            for (_, nei_id), B in B_local_dict.items():
+                if nei_id<=local_id:
+                    continue
+                # the rows of B_ij and B_ji are the same constraints
+                nei_dofs = dict(zip(*sparse.csr_matrix(self.B_dict[nei_id][nei_id,local_id]).nonzero()))
+                for row, local_dof in zip(*sparse.csr_matrix(B).nonzero()):
+                    parent[find((nei_id,nei_dofs[row]))] = find((local_id,local_dof))
+
+        self.dof_class = {node : find(node) for node in parent}
+
+    def detect_crosspoint_classes(self,f_dict):
+        ''' classes of the crosspoint dofs of LocalProblem.crosspoints_detection
+        '''
+        primal_classes = set()
+        for key in self.local_problem_id_list:
+            local_problem = LocalProblem(self.K_dict[key],self.B_dict[key],f_dict[key],id=key)
+            for crosspoint_dofs in local_problem.crosspoints_detection().values():
+                primal_classes.update(self.dof_class[key,dof] for dof in crosspoint_dofs)
+        return primal_classes
+
+    def set_primal_dofs(self,primal_classes):
+        ''' local primal dofs of every subdomain and their global ids
+        '''
+        class_list = sorted(primal_classes)
+        class_id = {dof_class : i for i, dof_class in enumerate(class_list)}
+        self.primal_coarse_size = len(class_list)
+        self.primal_dofs_dict = {key : [] for key in self.local_problem_id_list}
+        self.primal_map_dict = {key : [] for key in self.local_problem_id_list}
+        for (key, dof), dof_class in sorted(self.dof_class.items()):
+            if dof_class in class_id:
+                self.primal_dofs_dict[key].append(dof)
+                self.primal_map_dict[key].append(class_id[dof_class])
+
+        self.remaining_dofs_dict = {}
+        for key in self.local_problem_id_list:
+            self.primal_dofs_dict[key] = np.array(self.primal_dofs_dict[key],dtype=int)
+            self.primal_map_dict[key] = np.array(self.primal_map_dict[key],dtype=int)
+            self.remaining_dofs_dict[key] = np.setdiff1d(np.arange(self.local_length_dict[key]),self.primal_dofs_dict[key])
+
+    def create_local_problem(self,key,f,shared_matrix_dict):
+        ''' LocalProblem with the matrix K_rr of the remaining dofs and the B matrices 
+        of the remaining multipliers. Local problems with the same K_rr share one Matrix,
+        then the local problems which do not change are not factorized again
+        '''
+        K = sparse.csc_matrix(self.K_dict[key])
+        remaining_dofs = self.remaining_dofs_dict[key]
+        primal_dofs = self.primal_dofs_dict[key]
+        K_rr = K[remaining_dofs,:][:,remaining_dofs]
+
+        B_local_dict = {}
+        for interface_id, B in self.B_dict[key].items():
+            B = sparse.csr_matrix(B)
+            rows = np.setdiff1d(np.arange(B.shape[0]),sparse.csc_matrix(B)[:,primal_dofs].nonzero()[0])
+            if rows.size>0:
+                B_local_dict[interface_id] = B[rows,:][:,remaining_dofs]
+
+        try:
+            share_local_matrices = self.share_local_matrices
+        except AttributeError:
+            share_local_matrices = True
+
+        K_local = K_rr
+        if share_local_matrices:
+            tag = array_hash(K_rr)
+            if tag not in shared_matrix_dict:
+                shared_matrix_dict[tag] = Matrix(K_rr,pseudoinverse_kargs=self.pseudoinverse_kargs)
+            K_local = shared_matrix_dict[tag]
+
+        return LocalProblem(K_local,B_local_dict,f[remaining_dofs],id=key,pseudoinverse_kargs=self.pseudoinverse_kargs,
+                            **self.get_local_operator_kwargs())
+
+    def select_fixing_classes(self):
+        ''' classes of the interface dofs which fix the kernels of K_rr
+        '''
+        fixing_classes = set()
+        for key, local_problem in self.local_problem_dict.items():
+            R = local_problem.get_kernel()
+            if R.shape[0]==0 or R.shape[1]==0:
+                continue
+
+            interface_dofs = local_problem.interface_dofs
+            if interface_dofs.size==0:
+                raise ValueError('Local problem %i has a kernel and no interface dofs' %key)
+            idf = select_fixing_dofs(R[interface_dofs,:])
+            for dof in self.remaining_dofs_dict[key][interface_dofs[idf]]:
+                fixing_classes.add(self.dof_class[key,dof])
+            logging.info('%i fixing dofs are added to the primal dofs of local problem %i' %(len(idf),key))
+        return fixing_classes
+
+    def select_mechanism_classes(self):
+        ''' classes of the interface dofs which fix the kernel of S_pp. The kernel 
+        gives rigid local displacements, which are compatible at the primal dofs,
+        and the fixing dofs are selected from their gaps at the remaining multipliers
+        '''
+        tolerance = self.pseudoinverse_kargs.get('tolerance',1.0E-8)
+        _, _, Z = spkernel(self.course_problem.GGT,tol=tolerance)
+        if Z.size==0:
+            return set()
+
+        u_dict = {}
+        for problem_id, local_problem in self.local_problem_dict.items():
+            u_r = -self.K_rr_inv_K_rc_dict[problem_id].dot(Z[self.primal_map_dict[problem_id]])
+            u_dict.update(local_problem.get_interface_dict(u_r))
+        gap_dict = self.combine_interface_gap(u_dict)
+
+        gap_list = []
+        class_list = []
+        for (local_id, nei_id), gap in gap_dict.items():
+            if nei_id>local_id:
+                rows, dofs = sparse.csr_matrix(self.local_problem_dict[local_id].B_local[local_id,nei_id]).nonzero()
+                remaining_dofs = self.remaining_dofs_dict[local_id][dofs[np.argsort(rows)]]
+                class_list.extend(self.dof_class[local_id,dof] for dof in remaining_dofs)
+                gap_list.append(gap)
+
+        idf = select_fixing_dofs(np.vstack(gap_list))
+        logging.info('%i fixing dofs are added to the primal dofs of the partially assembled problem' %len(idf))
+        return set(class_list[i] for i in idf)
+
+    def update_forces(self,f_dict):
+        ''' split the local forces in the forces of the remaining and of the primal dofs
+        '''
+        self.f_primal_dict = {}
+        for problem_id, local_problem in self.local_problem_dict.items():
+            f_local = f_dict[problem_id]
+            if isinstance(f_local,Vector):
+                f_local = f_local.data
+            local_problem.f_local = Vector(f_local[self.remaining_dofs_dict[problem_id]])
+            self.f_primal_dict[problem_id] = f_local[self.primal_dofs_dict[problem_id]]
+
+    def assemble_primal_coarse_problem(self):
+        ''' assemble S_pp and the local K_rr^-1 K_rc
+        '''
+        block_list = []
+        self.K_cr_dict = {}
+        self.K_rr_inv_K_rc_dict = {}
+        for problem_id, local_problem in self.local_problem_dict.items():
+            K = sparse.csr_matrix(self.K_dict[problem_id])
+            remaining_dofs = self.remaining_dofs_dict[problem_id]
+            primal_dofs = self.primal_dofs_dict[problem_id]
+            K_cr = K[primal_dofs,:][:,remaining_dofs]
+            K_cc = K[primal_dofs,:][:,primal_dofs].toarray()
+            K_rr_inv_K_rc = local_problem.K_local.apply_inverse(K[remaining_dofs,:][:,primal_dofs].toarray())
+            self.K_cr_dict[problem_id] = K_cr
+            self.K_rr_inv_K_rc_dict[problem_id] = K_rr_inv_K_rc
+            primal_map = self.primal_map_dict[problem_id]
+            block_list.append((primal_map,primal_map,K_cc - K_cr.dot(K_rr_inv_K_rc)))
+
+        # the coarse matrix of FETI-DP is factorized in place of GGT
+        self.course_problem.GGT = block_coo_matrix(block_list,(self.primal_coarse_size,self.primal_coarse_size))
+        return self.course_problem.GGT
+
+    def solve_primal_problem(self,v_dict=None,external_force=False):
+        ''' solve the partially assembled problem for the multipliers v_dict
+
+        return 
+            u_r_dict : dict
+                solutions of the remaining dofs of every local problem
+            u_p : np.array
+                solution of the global primal dofs
+        '''
+        u_r_dict = {}
+        for problem_id, local_problem in self.local_problem_dict.items():
+            u_r_dict[problem_id] = local_problem.solve(v_dict,external_force)
+
+        u_r = u_r_dict[self.local_problem_id_list[0]]
+        f_p = np.zeros((self.primal_coarse_size,) + u_r.shape[1:])
+        for problem_id, u_r in u_r_dict.items():
+            f_c = -self.K_cr_dict[problem_id].dot(u_r)
+            if external_force:
+                f_primal = self.f_primal_dict[problem_id]
+                f_c += f_primal.reshape(f_primal.shape + (1,)*(f_c.ndim - f_primal.ndim))
+            f_p[self.primal_map_dict[problem_id]] += f_c
+
+        t0 = telemetry.start()
+        u_p = self.GGT_inv.dot(f_p)
+        telemetry.stop('coarse_solve',t0)
+
+        for problem_id, u_r in u_r_dict.items():
+            u_r -= self.K_rr_inv_K_rc_dict[problem_id].dot(u_p[self.primal_map_dict[problem_id]])
+
+        return u_r_dict, u_p
+
+    def solve_interface_gap(self,v_dict=None, external_force=False):
+        u_r_dict, u_p = self.solve_primal_problem(v_dict,external_force)
+        u_dict = {}
+        for problem_id, u_r in u_r_dict.items():
+            u_dict.update(self.local_problem_dict[problem_id].get_interface_dict(u_r))
+        return self.combine_interface_gap(u_dict)
+
+    def build_local_to_global_mapping(self):
+        ''' maps of the remaining multipliers, and of the primal variables with 
+        all the local dofs, see SolverManager.build_local_to_global_mapping
+        '''
+        super().build_local_to_global_mapping()
+
+        dof_primal_init = 0
+        self.local2global_primal_dofs = {}
+        self.global2local_primal_dofs = {}
+        for local_id in self.local_problem_id_list:
+            local_primal_dofs = np.arange(self.local_length_dict[local_id])
+            global_primal_index = dof_primal_init + local_primal_dofs
+            dof_primal_init += len(local_primal_dofs)
+            self.local2global_primal_dofs[local_id] = global_primal_index
+            self.global2local_primal_dofs[tuple(global_primal_index)] = {local_id:local_primal_dofs}
+            for interface_id, B in self.B_dict[local_id].items():
+                self.unique_map[interface_id] = global_primal_index[B.nonzero()[1]]
+        self.primal_size = dof_primal_init
+
+    def compute_lambda_im(self):
+        return np.zeros((self.lambda_size,) + self.rhs_shape)
+
+    def get_projection(self):
+        def projection(r,out=None):
+            if out is None:
+                return r.copy()
+            np.copyto(out,r)
+            return out
+        return projection
+
+    def compute_alpha(self,algorithm,rk,residual,lambda_ker):
+        return np.zeros((0,) + self.rhs_shape)
+
+    def get_carry_primal_iterates(self):
+        return False
+
+    def get_combined_projection(self):
+        return False
+
+    def assemble_solution_dict(self,lambda_sol,alpha_sol):
+        ''' local displacements of all the local dofs, the alpha_dict is empty
+        '''
+        lambda_global_dict = self.vector2localdict(lambda_sol, self.global2local_lambda_dofs)
+        u_r_dict, u_p = self.solve_primal_problem(lambda_global_dict,external_force=True)
+
+        u_dict = {}
+        lambda_dict = {}
+        for problem_id, u_r in u_r_dict.items():
+            u_local = np.zeros((self.local_length_dict[problem_id],) + u_r.shape[1:])
+            u_local[self.remaining_dofs_dict[problem_id]] = u_r
+            u_local[self.primal_dofs_dict[problem_id]] = u_p[self.primal_map_dict[problem_id]]
+            u_dict[problem_id] = u_local
+            lambda_dict[problem_id] = lambda_global_dict
+
+        return u_dict, lambda_dict, {}
+
+
 class ParallelSolverManager(SolverManager):
-    def __init__(self,K_dict,B_dict,f_dict,pseudoinverse_kargs={'method':'svd','tolerance':1.0E-8},temp_folder='temp',**kwargs):
+    def __init__(self,K_dict,B_dict,f_dict,pseudoinverse_kargs={'method':'spkernel','tolerance':1.0E-8},temp_folder='temp',**kwargs):
         self.temp_folder = temp_folder
         self.local_problem_path = {}
         self.prefix = 'local_problem_'
@@ -670,10 +1578,19 @@ class ParallelSolverManager(SolverManager):
             self.temp_folder = temp_folder
 
         try:
-            #deleting local files
-            shutil.rmtree(temp_folder, ignore_errors=True)
-        except:
-            pass
+            restart = self.restart
+        except AttributeError:
+            restart = False
+
+        if not restart:
+            try:
+                #deleting local files
+                shutil.rmtree(temp_folder, ignore_errors=True)
+            except:
+                pass
+        else:
+            # checkpoints and setup cache of the previous run are kept
+            logging.info('Restarting from the files in %s' %temp_folder)
 
         try:
             # creating folder for MPI execution
@@ -681,10 +1598,13 @@ class ParallelSolverManager(SolverManager):
         except:
             pass
             
+        shared_matrix_dict = {}
         for key, obj in K_dict.items():
             B_local_dict = B_dict[key]
             self.local_problem_id_list.append(key)
-            self.local_problem_dict[key] = LocalProblem(obj,B_local_dict,f_dict[key],id=key,pseudoinverse_kargs=self.pseudoinverse_kargs)
+            K_local = self.get_shared_matrix(key,obj,shared_matrix_dict,B_local_dict)
+            self.local_problem_dict[key] = LocalProblem(K_local,B_local_dict,f_dict[key],id=key,pseudoinverse_kargs=self.pseudoinverse_kargs,
+                                                        **self.get_rigid_body_kwargs(key),**self.get_local_operator_kwargs())
             for interface_id, B in B_local_dict.items():
                 self.local_lambda_length_dict[interface_id] = B.shape[0]
 
@@ -707,6 +1627,7 @@ class ParallelSolverManager(SolverManager):
                               tmp_folder=self.temp_folder ,
                               prefix = self.prefix, 
                               ext = self.ext,
+                              dual_interface_algorithm=self.dual_interface_algorithm,
                               **self.kwargs)
         
         elapsed_time = time.time() - start_time
@@ -780,21 +1701,48 @@ class ParallelFETIsolver(FETIsolver):
         if self.delete_folder:
             manager.delete()
 
+        if self.n_rhs is not None and sol_obj is not None:
+            return sol_obj.split()
         return sol_obj
         
 
 class LocalProblem():
     counter = 0
-    def __init__(self,K_local, B_local, f_local,id,pseudoinverse_kargs={'method':'svd','tolerance':1.0E-8}):
+    # flops equivalent to the python overhead of one local solve, see is_explicit_operator_cheaper
+    solve_overhead = 1.0E5
+    def __init__(self,K_local, B_local, f_local,id,pseudoinverse_kargs={'method':'spkernel','tolerance':1.0E-8},
+                 coordinates=None,dof_map=None,local_operator='implicit',expected_iterations=50,dense_schur=False):
+        ''' 
+        Parameters:
+            coordinates : np.array, Default = None
+                nodal coordinates of the subdomain, if given the kernel of K_local
+                is built from the rigid body modes, see linalg.rigid_body_modes
+            dof_map : np.array or pandas.DataFrame, Default = None
+                local dof index of every node and direction, e.g. SelectionOperator.id_map_df
+            local_operator : str, Default = 'implicit'
+                'implicit' applies F_i = B_i K_i^+ B_i^T by local solves, 'explicit' 
+                builds F_i as a dense matrix, and 'auto' selects one of them by 
+                the cost model of is_explicit_operator_cheaper
+            expected_iterations : int, Default = 50
+                expected number of F applications of the cost model
+            dense_schur : Boolean, Default = False
+                hold the dense interface Schur complement S = Kbb - Kbi Kii^-1 Kib 
+                of the Dirichlet preconditioner, which is built with one multiple 
+                right hand side solve and is meant for small interfaces. With the
+                'schur' pseudoinverse method the Dirichlet preconditioner reuses 
+                the factorization of K_local, which holds S in sparse factors or,
+                with its dense_schur option, in dense spectral form
+        '''
         LocalProblem.counter+=1
 
-        if not isinstance(K_local,csc_matrix):  
-            K_local = sparse.csc_matrix(K_local)
-
         if isinstance(K_local,Matrix):
+            # e.g. a Matrix shared by identical subdomains
             self.K_local = K_local
         else:
-            self.K_local = Matrix(K_local,pseudoinverse_kargs=pseudoinverse_kargs)
+            if not isinstance(K_local,csc_matrix):  
+                K_local = sparse.csc_matrix(K_local)
+            self.K_local = Matrix(K_local,pseudoinverse_kargs=pseudoinverse_kargs,
+                                  coordinates=coordinates,dof_map=dof_map)
 
         self.length = self.K_local.shape[0]
         if isinstance(f_local,Vector):
@@ -804,6 +1752,10 @@ class LocalProblem():
 
         self.B_local = B_local
         self.solution = None
+        self.local_operator = local_operator
+        self.expected_iterations = expected_iterations
+        self.dense_schur = dense_schur
+        self.F_local = None
         
         self.id = id
         self.interface_size =  0
@@ -816,6 +1768,10 @@ class LocalProblem():
         self.compute_interface_dof_set()
         self.compute_interior_dof_set()
         self.compute_neighbor_scaling_array()
+        self.assemble_interface_operator()
+        if self.K_local.psudeoinverve.solver_opt=='schur':
+            # interface-last ordering of the partial factorization of K_local
+            self.K_local.interface_dofs = self.interface_dofs
 
     def get_neighbors_id(self):
         for nei_id, obj in self.B_local.items():
@@ -829,7 +1785,8 @@ class LocalProblem():
         '''
         for key, B in self.B_local.items():
             self.interface_set.update(B.nonzero()[1])
-            
+
+        self.interface_dofs = np.array(sorted(self.interface_set),dtype=int)
         return self.interface_set
 
     def compute_interior_dof_set(self):
@@ -840,6 +1797,7 @@ class LocalProblem():
             self.compute_interface_dof_set()
         
         self.interior_set.update(set(list(range(self.length)))-self.interface_set)
+        self.interior_dofs = np.array(sorted(self.interior_set),dtype=int)
         return self.interior_set
 
     def compute_neighbor_scaling_array(self):
@@ -853,8 +1811,47 @@ class LocalProblem():
             scalling[B.nonzero()[1]] += 1 
 
         self.scalling = scalling
+        self.inverse_scalling = 1.0/scalling
         return self.scalling
 
+    def assemble_interface_operator(self):
+        ''' This method stacks the local B matrices in one float CSR
+        matrix, B_stack = [B_local(id,nei_1); B_local(id,nei_2); ...],
+        and its transpose, such that the interface assembly and the
+        interface gap are one sparse matvec per subdomain.
+
+        The rows of B_local[interface_id] are in the slice
+        interface_slices[interface_id] of B_stack.
+        '''
+        self.interface_slices = {}
+        B_list = []
+        offset = 0
+        for interface_id, B in self.B_local.items():
+            self.interface_slices[interface_id] = slice(offset,offset + B.shape[0])
+            offset += B.shape[0]
+            B_list.append(sparse.csr_matrix(B,dtype=float))
+
+        if B_list:
+            self.B_stack = sparse.vstack(B_list,format='csr')
+        else:
+            self.B_stack = sparse.csr_matrix((0,self.length))
+        self.B_stack_T = self.B_stack.T.tocsr()
+        return self.B_stack
+
+    def stack_interface_dict(self,v_dict):
+        ''' stack the arrays of v_dict, which has the interface pairs
+        (min_id,max_id) as keys, in the row order of B_stack
+        '''
+        v_list = []
+        for (local_id,nei_id) in self.interface_slices:
+            v_list.append(v_dict[min(local_id,nei_id),max(local_id,nei_id)])
+        return np.concatenate(v_list)
+
+    def apply_inverse_scalling(self,u):
+        if u.ndim>1:
+            return self.inverse_scalling[:,None]*u
+        return self.inverse_scalling*u
+
     def expand_interface_gap(self,gap_dict):
         ''' This method expands a u gap_dict given at the interface
         pairs to the whole domain, named [ub, ui] based on 
@@ -868,17 +1865,13 @@ class LocalProblem():
             u : np.array
                 array with primal variables 
         '''
-        u = np.zeros(self.length)
-        for interface_id, B in self.B_local.items():
-                (local_id,nei_id) = interface_id
-                if local_id>nei_id:
-                    interface_id = (nei_id,local_id) 
-                u += B.T.dot(gap_dict[interface_id])
+        if not self.interface_slices:
+            return np.zeros((self.length,) + self.get_columns_shape(gap_dict))
+
+        u = self.B_stack_T.dot(self.stack_interface_dict(gap_dict))
 
         # scalling gap
-        u = sparse.diags(1.0/self.scalling).dot(u)
-        
-        return u
+        return self.apply_inverse_scalling(u)
 
     def apply_schur_complement(self,gap_dict,precond_type='Lumped'):
         ''' This method computes the force at the interface, 
@@ -886,76 +1879,99 @@ class LocalProblem():
         which is defined as the primal variable at the interface given
         the interface pair dictionary
         '''
-
-        
-        interface_id = list(self.interface_set)
-        interior_id = list(self.interior_set)
-        f = np.zeros(self.length)
+        interface_id = self.interface_dofs
         u = self.expand_interface_gap(gap_dict)
+        f = np.zeros(u.shape)
         ub = u[interface_id]
-        K = self.K_local.data
-        # creating Kbb matrix in the first try
-        try:
-            Kbb = self._Kbb
-        except AttributeError:
-            self._Kbb = K[np.ix_(interface_id,interface_id)]
-            Kbb = self._Kbb
 
         if precond_type=='Lumped':
-            f[interface_id] += Kbb.dot(ub)
+            f[interface_id] += self.get_Kbb().dot(ub)
 
         elif precond_type=='SuperLumped':
-            f[interface_id] += np.diag(Kbb.diagonal()).dot(ub)
+            f[interface_id] += sparse.diags(self.get_Kbb().diagonal()).dot(ub)
 
         elif precond_type=='LumpedDirichlet':
+            Kib = self.get_Kib()
             try:
-                Kib = self._Kib
+                Kii_inv = self._Kii_inv
             except AttributeError:
-                Kib = self.K_local.data[np.ix_(interior_id,interface_id)]
-                self._Kib = Kib
+                self._Kii_inv = sparse.diags(1.0/(self.K_local.data.diagonal()[self.interior_dofs]))
+                Kii_inv = self._Kii_inv
 
-            try:
-                Kii = self._Kii_inv
-            except AttributeError:
-                self._Kii_inv = sparse.diags(1.0/(K.diagonal()[interior_id]))
-                Kii = self._Kii_inv
-
-            f_exp = Kib.dot(ub)    
-            ui = self._Kii_inv.dot(f_exp) 
-
-            f[interface_id] += Kbb.dot(ub) - Kib.T.dot(ui)
+            ui = Kii_inv.dot(Kib.dot(ub))
+            f[interface_id] += self.get_Kbb().dot(ub) - Kib.T.dot(ui)
         
         elif precond_type=='Dirichlet':
-            
-            try:
-                Kib = self._Kib
-            except AttributeError:
-                Kib = self.K_local.data[np.ix_(interior_id,interface_id)]
-                self._Kib = Kib
-            
-            f_exp = np.zeros(self.length)
-            f_exp[interior_id] += Kib.dot(ub)
-            try:
-                ui = self._lu.solve(f_exp[interior_id])
-            except AttributeError:
-                Kii = K[np.ix_(interior_id,interior_id)].tocsc()
-                self._lu = sparse.linalg.splu(Kii,options={'SymmetricMode':True})
-                ui = self._lu.solve(f_exp[interior_id])
-            except MemoryError:
-                looging.error('Memory error during Dirichlet Preconditioner Applications')
-                raise MemoryError('Memory error during Dirichlet Preconditioner Applications')
-            except Exception as e:
-                raise Exception('Excepiton occurs during Dirichlet Preconditioner Applications')
-            #ui = self.K_local.apply_inverse(f_exp)[interior_id]
-            f[interface_id] += Kbb.dot(ub) - Kib.T.dot(ui)
+            f[interface_id] += self.apply_dirichlet_schur(ub)
 
         else:
             logging.error('Schur complement type not supported!')
 
-        
-        f_scalling = sparse.diags(1.0/self.scalling).dot(f)
+        return self.get_interface_dict(self.apply_inverse_scalling(f))
+
+    def get_Kbb(self):
+        try:
+            return self._Kbb
+        except AttributeError:
+            self._Kbb = self.K_local.data[np.ix_(self.interface_dofs,self.interface_dofs)]
+            return self._Kbb
+
+    def get_Kib(self):
+        try:
+            return self._Kib
+        except AttributeError:
+            self._Kib = self.K_local.data[np.ix_(self.interior_dofs,self.interface_dofs)]
+            return self._Kib
+
+    def get_schur_factors(self):
+        ''' SchurFactors of the 'schur' pseudoinverse method of K_local, 
+        None for the other methods
+        '''
+        if self.K_local.psudeoinverve.solver_opt!='schur':
+            return None
+        self.get_kernel()
+        factor = self.K_local.psudeoinverve.factor
+        if isinstance(factor,SchurFactors) and np.array_equal(factor.interface_dofs,self.interface_dofs):
+            return factor
+        return None
 
-        return self.get_interface_dict(f_scalling)
+    def apply_dirichlet_schur(self,ub):
+        ''' Schur complement action of the Dirichlet preconditioner
+
+            S ub = Kbb ub - Kbi Kii^-1 Kib ub
+
+        S is the one held by the 'schur' factorization of K_local, or the
+        dense S of dense_schur=True, otherwise Kii is factorized once.
+        '''
+        schur_factors = self.get_schur_factors()
+        if schur_factors is not None:
+            return schur_factors.apply_schur(ub)
+
+        try:
+            S = self._S
+        except AttributeError:
+            S = None
+
+        if S is None:
+            Kib = self.get_Kib()
+            try:
+                lu = self._lu
+            except AttributeError:
+                Kii = self.K_local.data[np.ix_(self.interior_dofs,self.interior_dofs)].tocsc()
+                try:
+                    self._lu = sparse.linalg.splu(Kii,permc_spec='MMD_AT_PLUS_A',options={'SymmetricMode':True})
+                except MemoryError:
+                    logging.error('Memory error during Dirichlet Preconditioner Applications')
+                    raise MemoryError('Memory error during Dirichlet Preconditioner Applications')
+                lu = self._lu
+
+            if not self.dense_schur:
+                return self.get_Kbb().dot(ub) - Kib.T.dot(lu.solve(Kib.dot(ub)))
+
+            self._S = self.get_Kbb().toarray() - Kib.T.dot(lu.solve(Kib.toarray()))
+            S = self._S
+
+        return S.dot(ub)
 
     def crosspoints_detection(self):
         ''' This function detects cross points based on local 
@@ -964,8 +1980,9 @@ class LocalProblem():
         but it can appears in an another crosspoint tuple.
         The crosspoints tuple points work as a key to the pointers of local B matrix:
 
-        crosspoints[i,j,k] = (dof_u, dof_lambda_j, dof_lambda_k)
+        crosspoints[i,j,k] = {dof_u : (dof_lambda_j, dof_lambda_k), ...}
 
+        with one item per dof shared by the domains i, j and k, 
         where dof_u is a columns id of the Local B matrices, 
         and dof_lambda_j, dof_lambda_k are the rows of the local B matrices:
 
@@ -984,53 +2001,128 @@ class LocalProblem():
         for nei_id_j in self.neighbors_id:
             for nei_id_k in self.neighbors_id:
                 if nei_id_k>nei_id_j:
-                    Bij = np.abs(self.B_local[self.id,nei_id_j])
-                    Bik = np.abs(self.B_local[self.id,nei_id_k])
-                    try:
-                        B_stack = sparse.vstack((Bij,Bik))
-                    except:
-                        B_stack = np.vstack((Bij,Bik))
-
-                    try:
-                        col_id = np.argwhere(B_stack.T.sum(axis=1)>1)[0][0]
-                        row_id_j = np.argwhere(Bij[:,col_id]>0)[0][0] 
-                        row_id_k = np.argwhere(Bik[:,col_id]>0)[0][0] 
-                        crosspoints[self.id,nei_id_j,nei_id_k] = {col_id : (row_id_j,row_id_k)}
-                        logging.info('Crosspoint detected in Domain id = %i, dofs is connected to domains (%i and %i)' %(self.id,row_id_j,row_id_k))
-                    except:
+                    Bij = sparse.csc_matrix(self.B_local[self.id,nei_id_j])
+                    Bik = sparse.csc_matrix(self.B_local[self.id,nei_id_k])
+                    shared_dofs = np.intersect1d(Bij.nonzero()[1],Bik.nonzero()[1])
+                    if shared_dofs.size==0:
                         continue
 
-                else:
-                    continue
+                    crosspoints[self.id,nei_id_j,nei_id_k] = {}
+                    for col_id in shared_dofs:
+                        row_id_j = Bij[:,col_id].nonzero()[0][0]
+                        row_id_k = Bik[:,col_id].nonzero()[0][0]
+                        crosspoints[self.id,nei_id_j,nei_id_k][col_id] = (row_id_j,row_id_k)
+                        logging.info('Crosspoint detected in Domain id = %i, dof %i is connected to domains (%i and %i)' %(self.id,col_id,nei_id_j,nei_id_k))
 
         return crosspoints
 
-    def solve(self, lambda_dict,external_force_bool=False):
-       
-        if not external_force_bool:
-            f = np.zeros(self.f_local.data.shape)
-        else:
-            f = np.copy(self.f_local.data)
+    def get_columns_shape(self,v_dict):
+        ''' trailing shape of the arrays in v_dict, () for 1D arrays
+        and (n,) for 2D arrays with n columns
+        '''
+        if v_dict:
+            return np.shape(next(iter(v_dict.values())))[1:]
+        return self.f_local.data.shape[1:]
 
-        if lambda_dict is not None:
+    def solve(self, lambda_dict,external_force_bool=False):
+        ''' solve the local problem K u = f - B^T lambda,
+        where lambda_dict values can be 1D arrays or 2D arrays with
+        one column per right hand side
+        '''
+        f = np.zeros((self.length,) + self.get_columns_shape(lambda_dict))
+        if external_force_bool:
+            f_local = self.f_local.data
+            if f_local.ndim<f.ndim:
+                f_local = f_local[:,None]
+            f += f_local
+
+        if lambda_dict is not None and self.interface_slices:
             # assemble interface and external forces
-            #for interface_id, f_interface in lambda_dict.items():
-            for interface_id, B in self.B_local.items():
-                (local_id,nei_id) = interface_id
-                if local_id>nei_id:
-                    interface_id = (nei_id,local_id) 
-                f -= B.T.dot(lambda_dict[interface_id])
-        return self.K_local.apply_inverse(f)
+            f -= self.B_stack_T.dot(self.stack_interface_dict(lambda_dict))
+
+        t0 = telemetry.start()
+        u = self.K_local.apply_inverse(f)
+        telemetry.stop('local_solve',t0)
+        return u
 
     def get_interface_dict(self,x):
+        return self.split_interface_array(self.B_stack.dot(x))
+
+    def split_interface_array(self,b):
+        ''' split an array with the rows of B_stack in a dict
+        with the local interface pairs as keys
+        '''
         interface_dict = {}
-        for interface_id, Bij in self.B_local.items():
-            (local_id,nei_id) = interface_id
-            #interface_dict[interface_id] = (nei_id-local_id)*Bij.dot(x)
-            interface_dict[interface_id] = Bij.dot(x)
+        for interface_id, interface_slice in self.interface_slices.items():
+            interface_dict[interface_id] = b[interface_slice]
 
         return interface_dict
 
+    def is_explicit_operator_cheaper(self,max_size=2**27):
+        ''' cost model of the local dual operator F_i = B_i K_i^+ B_i^T, 
+        with n_int interface rows, nnz(L+U) nonzeros of the factorization
+        and n_it expected iterations:
+
+            implicit : n_it * (2 nnz(L+U) + 4 nnz(B) + solve_overhead)
+            explicit : n_int * (2 nnz(L+U) + 4 nnz(B)) / 2 + n_it * 2 n_int^2
+
+        where the columns of the multiple right hand side solve of F_i
+        cost about half of a single solve, see multi_rhs_benchmark.py
+
+        Parameters:
+            max_size : int, Default = 2**27
+                maximum size of the dense F_i in bytes
+
+        return
+            boolean
+        '''
+        n_int = self.interface_size
+        if 8*n_int**2>max_size:
+            return False
+
+        self.get_kernel()
+        solve_cost = 2*self.K_local.psudeoinverve.factor_nnz + 4*self.B_stack.nnz
+        implicit_cost = self.expected_iterations*(solve_cost + self.solve_overhead)
+        explicit_cost = n_int*solve_cost/2 + self.expected_iterations*2*n_int**2
+        return explicit_cost<implicit_cost
+
+    def use_explicit_operator(self):
+        ''' True if F_i is applied as a dense matrix, with local_operator='auto'
+        the operator is selected once by is_explicit_operator_cheaper
+        '''
+        if self.local_operator=='auto':
+            self.local_operator = 'explicit' if self.is_explicit_operator_cheaper() else 'implicit'
+            logging.info('Local problem %s uses the %s local operator' %(str(self.id),self.local_operator))
+        return self.local_operator=='explicit'
+
+    def get_local_F(self):
+        ''' dense local dual operator F_i = B_i K_i^+ B_i^T, which is
+        computed by one multiple right hand side solve
+        '''
+        if self.F_local is None:
+            t0 = telemetry.start()
+            schur_factors = self.get_schur_factors()
+            if schur_factors is not None:
+                # B_i has nonzeros at the interface dofs only, F_i = B_b S^+ B_b^T
+                B_interface = self.B_stack[:,self.interface_dofs]
+                self.F_local = B_interface.dot(schur_factors.solve_schur(B_interface.T.toarray()))
+            else:
+                self.F_local = self.B_stack.dot(self.K_local.apply_inverse(self.B_stack_T.toarray()))
+            telemetry.stop('local_solve',t0)
+        return self.F_local
+
+    def apply_local_F(self,lambda_dict):
+        ''' interface displacements B_i u_i with u_i = - K_i^+ B_i^T lambda
+        computed with the dense local operator, see get_local_F
+        '''
+        F_local = self.get_local_F()
+        if not self.interface_slices:
+            return {}
+        t0 = telemetry.start()
+        b = -F_local.dot(self.stack_interface_dict(lambda_dict))
+        telemetry.stop('local_F',t0)
+        return self.split_interface_array(b)
+
     def rigid_body_correction(self,alpha):
         return self.get_kernel().dot(alpha)
         
@@ -1064,6 +2156,12 @@ class LocalProblem():
 
 class CoarseProblem():
     counter = 0
+    # options of coarse_method, see compute_GGT_inv
+    list_of_coarse_methods = ['splu','inv','cholesky','qr','auto']
+    # coarse_method='auto' uses the orthonormal basis Q up to this number of entries of Q
+    # and the dense Cholesky factor up to this number of alphas, see coarse_benchmark.py
+    qr_max_entries = 2**18
+    dense_max_size = 500
     def __init__(self,id=None):
         
         self.G_dict = {}
@@ -1077,6 +2175,7 @@ class CoarseProblem():
         self.global2local_lambda_dofs = {}
         self.GGT = None
         self.GGT_inv = None
+        self.Q = None
         self.coarse_method = 'splu'
      
         if id is None:
@@ -1094,32 +2193,90 @@ class CoarseProblem():
     def update_GGT_dict(self,local_GGT_dict):
         self.GGT_dict.update(local_GGT_dict)
     
-    def compute_GGT_inv(self,coarse_method=None,**kwargs):
+    def select_coarse_method(self,coarse_method=None,G=None):
+        ''' return the coarse method, 'auto' is replaced by 'qr' if G is given
+        and Q has not more than qr_max_entries entries, by 'cholesky' if the number 
+        of alphas is not larger than dense_max_size, else by 'splu'
+        '''
+        if coarse_method is None:
+            coarse_method = self.coarse_method
 
+        if coarse_method not in self.list_of_coarse_methods:
+            raise ValueError('Coarse method %s is not supported, select one of %s' %(coarse_method,self.list_of_coarse_methods))
 
-        if self.GGT_inv is None:
-            if coarse_method is None:
-                coarse_method = self.coarse_method
+        if coarse_method == 'auto':
+            if G is not None and G.shape[0]*G.shape[1]<=self.qr_max_entries:
+                coarse_method = 'qr'
+            elif self.GGT.shape[0]<=self.dense_max_size:
+                coarse_method = 'cholesky'
+            else:
+                coarse_method = 'splu'
+        return coarse_method
+
+    def compute_GGT_inv(self,coarse_method=None,G=None,**kwargs):
+        ''' compute the action of the inverse of GGT
 
+        Parameters:
+            coarse_method : str, Default = None
+                one of list_of_coarse_methods, if None self.coarse_method is used
+                'splu' : sparse LU factorization of GGT
+                'inv' : dense inverse of GGT
+                'cholesky' : dense Cholesky factor of GGT, applied with BLAS triangular solves
+                'qr' : economic QR factorization G^T = Q R, then GGT = R^T R and the 
+                       orthonormal basis Q is stored in self.Q, such that the projection
+                       is applied as r - Q(Q^T r). Without G the Cholesky factor is used
+                'auto' : see select_coarse_method
+            G : sparse matrix, Default = None
+                assembled G matrix, only used by 'qr'
+
+        return 
+            GGT_inv : LinearOperator or np.array
+        '''
+        if self.GGT_inv is None:
             if self.GGT is None:
                 raise ValueError('GGT is None, but it must be a np.array!')
 
+            coarse_method = self.select_coarse_method(coarse_method,G)
+            if coarse_method == 'qr' and G is None:
+                logging.warning('The qr coarse method requires the assembled G, the Cholesky factor of GGT is used.')
+                coarse_method = 'cholesky'
+
             if coarse_method == 'splu':
                 if not sparse.issparse(self.GGT):
                     self.GGT = sparse.csc_matrix(self.GGT)
                 GGT_inv  = sparse.linalg.splu(self.GGT)
-                self.GGT_inv = sparse.linalg.LinearOperator(shape=self.GGT.shape,matvec = lambda x : GGT_inv.solve(x)) 
+                self.GGT_inv = sparse.linalg.LinearOperator(shape=self.GGT.shape,matvec = lambda x : GGT_inv.solve(x),
+                                                            matmat = lambda X : GGT_inv.solve(X)) 
                 
             elif coarse_method == 'inv':
                 if sparse.issparse(self.GGT):
                     # convert to a dense matrix
                     self.GGT = self.GGT.A 
                 self.GGT_inv = np.linalg.inv(self.GGT)
-            else:
-                raise ValueError('G@G.T is not defined.')
+
+            elif coarse_method == 'cholesky':
+                if sparse.issparse(self.GGT):
+                    self.GGT = self.GGT.A
+                self.GGT_inv = self.triangular_inverse(scipy.linalg.cholesky(self.GGT))
+
+            elif coarse_method == 'qr':
+                GT = G.T
+                if sparse.issparse(GT):
+                    GT = GT.A
+                self.Q, R = scipy.linalg.qr(GT,mode='economic')
+                self.GGT_inv = self.triangular_inverse(R)
 
         return self.GGT_inv
     
+    def triangular_inverse(self,R):
+        ''' action of the inverse of R^T R, where R is upper triangular
+        '''
+        def solve(x):
+            y = scipy.linalg.solve_triangular(R,x,trans='T',check_finite=False)
+            return scipy.linalg.solve_triangular(R,y,check_finite=False)
+
+        return sparse.linalg.LinearOperator(shape=R.shape,matvec=solve,matmat=solve)
+
     def compute_local_GGT_columns_inv(self,columns_id=None):
 
         n = self.GGT.shapep[0]
@@ -1131,26 +2288,27 @@ class CoarseProblem():
         return GGT_inv_columns
             
     def assemble_block_matrix(self,M_dict,row_map_dict,column_map_dict,shape):
-        M = sparse.lil_matrix(shape)
-        for row_key, row_dofs in row_map_dict.items():
-            for col_key, column_dofs in column_map_dict.items():
-                if isinstance(col_key,int):
-                    column_key = col_key
-                else:
-                    if row_key not in col_key:
-                        continue
-                    else:
-                        l_key = list(col_key)
-                        l_key.remove(row_key)
-                        column_key = l_key[0]
-                try:        
-                    M[np.ix_(row_dofs,column_dofs)] = M_dict[row_key,column_key]
-                except:
-                    continue
+        ''' assemble the blocks M_dict[row_key,column_key] in one COO triplet assembly.
+        The columns of a block are column_map_dict[column_key], or if the column
+        keys are interface pairs, column_map_dict[pair] of the pairs with row_key and column_key
+        '''
+        block_list = []
+        for (row_key, column_key), M_block in M_dict.items():
+            if row_key not in row_map_dict:
+                continue
+            if column_key in column_map_dict:
+                block_list.append((row_map_dict[row_key],column_map_dict[column_key],M_block))
+            else:
+                for pair in set([(row_key,column_key),(column_key,row_key)]):
+                    if pair in column_map_dict:
+                        block_list.append((row_map_dict[row_key],column_map_dict[pair],M_block))
 
-        return M.tocsc()
+        return block_coo_matrix(block_list,shape)
             
     def assemble_block_vector(self,v_dict,map_dict,length):
+        ''' assemble a vector based on v_dict, length can be an int
+        or a tuple (length, n_rhs) to assemble a block of vectors
+        '''
         v = np.zeros(length)
         for row_keys, row_dofs in map_dict.items():
             v[np.ix_(row_dofs)] += v_dict[row_keys]
@@ -1239,11 +2397,63 @@ class Solution():
         return self.assemble_vector(self.alpha_dict,self.alpha_size,self.alpha_map)
 
     def assemble_vector(self,v_dict,vector_length,map_dict):
-        v = np.zeros(vector_length)
+        v = np.zeros((vector_length,) + get_trailing_shape(v_dict))
         for map_index,row_dofs in map_dict.items():
             v[np.ix_(row_dofs)] += v_dict[map_index]
         return v
 
+    def split(self):
+        ''' split a solution of multiple right hand sides, where 
+        the arrays have one column per right hand side, in a list
+        of Solution objects, one per right hand side
+
+        return 
+            list of Solution objects
+        '''
+        n_rhs = self.rk.shape[1]
+        sol_list = []
+        for i in range(n_rhs):
+            sol_obj = copy.copy(self)
+            sol_obj.u_dict = get_column(self.u_dict,i)
+            sol_obj.lambda_dict = get_column(self.lambda_dict,i)
+            sol_obj.alpha_dict = get_column(self.alpha_dict,i)
+            sol_obj.rk = self.rk[:,i]
+            sol_obj.proj_r_hist = self.proj_r_hist[i]
+            if self.lambda_hist:
+                sol_obj.lambda_hist = [lambda_k[:,i] for lambda_k in self.lambda_hist]
+            sol_obj.rhs_id = i
+            sol_list.append(sol_obj)
+        return sol_list
+
+
+def get_column(v,i):
+    ''' get the i-th column of 2D arrays in nested dicts
+    '''
+    if isinstance(v,dict):
+        return {key : get_column(item,i) for key, item in v.items()}
+    elif isinstance(v,np.ndarray) and v.ndim>1:
+        return v[:,i]
+    return v
+
+def stack_f_dict_list(f_dict_list):
+    ''' stack a list of f_dicts in a single f_dict, where 
+    the local force vectors are 2D arrays with one column 
+    per f_dict
+    '''
+    f_dict = {}
+    for key, f in f_dict_list[0].items():
+        columns = []
+        for f_dict_i in f_dict_list:
+            fi = f_dict_i[key]
+            if isinstance(fi,Vector):
+                fi = fi.data
+            columns.append(np.asarray(fi,dtype=float).flatten())
+        key_dict = {}
+        if isinstance(f,Vector):
+            key_dict = f.key_dict
+        f_dict[key] = Vector(np.column_stack(columns),key_dict)
+    return f_dict
+
 
 #Alias variables for backward and future compatibilite
 SerialSolverManager = SolverManager
@@ -25,19 +25,34 @@ from scipy.sparse import csc_matrix, issparse, lil_matrix, linalg as sla
 from scipy import linalg
 from scipy.sparse.linalg import LinearOperator
 
+try:
+    from sksparse.cholmod import cholesky as cholmod_cholesky
+except ImportError:
+    cholmod_cholesky = None
+
 import sys
 sys.path.append('../..')
 from pyfeti.src.utils import OrderedSet, Get_dofs, save_object, MapDofs, pyfeti_dir, load_object
+from pyfeti.src.cache import FactorizationCache
 
 
-def cholsps(A, tol=1.0e-8):    
+def cholsps(A, tol=1.0e-8, block_size=128):
     ''' This method return the upper traingular matrix of cholesky decomposition of A.
     This function works for positive semi-definite matrix. 
     This functions also return the null space of the matrix A.
+
+    The factorization is blocked: the pivots of a diagonal block are checked
+    column by column, the block column is computed by a triangular solve and
+    the trailing matrix is updated by a matrix product, such that almost all
+    the work runs in LAPACK/BLAS. Sparse matrices with a small bandwidth are
+    factorized in a moving dense window of size block_size + bandwidth and U
+    is returned as a sparse matrix, other sparse matrices are converted to dense.
+
     Input:
     
         A -> positive semi-definite matrix
         tol -> tolerance for small pivots
+        block_size -> number of columns per block
         
     Ouputs:
         U -> upper triangule of Cholesky decomposition
@@ -51,78 +66,109 @@ def cholsps(A, tol=1.0e-8):
         print('Matrix is not square')
         return
     
-    
-    L = np.zeros([n,n])
-    #L = sparse.lil_matrix((n,n),dtype=float) 
-    #A = sparse.csr_matrix(A)
     idp = [] # id of non-zero pivot columns
     idf = [] # id of zero pivot columns
     
+    banded = False
     if issparse(A):
-        Atrace = np.trace(A.A)
-        A = A.todense()
-    else:    
-        Atrace = np.trace(A)
-        
+        A = A.tocsr()
+        rows, cols = A.nonzero()
+        bandwidth = np.abs(rows - cols).max() if rows.size else 0
+        banded = (bandwidth + block_size) < n//2
+        if not banded:
+            A = A.toarray()
+            bandwidth = n - 1
+    else:
+        A = np.asarray(A)
+        bandwidth = n - 1
+
+    Atrace = A.diagonal().sum()
     tolA = tol*Atrace/n
-    
-    for i in range(n):
-        Li = L[i,:]
-        Lii = A[i,i] - np.dot(Li,Li)
-        if Lii>tolA:
-            L[i,i] = np.sqrt(Lii)
-            idp.append(i)
-        elif abs(Lii)<tolA:
-            L[i,i] = 0.0
-            idf.append(i)
-    
-        elif Lii<-tolA:
-            logging.debug('Matrix is not positive semi-definite.' + \
-                          'Given tolerance = %2.5e' %tol)
-            return L, [], None
-    
-        for j in range(i+1,n):
-            if L[i, i]>tolA:
-                L[j, i] = (A[j, i] - np.dot(L[i,:],L[j,:]))/L[i, i]
-            
-            
+
+    if banded:
+        L_rows, L_cols, L_data = [], [], []
+    else:
+        L = np.zeros([n,n])
+
+    # W is the dense window A[k:end,k:end] updated by the previous blocks
+    positive_semidefinite = True
+    end = min(block_size + bandwidth, n)
+    W = A[:end,:end]
+    W = W.toarray() if banded else np.array(W,dtype=float)
+    for k in range(0,n,block_size):
+        r1 = min(k + block_size, n)
+        e = min(r1 + bandwidth, n)
+        if e>end:
+            # rows of the band which are not yet updated by any block
+            W_new = np.zeros([e-k,e-k])
+            W_new[:end-k,:end-k] = W
+            W_new[end-k:,:] = A[end:e,k:e].toarray()
+            W_new[:end-k,end-k:] = W_new[end-k:,:end-k].T
+            W = W_new
+            end = e
+
+        nb = r1 - k
+        W11 = W[:nb,:nb]
+        L11 = np.zeros([nb,nb])
+        p = [] # block ids of the non-zero pivots
+        for j in range(nb):
+            Lj = L11[j,:j]
+            Ljj = W11[j,j] - np.dot(Lj,Lj)
+            if Ljj>tolA:
+                L11[j,j] = np.sqrt(Ljj)
+                L11[j+1:,j] = (W11[j+1:,j] - L11[j+1:,:j].dot(Lj))/L11[j,j]
+                idp.append(k+j)
+                p.append(j)
+            elif abs(Ljj)<tolA:
+                idf.append(k+j)
+            elif Ljj<-tolA:
+                positive_semidefinite = False
+                break
+
+        L21 = np.zeros([e-r1,nb])
+        if p and e>r1 and positive_semidefinite:
+            L21[:,p] = linalg.solve_triangular(L11[np.ix_(p,p)],W[nb:,:nb][:,p].T,lower=True).T
+        W = W[nb:,nb:] - L21.dot(L21.T)
+
+        L_block = np.vstack([L11,L21])
+        if banded:
+            i, j = np.nonzero(L_block)
+            L_rows.append(i + k)
+            L_cols.append(j + k)
+            L_data.append(L_block[i,j])
+        else:
+            L[k:e,k:r1] = L_block
+
+        if not positive_semidefinite:
+            break
+
+    if banded:
+        L = sparse.csr_matrix((np.concatenate(L_data),(np.concatenate(L_rows),np.concatenate(L_cols))),shape=(n,n))
+
+    if not positive_semidefinite:
+        logging.debug('Matrix is not positive semi-definite.' + \
+                      'Given tolerance = %2.5e' %tol)
+        return L, [], None
+
+    if banded:
+        U = L.T.tocsr()
+    else:
+        U = L.T
+
     # finding the null space
     rank = len(idp)
     rank_null = n - rank
-    
-    U = L.T 
     R = None
     if rank_null>0:
-        Im = np.eye(rank_null)
-        
-        # Applying permutation to get an echelon form
-        
-        PA = np.zeros([n,n])
-        PA[:rank,:] = U[idp,:]
-        PA[rank:,:] = U[idf,:]
-        
-        # creating block matrix
-        A11 = np.zeros([rank,rank])
-        A12 = np.zeros([rank,rank_null])
-        
-        A11 = PA[:rank,idp]
-        A12 = PA[:rank,idf]
-        
-        
-        R11 = np.zeros([rank,rank_null])
+        # backward substitution U[idp,idp] R[idp] = -U[idp,idf]
         R = np.zeros([n,rank_null])
-        
-        # backward substitution
-        for i in range(rank_null):
-            for j in range(rank-1,-1,-1):
-                if j==rank-1:
-                    R11[j,i] = -A12[j,i]/A11[j,j]
-                else:
-                    R11[j,i] = (-A12[j,i] - np.dot(R11[j+1:rank,i],A11[j,j+1:rank]) )/A11[j,j]
-                
-        # back to the original bases
-        R[idf,:] = Im
-        R[idp,:] = R11
+        R[idf,:] = np.eye(rank_null)
+        if banded:
+            U_pp = U[idp,:][:,idp].tocsr()
+            U_pf = U[idp,:][:,idf].toarray()
+            R[idp,:] = sla.spsolve_triangular(U_pp,-U_pf,lower=False)
+        else:
+            R[idp,:] = linalg.solve_triangular(U[np.ix_(idp,idp)],-U[np.ix_(idp,idf)],lower=False)
         
         logging.debug('Null space size = %i' %len(idf))
             
@@ -199,6 +245,694 @@ def splusps(A,tol=1.0e-6):
 
     return  lu, idf, R
 
+def spkernel(A,tol=1.0e-8,kernel_only=False):
+    ''' This method computes a kernel-revealing sparse factorization of a
+    positive semi-definite matrix without building dense n x n matrices.
+    A first SuperLU factorization in symmetric mode without pivoting reveals
+    the zero pivots |U_ii| < tol*|A_pp|, where p is the dof of the i-th pivot.
+    The dofs of the zero pivots (f) are fixed and the regular block Arr is
+    factorized again, then the null space is
+
+        R = [ -Arr^-1 Arf ]
+            [      I      ]
+
+    which is orthonormalized.
+
+    Input:
+
+        A -> positive semi-definite matrix
+        tol -> relative tolerance for zero pivots
+        kernel_only -> only detect the zero pivots, Arr is not factorized again
+                       and the null space is not computed, e.g. for another
+                       factorization of Arr, see null_space_of_fixed_dofs
+
+    Ouputs:
+        lu -> SuperLU object of the regular block Arr, or of A with kernel_only
+        idf -> list of the fixed dofs (zero pivot columns)
+        R -> orthonormal bases of the null space, empty array if A is regular
+             or None with kernel_only
+
+    A ValueError is raised if |A R| is not below tol*max|A_ii|.
+    '''
+    if not isinstance(A,csc_matrix):
+        A = csc_matrix(A)
+
+    n = A.shape[0]
+    options = {'DiagPivotThresh': 0.0,'SymmetricMode':True}
+    A_diag = np.abs(A.diagonal())
+
+    start = time.time()
+    try:
+        lu = sla.splu(A,options=options)
+    except RuntimeError:
+        # exactly singular, the perturbed zero pivots are still below the tolerance
+        lu = sla.splu(A + sparse.diags(1.0E-14*A_diag,format='csc'),options=options)
+
+    # Pr A Pc = L U, the dof of the i-th pivot is the inverse column permutation
+    pivots = np.abs(lu.U.diagonal())
+    pivot_dofs = np.argsort(lu.perm_c)
+    idf = np.sort(pivot_dofs[pivots<tol*A_diag[pivot_dofs]]).tolist()
+    logging.info('Time Duration of the pivot detection = %4.2e (s)' %(time.time() - start))
+
+    if kernel_only:
+        return lu, idf, None
+
+    if not idf:
+        return lu, idf, np.array([])
+
+    start = time.time()
+    idr = np.setdiff1d(np.arange(n),idf)
+    A_rr = A[idr,:][:,idr].tocsc()
+    lu = sla.splu(A_rr,options=options)
+    R = null_space_of_fixed_dofs(A,lu.solve,idf,tol=tol)
+    logging.info('Time Duration of Kernel computation = %4.2e (s)' %(time.time() - start))
+    logging.debug('Null space size = %i' %len(idf))
+    return lu, idf, R
+
+def null_space_of_fixed_dofs(A,solve_rr,idf,tol=1.0e-8):
+    ''' This function computes the orthonormal null space of a positive
+    semi-definite matrix with the fixed dofs (f), which make the block Arr
+    of the remaining dofs regular
+
+        R = [ -Arr^-1 Arf ]
+            [      I      ]
+
+    Input:
+
+        A -> positive semi-definite csc matrix
+        solve_rr -> function which solves Arr x = b
+        idf -> list of the fixed dofs
+        tol -> relative tolerance of the kernel residual
+
+    Ouputs:
+        R -> orthonormal bases of the null space
+
+    A ValueError is raised if |A R| is not below tol*max|A_ii|.
+    '''
+    n = A.shape[0]
+    idr = np.setdiff1d(np.arange(n),idf)
+    R = np.zeros((n,len(idf)))
+    R[idf,:] = np.eye(len(idf))
+    R[idr,:] = -solve_rr(A[idr,:][:,idf].toarray())
+    R, _ = np.linalg.qr(R)
+
+    residual = np.abs(A.dot(R)).max()/np.abs(A.diagonal()).max()
+    if residual>tol:
+        raise ValueError('The computed null space is not a kernel, |A R|/max|A_ii| = %2.2e' %residual)
+    return R
+
+def rigid_body_modes(coordinates,dof_map=None,orthonormal=True):
+    ''' This function builds the rigid body modes of an elasticity problem
+    from the nodal coordinates, 3 modes in 2D (2 translations and the
+    rotation about z) and 6 modes in 3D (3 translations and 3 rotations)
+
+    argument
+        coordinates : np.array
+            array (n_nodes, dim) with the nodal coordinates, dim = 2 or 3
+        dof_map : np.array or pandas.DataFrame, Default = None
+            array (n_nodes, dim) with the dof index of every node and direction,
+            e.g. SelectionOperator.id_map_df. If None the dofs are numbered
+            node by node [u1x, u1y, u2x, u2y, ...]
+        orthonormal : Boolean, Default = True
+            return a orthonormal bases
+
+    return
+        R : np.array
+            array (n_dofs, n_modes) with the rigid body modes
+    '''
+    coordinates = np.asarray(coordinates,dtype=float)
+    n_nodes, dim = coordinates.shape
+    if dim not in (2,3):
+        raise ValueError('Rigid body modes are only available for dim = 2 or 3, not %i' %dim)
+
+    if dof_map is None:
+        dof_map = np.arange(n_nodes*dim).reshape(n_nodes,dim)
+    else:
+        dof_map = np.asarray(getattr(dof_map,'values',dof_map),dtype=int)[:,:dim]
+
+    # rotations about the centroid are better conditioned
+    x = coordinates - coordinates.mean(axis=0)
+    n_modes = 3*(dim-1)
+    R = np.zeros((dof_map.max()+1,n_modes))
+    for i in range(dim):
+        R[dof_map[:,i],i] = 1.0
+
+    # rotation axis and the two directions which are rotated
+    if dim==2:
+        rotations = [(0,1)]
+    else:
+        rotations = [(1,2),(2,0),(0,1)]
+
+    for mode_id, (i,j) in enumerate(rotations,dim):
+        R[dof_map[:,i],mode_id] = -x[:,j]
+        R[dof_map[:,j],mode_id] = x[:,i]
+
+    if orthonormal:
+        R, _ = np.linalg.qr(R)
+    return R
+
+def regularized_splu(A,R,tol=1.0e-8):
+    ''' This function factorizes a positive semi-definite matrix with a
+    known null space R without numerical rank detection. The columns of R
+    which are not in the kernel of A, e.g. rigid body modes of a subdomain
+    with Dirichlet boundary conditions, are removed with the tolerance
+    ||A r|| < tol*max(diag(A)). For the remaining kernel the fixing dofs
+    are selected by a pivoted QR of R^T, such that R[idf,:] is regular, and
+
+        A_reg = A + D_f
+
+    is factorized, where D_f is the diagonal of A at the fixing dofs. A_reg
+    is regular and A A_reg^-1 f = f for all f orthogonal to R.
+
+    Input:
+
+        A -> positive semi-definite matrix
+        R -> candidate bases of the null space, e.g. from rigid_body_modes
+        tol -> relative tolerance of the kernel check
+
+    Ouputs:
+        lu -> SuperLU object of A_reg
+        idf -> list of the fixing dofs
+        R -> orthonormal bases of the null space, empty array if A is regular
+    '''
+    if not isinstance(A,csc_matrix):
+        A = csc_matrix(A)
+
+    start = time.time()
+    A_diag = np.abs(A.diagonal())
+    R = restrict_to_kernel(A,R,tol=tol)
+
+    options = {'DiagPivotThresh': 0.0,'SymmetricMode':True}
+    if R.shape[1]==0:
+        lu = sla.splu(A,options=options)
+        return lu, [], np.array([])
+
+    idf = select_fixing_dofs(R)
+    D_f = sparse.csc_matrix((A_diag[idf],(idf,idf)),shape=A.shape)
+    lu = sla.splu(A + D_f,options=options)
+    logging.info('Time Duration of the regularized factorization = %4.2e (s)' %(time.time() - start))
+    logging.debug('Null space size = %i' %len(idf))
+    return lu, idf, R
+
+def restrict_to_kernel(A,R,tol=1.0e-8):
+    ''' This function returns an orthonormal bases of the subspace of R 
+    which is in the kernel of A, ||A r|| < tol*max(diag(A))
+
+    argument
+        A : sparse matrix
+            positive semi-definite matrix
+        R : np.array
+            candidate bases of the null space
+        tol : float
+            relative tolerance
+    
+    return
+        R : np.array
+            orthonormal bases (n, m) with m <= R.shape[1]
+    '''
+    R, _ = np.linalg.qr(R)
+    _, s, Vt = np.linalg.svd(A.dot(R),full_matrices=False)
+    return R.dot(Vt[s<tol*np.abs(A.diagonal()).max()].T)
+
+def select_fixing_dofs(R):
+    ''' This function selects one fixing dof per kernel vector by a
+    pivoted QR of R^T, such that R[idf,:] is regular and well conditioned.
+    Constraining the fixing dofs removes the rigid body motions.
+
+    argument
+        R : np.array
+            bases of the null space (n, m)
+    
+    return
+        idf : list
+            sorted list with the m fixing dofs
+    '''
+    _, _, pivots = linalg.qr(R.T,mode='economic',pivoting=True)
+    return np.sort(pivots[:R.shape[1]]).tolist()
+
+def sparse_cholesky(A):
+    ''' This function computes the sparse Cholesky factorization of a
+    symmetric positive definite matrix. CHOLMOD (scikit-sparse) is used if
+    it is installed, otherwise SuperLU in symmetric mode without pivoting,
+    which is a LDL^T factorization with the same fill-in.
+
+    argument
+        A : sparse matrix
+            symmetric positive definite matrix
+    
+    return
+        factor : cholmod Factor or SuperLU
+            factorization object, see factor_solve
+    '''
+    if cholmod_cholesky is not None:
+        return cholmod_cholesky(csc_matrix(A))
+    return sla.splu(csc_matrix(A),options={'DiagPivotThresh': 0.0,'SymmetricMode':True})
+
+def factor_solve(factor):
+    ''' return the function which solves A x = b with a factorization object,
+    SuperLU, TriangularFactors, cholmod Factor or a dense inverse matrix
+    '''
+    if isinstance(factor,np.ndarray):
+        return factor.dot
+    try:
+        return factor.solve
+    except AttributeError:
+        # cholmod Factor
+        return factor
+
+def factor_nnz(factor):
+    ''' number of nonzeros of the factors of a factorization object, see
+    factor_solve, which is the cost of one forward and back substitution
+    '''
+    if isinstance(factor,np.ndarray):
+        return factor.size
+    if isinstance(factor,SparseSchurFactors):
+        return factor_nnz(factor.factor)
+    if isinstance(factor,SchurFactors):
+        # two interior solves and the dense Schur complement
+        nnz = factor.V.size
+        if factor.interior_factor is not None:
+            nnz += 2*factor_nnz(factor.interior_factor)
+        return nnz
+    try:
+        # SuperLU and TriangularFactors
+        return sum(M.nnz if issparse(M) else np.count_nonzero(M) for M in [factor.L,factor.U])
+    except AttributeError:
+        # cholmod Factor, L and L^T
+        return 2*factor.L().nnz
+
+
+class TriangularFactors():
+    ''' Solver of A x = b with given triangular factors
+
+        Pr A Pc = L U
+
+    where the permutations are given as in SuperLU, Pr = I[perm_r,:].T and
+    Pc = I[:,perm_c].T. Sparse factors are solved by SuperLU objects of
+    L and U with natural ordering, which are computed without fill-in,
+    dense factors by LAPACK triangular solves. The last n_fixed pivots
+    of solve can be fixed, which solves the leading block of Pr A Pc.
+
+    Parameters:
+        L : np.array or sparse matrix
+            lower triangular factor
+        U : np.array or sparse matrix
+            upper triangular factor
+        perm_r : np.array, Default = None
+            row permutation, if None no permutation
+        perm_c : np.array, Default = None
+            column permutation, if None no permutation
+    '''
+    def __init__(self,L,U,perm_r=None,perm_c=None):
+        n = U.shape[0]
+        self.perm_r = np.arange(n) if perm_r is None else np.asarray(perm_r)
+        self.perm_c = np.arange(n) if perm_c is None else np.asarray(perm_c)
+        self.dense = not issparse(U)
+        if self.dense:
+            self.L = np.asarray(L)
+            self.U = np.asarray(U)
+        else:
+            options = {'DiagPivotThresh': 0.0}
+            self.L = csc_matrix(L)
+            self.U = csc_matrix(U)
+            self.lu_L = sla.splu(self.L,permc_spec='NATURAL',options=options)
+            self.lu_U = sla.splu(self.U,permc_spec='NATURAL',options=options)
+
+    @staticmethod
+    def factor2arrays(factor):
+        ''' dict with the arrays L, U, perm_r, perm_c of a SuperLU,
+        cholmod Factor or TriangularFactors object
+        '''
+        try:
+            return {'L' : factor.L, 'U' : factor.U, 'perm_r' : factor.perm_r, 'perm_c' : factor.perm_c}
+        except AttributeError:
+            # cholmod Factor, A[P,P] = L L^T
+            L = factor.L()
+            perm = np.argsort(factor.P())
+            return {'L' : L, 'U' : L.T, 'perm_r' : perm, 'perm_c' : perm}
+
+    def solve(self,b,n_fixed=0):
+        ''' solve A x = b, the unknowns of the last n_fixed pivots are fixed to zero
+        and the rows of the last n_fixed pivots are not solved
+        '''
+        b_perm = np.empty(b.shape)
+        b_perm[self.perm_r] = b
+        m = self.U.shape[0] - n_fixed
+        if self.dense:
+            z = linalg.solve_triangular(self.L,b_perm,lower=True)
+            z[m:] = 0.0
+            z[:m] = linalg.solve_triangular(self.U[:m,:m],z[:m],lower=False)
+        else:
+            z = self.lu_L.solve(b_perm)
+            z[m:] = 0.0
+            z = self.lu_U.solve(z)
+        return z[self.perm_c]
+
+
+class SchurFactors():
+    ''' Partial factorization of a positive semi-definite matrix with the
+    interface dofs (b) ordered last
+
+        A = [ Aii  Aib ]
+            [ Abi  Abb ]
+
+    Aii is factorized by SuperLU and the dense Schur complement of the
+    interface S = Abb - Abi Aii^-1 Aib is held in its spectral form 
+    S = V diag(w) V^T, where the null space eigenvalues are set to zero.
+    The solve is the generalized inverse
+
+        u_b = S^+ (f_b - Abi Aii^-1 f_i)
+        u_i = Aii^-1 (f_i - Aib u_b)
+
+    and the same factorization gives the interior solve Aii^-1 and the 
+    Schur complement action S u_b of the Dirichlet preconditioner.
+
+    Parameters:
+        interior_factor : SuperLU or TriangularFactors
+            factorization of Aii, None if there are no interior dofs
+        Aib : sparse matrix
+            interior-interface block
+        interior_dofs : np.array
+            interior dofs
+        interface_dofs : np.array
+            interface dofs
+        V : np.array
+            eigenvectors of S
+        w : np.array
+            eigenvalues of S, zero for the null space
+    '''
+    def __init__(self,interior_factor,Aib,interior_dofs,interface_dofs,V,w):
+        self.interior_factor = interior_factor
+        self.Aib = csc_matrix(Aib)
+        self.interior_dofs = np.asarray(interior_dofs,dtype=int)
+        self.interface_dofs = np.asarray(interface_dofs,dtype=int)
+        self.V = np.asarray(V)
+        self.w = np.asarray(w)
+        self.w_inv = np.zeros(self.w.shape)
+        self.w_inv[self.w!=0.0] = 1.0/self.w[self.w!=0.0]
+
+    def spectral_product(self,d,x):
+        d = d if np.ndim(x)==1 else d[:,None]
+        return self.V.dot(d*self.V.T.dot(x))
+
+    def apply_schur(self,u_b):
+        return self.spectral_product(self.w,u_b)
+
+    def solve_schur(self,f_b):
+        return self.spectral_product(self.w_inv,f_b)
+
+    def solve_interior(self,f_i):
+        if self.interior_factor is None:
+            return np.zeros(f_i.shape)
+        return self.interior_factor.solve(f_i)
+
+    def solve(self,f):
+        f = np.asarray(f,dtype=float)
+        f_i = f[self.interior_dofs]
+        u = np.empty(f.shape)
+        u_b = self.solve_schur(f[self.interface_dofs] - self.Aib.T.dot(self.solve_interior(f_i)))
+        u[self.interface_dofs] = u_b
+        u[self.interior_dofs] = self.solve_interior(f_i - self.Aib.dot(u_b))
+        return u
+
+    def factor2arrays(self):
+        arrays = {}
+        if self.interior_factor is not None:
+            arrays.update(TriangularFactors.factor2arrays(self.interior_factor))
+        arrays.update({'Aib' : self.Aib, 'interior_dofs' : self.interior_dofs,
+                       'interface_dofs' : self.interface_dofs, 'V' : self.V, 'w' : self.w})
+        return arrays
+
+    @staticmethod
+    def arrays2factor(arrays):
+        interior_factor = None
+        if 'L' in arrays:
+            interior_factor = TriangularFactors(arrays['L'],arrays['U'],arrays['perm_r'],arrays['perm_c'])
+        return SchurFactors(interior_factor,arrays['Aib'],arrays['interior_dofs'],arrays['interface_dofs'],
+                            arrays['V'],arrays['w'])
+
+
+class SparseSchurFactors(SchurFactors):
+    ''' Sparse LU factorization of a positive semi-definite matrix with the
+    interface dofs (b) ordered last
+
+        [ Aii  Aib ] = [ Lii   0  ] [ Uii  Uib ]
+        [ Abi  Abb ]   [ Lbi  Lbb ] [  0   Ubb ]
+
+    which holds the Schur complement of the interface in the sparse 
+    trailing blocks S = Abb - Abi Aii^-1 Aib = Lbb Ubb. The null space
+    pivots are the last n_fixed pivots, which are fixed in the generalized 
+    inverse. The same factorization gives the interior solve with the 
+    leading blocks, the Schur complement action S u_b = Lbb Ubb u_b of the
+    Dirichlet preconditioner and the generalized inverse of S.
+
+    Parameters:
+        factor : TriangularFactors
+            factorization with the interior dofs first and the interface dofs last
+        interior_dofs : np.array
+            interior dofs
+        interface_dofs : np.array
+            interface dofs
+        n_fixed : int
+            number of the fixed pivots, which are the last interface pivots
+    '''
+    def __init__(self,factor,interior_dofs,interface_dofs,n_fixed=0):
+        self.factor = factor
+        self.interior_dofs = np.asarray(interior_dofs,dtype=int)
+        self.interface_dofs = np.asarray(interface_dofs,dtype=int)
+        self.n_fixed = int(n_fixed)
+        # column and row positions of the interface dofs in the factors
+        self.interface_columns = self.factor.perm_c[self.interface_dofs]
+        self.interface_rows = self.factor.perm_r[self.interface_dofs]
+
+    def expand(self,x,dofs):
+        u = np.zeros((self.factor.U.shape[0],) + np.shape(x)[1:])
+        u[dofs] = x
+        return u
+
+    def apply_schur(self,u_b):
+        z = self.factor.U.dot(self.expand(u_b,self.interface_columns))
+        z[:self.interior_dofs.size] = 0.0
+        return self.factor.L.dot(z)[self.interface_rows]
+
+    def solve_schur(self,f_b):
+        return self.solve(self.expand(f_b,self.interface_dofs))[self.interface_dofs]
+
+    def solve_interior(self,f_i):
+        u = self.factor.solve(self.expand(f_i,self.interior_dofs),n_fixed=self.interface_dofs.size)
+        return u[self.interior_dofs]
+
+    def solve(self,f):
+        return self.factor.solve(np.asarray(f,dtype=float),n_fixed=self.n_fixed)
+
+    def factor2arrays(self):
+        arrays = TriangularFactors.factor2arrays(self.factor)
+        arrays.update({'interior_dofs' : self.interior_dofs, 'interface_dofs' : self.interface_dofs,
+                       'n_fixed' : np.array(self.n_fixed)})
+        return arrays
+
+    @staticmethod
+    def arrays2factor(arrays):
+        factor = TriangularFactors(arrays['L'],arrays['U'],arrays['perm_r'],arrays['perm_c'])
+        return SparseSchurFactors(factor,arrays['interior_dofs'],arrays['interface_dofs'],int(arrays['n_fixed']))
+
+
+def schur_factorization(A,interface_dofs,tol=1.0e-8,dense=False):
+    ''' This function computes the partial factorization of a positive 
+    semi-definite matrix with the interface dofs ordered last. The interior 
+    block is regular for any subdomain with an interface, such that the null
+    space is the null space of the Schur complement S:
+
+        R = [ -Aii^-1 Aib R_b ]
+            [        R_b      ]
+
+    By default A is factorized by one sparse LU with the interior dofs in 
+    the fill-reducing order of Aii and the interface dofs last, see 
+    SparseSchurFactors. The ordering is given by a SuperLU factorization of
+    Aii, which is not kept. The null space pivots are detected as in spkernel,
+    they are the last pivots of the interface. If a zero pivot is not at the
+    end, its dof is moved to the end and A is factorized again.
+
+    If dense is True, the dense S is computed by one multiple right hand side
+    solve with Aii and held in its spectral form by np.linalg.eigh, see
+    SchurFactors, which costs O(n_b^3) operations and O(n_b^2) memory with
+    n_b interface dofs and is only meant for small interfaces.
+
+    Input:
+
+        A -> positive semi-definite matrix
+        interface_dofs -> dofs ordered last, e.g. the interface dofs of a subdomain
+        tol -> relative tolerance of the zero pivots, or of the eigenvalues of S
+        dense -> hold the dense spectral S instead of the sparse factors
+
+    Ouputs:
+        factor -> SparseSchurFactors or SchurFactors object
+        idf -> empty list, no dof is fixed
+        R -> orthonormal bases of the null space, None if A is regular
+    '''
+    A = csc_matrix(A)
+    n = A.shape[0]
+    interface_dofs = np.unique(np.asarray(interface_dofs,dtype=int))
+    interior_dofs = np.setdiff1d(np.arange(n),interface_dofs)
+    A_interior = A[interior_dofs,:]
+    Aib = A_interior[:,interface_dofs].tocsc()
+
+    interior_factor = None
+    if interior_dofs.size>0:
+        interior_factor = sla.splu(A_interior[:,interior_dofs].tocsc(),permc_spec='MMD_AT_PLUS_A',
+                                   options={'SymmetricMode':True})
+
+    if dense:
+        return dense_schur_factorization(A,interior_factor,Aib,interior_dofs,interface_dofs,tol=tol)
+
+    interior_order = interior_dofs
+    if interior_factor is not None:
+        interior_order = interior_dofs[np.argsort(interior_factor.perm_c)]
+        interior_factor = None
+
+    options = {'DiagPivotThresh': 0.0,'SymmetricMode':True}
+    A_diag = np.abs(A.diagonal())
+    interface_order = interface_dofs
+    for i in range(2):
+        order = np.concatenate([interior_order,interface_order])
+        A_order = A[order,:][:,order].tocsc()
+        try:
+            lu = sla.splu(A_order,permc_spec='NATURAL',options=options)
+        except RuntimeError:
+            # exactly singular, the perturbed zero pivots are still below the tolerance
+            lu = sla.splu(A_order + sparse.diags(1.0E-14*A_diag[order],format='csc'),
+                          permc_spec='NATURAL',options=options)
+
+        pivot_dofs = order[np.argsort(lu.perm_c)]
+        null_index = np.abs(lu.U.diagonal())<tol*A_diag[pivot_dofs]
+        idf = pivot_dofs[null_index]
+        if np.isin(idf,interior_dofs).any():
+            raise ValueError('The interior block of the schur factorization is singular')
+        n_fixed = idf.size
+        if n_fixed==0 or null_index[n-n_fixed:].all():
+            break
+        interface_order = np.concatenate([np.setdiff1d(interface_dofs,idf),idf])
+
+    perm = np.argsort(order)
+    factor = TriangularFactors(lu.L,lu.U,lu.perm_r[perm],lu.perm_c[perm])
+    factor = SparseSchurFactors(factor,interior_dofs,interface_dofs,n_fixed)
+
+    R = None
+    if n_fixed>0:
+        R = np.zeros((n,n_fixed))
+        R[idf,:] = np.eye(n_fixed)
+        R -= factor.solve(A[:,idf].toarray())
+        R = np.linalg.qr(R)[0]
+
+        residual = np.abs(A.dot(R)).max()/A_diag.max()
+        if residual>tol:
+            raise ValueError('The computed null space is not a kernel, |A R|/max|A_ii| = %2.2e' %residual)
+
+    return factor, [], R
+
+def dense_schur_factorization(A,interior_factor,Aib,interior_dofs,interface_dofs,tol=1.0e-8):
+    ''' dense spectral Schur complement of schur_factorization, see SchurFactors
+    '''
+    n = A.shape[0]
+    S = A[interface_dofs,:][:,interface_dofs].toarray()
+    if interior_factor is not None:
+        S -= Aib.T.dot(interior_factor.solve(Aib.toarray()))
+
+    w, V = np.linalg.eigh(0.5*(S + S.T))
+    null_index = w<=tol*max(np.abs(w).max(),1.0e-300)
+    w[null_index] = 0.0
+    factor = SchurFactors(interior_factor,Aib,interior_dofs,interface_dofs,V,w)
+
+    R = None
+    if null_index.any():
+        R_b = V[:,null_index]
+        R = np.zeros((n,R_b.shape[1]))
+        R[interface_dofs] = R_b
+        R[interior_dofs] = -factor.solve_interior(Aib.dot(R_b))
+        R = np.linalg.qr(R)[0]
+
+    return factor, [], R
+
+
+def factor2arrays(factor,idf,R):
+    ''' dict of arrays which stores a factorization object, the fixed dofs
+    and the null space, e.g. in a FactorizationCache, see arrays2factor
+    '''
+    if isinstance(factor,np.ndarray):
+        arrays = {'K_inv' : factor}
+    elif isinstance(factor,SchurFactors):
+        arrays = factor.factor2arrays()
+    else:
+        arrays = TriangularFactors.factor2arrays(factor)
+    arrays['idf'] = np.array(idf,dtype=int)
+    arrays['R'] = np.array([]) if R is None else R
+    return arrays
+
+def arrays2factor(arrays):
+    ''' factorization object, fixed dofs and null space of a dict
+    of arrays given by factor2arrays
+    '''
+    if 'K_inv' in arrays:
+        factor = arrays['K_inv']
+    elif 'V' in arrays:
+        factor = SchurFactors.arrays2factor(arrays)
+    elif 'n_fixed' in arrays:
+        factor = SparseSchurFactors.arrays2factor(arrays)
+    else:
+        factor = TriangularFactors(arrays['L'],arrays['U'],arrays['perm_r'],arrays['perm_c'])
+    return factor, arrays['idf'].tolist(), arrays['R']
+
+def fixing_dofs_factorization(A,R=None,tol=1.0e-8):
+    ''' This function computes a generalized inverse of a positive semi-definite
+    matrix by the fixing dofs regularization. The fixing dofs (f) are selected
+    from a given null space R by select_fixing_dofs, which makes the block Arr of 
+    the remaining dofs regular, then
+
+        A_pinv = [ Arr^-1  0 ]
+                 [   0     0 ]
+
+    satisfies A A_pinv f = f for all f orthogonal to R, such that no 
+    projection with R is needed in the solve. Arr is factorized by a 
+    sparse Cholesky.
+
+    If R is None, the zero pivots of spkernel are the fixing dofs. Only the
+    pivot detection of spkernel is used and R is computed with the Cholesky
+    factorization of Arr, such that A is factorized twice.
+
+    Input:
+
+        A -> positive semi-definite matrix
+        R -> bases of the null space, e.g. from rigid_body_modes. If None
+             the null space is detected by the zero pivots of spkernel
+        tol -> relative tolerance of the kernel detection
+
+    Ouputs:
+        factor -> Cholesky factorization of Arr, or of A if A is regular
+        idf -> list of the fixing dofs
+        R -> orthonormal bases of the null space, empty array if A is regular
+    '''
+    if not isinstance(A,csc_matrix):
+        A = csc_matrix(A)
+
+    if R is None:
+        _, idf, _ = spkernel(A,tol=tol,kernel_only=True)
+    else:
+        R = restrict_to_kernel(A,R,tol=tol)
+        idf = select_fixing_dofs(R) if R.shape[1]>0 else []
+
+    start = time.time()
+    if not len(idf):
+        return sparse_cholesky(A), [], np.array([])
+
+    idr = np.setdiff1d(np.arange(A.shape[0]),idf)
+    factor = sparse_cholesky(A[idr,:][:,idr])
+    if R is None:
+        R = null_space_of_fixed_dofs(A,factor_solve(factor),idf,tol=tol)
+
+    logging.info('Time Duration of the fixing dofs factorization = %4.2e (s)' %(time.time() - start))
+    logging.debug('Null space size = %i' %len(idf))
+    return factor, idf, R
+
 #@profile
 def calc_null_space_of_upper_trig_matrix(U,idf=None,orthonormal=True):
     ''' This function computer the Null space of
@@ -306,6 +1040,47 @@ def is_null_space(K,v, tol=1.0E-3):
         return False
 
 
+def blockdot(V,W):
+    ''' matrix of the dot products of all the columns of 
+    the 2D arrays V and W, i.e. V^T W
+    '''
+    return V.T.dot(W)
+
+def coldot(v,w):
+    ''' dot product of two arrays, if v and w are 2D arrays
+    the dot product is computed column by column, returning
+    an array with one entry per column
+    '''
+    if np.ndim(v)<2:
+        return np.dot(v,w)
+    return np.einsum('ij,ij->j',v,w)
+
+class ReductionRequest():
+    ''' handle of a (possible non-blocking) reduction,
+    the reduced values are returned by wait()
+    '''
+    def __init__(self,values):
+        self.values = values
+
+    def wait(self):
+        return self.values
+
+def ivdot(pairs):
+    ''' fused dot products of a list of pairs [(v1,w1), (v2,w2), ...]
+    returning a ReductionRequest, such that wait() gives the array
+    [v1.dot(w1), v2.dot(w2), ...]. This is the serial counterpart of
+    MPIlinalg.parivdot where all the dot products are reduced in one
+    non-blocking message
+    '''
+    return ReductionRequest(np.array([coldot(v,w) for v,w in pairs]))
+
+def get_trailing_shape(v_dict):
+    ''' shape of the columns of the arrays in a dict, () for 1D arrays
+    '''
+    for item in v_dict.values():
+        return np.shape(item)[1:]
+    return ()
+
 def vector2localdict(v,map_dict):
     ''' converts an array to a dict
     based on map_dict such that map_dict[global_index] = key
@@ -331,12 +1106,45 @@ def localdict2array(v_dict,length,map_dict):
     ''' converts an array to a dict
     based on map_dict such that map_dict[key] = global_index
     '''
-    v = np.zeros(length)
+    v = np.zeros((length,) + get_trailing_shape(v_dict))
     for interface_id, global_index in map_dict.items():
         v[global_index] += v_dict[interface_id]
 
     return v
 
+def block_coo_matrix(block_list,shape,dtype=np.float64):
+    ''' assemble a sparse matrix from a list of blocks [(row_dofs, column_dofs, M), ...]
+    with one COO triplet assembly. The triplet arrays are preallocated from the
+    block sizes, dense blocks contribute all their entries and sparse blocks
+    their nonzero entries. Entries of overlapping blocks are summed.
+
+    return 
+        A : csc_matrix
+    '''
+    block_list = [(np.asarray(row_dofs),np.asarray(column_dofs),M) for row_dofs, column_dofs, M in block_list]
+    nnz = sum(M.nnz if issparse(M) else np.size(M) for _, _, M in block_list)
+    rows = np.empty(nnz,dtype=np.int64)
+    columns = np.empty(nnz,dtype=np.int64)
+    data = np.empty(nnz,dtype=dtype)
+
+    start = 0
+    for row_dofs, column_dofs, M in block_list:
+        if issparse(M):
+            M = M.tocoo()
+            block_rows, block_columns, block_data = row_dofs[M.row], column_dofs[M.col], M.data
+        else:
+            M = np.asarray(M).reshape(len(row_dofs),len(column_dofs))
+            block_rows = np.repeat(row_dofs,len(column_dofs))
+            block_columns = np.tile(column_dofs,len(row_dofs))
+            block_data = M.ravel()
+        end = start + len(block_data)
+        rows[start:end] = block_rows
+        columns[start:end] = block_columns
+        data[start:end] = block_data
+        start = end
+
+    return sparse.coo_matrix((data,(rows,columns)),shape=shape).tocsc()
+
 
 class RetangularLinearOperator(LinearOperator):
     def __init__(self,A_dict,row_map_dict,column_map_dict,shape=(0,0),dtype=np.float):
@@ -362,7 +1170,7 @@ class RetangularLinearOperator(LinearOperator):
         # convert vector to dict    
         v_dict = self.vec2dict(v, **kwargs)
 
-        a = np.zeros(self.shape[0])
+        a = np.zeros((self.shape[0],) + np.shape(v)[1:])
         for (i,j), A in self.A_dict.items():
             if j>=i:
                 pair = (i,j)
@@ -378,6 +1186,10 @@ class RetangularLinearOperator(LinearOperator):
         
         return self._callback(a)
 
+    def _matmat(self,V):
+        # _matvec supports 2D arrays, so the block is multiplied at once
+        return self._matvec(V)
+
     def _transpose(self):
         return RetangularLinearOperator(self.A_dict,self.column_map_dict,self.row_map_dict,
                                         shape=(self.shape[1],self.shape[0]),dtype=self.dtype)
@@ -743,18 +1555,35 @@ class Pseudoinverse():
     u = K_pinvf + alpha*R
     
     argument
-        K : np.array
-            matrix to be inverted
-        tol : float
+        method : str, Default = 'spkernel'
+            one of list_of_solvers
+        tolerance : float
             float tolerance for building the null space
+        svd_max_size : int, Default = 2500
+            matrices larger than svd_max_size are not inverted by the dense svd,
+            the spkernel is used instead. If None the svd is always used
+        dense_schur : Boolean, Default = False
+            the 'schur' method holds the dense spectral Schur complement of the
+            interface instead of the sparse factors, see schur_factorization
+        dense_schur_max_size : int, Default = 1000
+            interfaces larger than dense_schur_max_size do not use the dense 
+            Schur complement, the sparse factors are used instead. If None 
+            the dense Schur complement is always used with dense_schur
+        cache_dir : str, Default = None
+            folder of a FactorizationCache, if given the factorizations and null
+            spaces are loaded from the cache when the same matrix, method and 
+            tolerance were already factorized
+        cache_size : int, Default = 2**30
+            maximum size of the cache in bytes
         
     return:
         K_pinv : object
         object containg the null space and the inverse operator
     '''
-    def __init__(self,method='splusps',tolerance=1.0E-8):
+    def __init__(self,method='spkernel',tolerance=1.0E-8,svd_max_size=2500,dense_schur=False,
+                 dense_schur_max_size=1000,cache_dir=None,cache_size=2**30):
         
-        self.list_of_solvers = ['cholsps','splusps','svd']
+        self.list_of_solvers = ['cholsps','splusps','svd','spkernel','fixing','schur']
         if method not in self.list_of_solvers:
             raise('Selection method not avalible, please selection one in the following list :' %(self.list_of_solvers))
 
@@ -762,8 +1591,16 @@ class Pseudoinverse():
         self.pinv = None
         self.null_space = np.array([])
         self.free_index = []
-        self.tolerance = 1.0E-8
+        self.tolerance = tolerance
+        self.svd_max_size = svd_max_size
+        self.dense_schur = dense_schur
+        self.dense_schur_max_size = dense_schur_max_size
         self.matrix = None
+        self.factor = None
+        self.factor_nnz = 0
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = FactorizationCache(cache_dir,max_size=cache_size)
     
     def set_tolerance(self,tol):
         ''' setting P_inverse tolerance
@@ -793,8 +1630,23 @@ class Pseudoinverse():
             raise('Error! Select solver is not implemented. ' + \
             '\n Please check list_of_solvers variable.')
         
-    def compute(self,K,tol=None,solver_opt=None):
+    def compute(self,K,tol=None,solver_opt=None,null_space=None,interface_dofs=None):
         ''' This method computes the kernel and inverse operator
+
+        argument
+            K : matrix
+                positive semi-definite matrix
+            tol : float, Default = None
+                tolerance, if None self.tolerance is used
+            solver_opt : str, Default = None
+                method, if None self.solver_opt is used
+            null_space : np.array, Default = None
+                known bases of the null space, e.g. rigid body modes. If given
+                the numerical rank detection of the method is skipped and 
+                K is factorized by regularized_splu, or by fixing_dofs_factorization
+                if the method is 'fixing'
+            interface_dofs : np.array, Default = None
+                dofs ordered last by the 'schur' method, see schur_factorization
         '''
         
         # store matrix to future use
@@ -806,40 +1658,138 @@ class Pseudoinverse():
         if tol is None:
             tol = self.tolerance
 
-        if solver_opt=='splusps':
-            lu, idf, R = splusps(K,tol=tol)
+        if solver_opt=='svd' and self.svd_max_size is not None and K.shape[0]>self.svd_max_size:
+            logging.warning('Dense svd of a matrix with %i rows is not used, spkernel is used instead. ' 
+                            'Increase svd_max_size to use svd.' %K.shape[0])
+            solver_opt = 'spkernel'
+
+        if solver_opt=='schur' and interface_dofs is None:
+            logging.warning('The schur method needs the interface dofs, spkernel is used instead.')
+            solver_opt = 'spkernel'
+
+        dense_schur = solver_opt=='schur' and self.dense_schur
+        if dense_schur and self.dense_schur_max_size is not None:
+            n_interface = np.unique(interface_dofs).size
+            if n_interface>self.dense_schur_max_size:
+                logging.warning('Dense Schur complement of an interface with %i dofs is not used, the sparse '
+                                'factors are used instead. Increase dense_schur_max_size to use it.' %n_interface)
+                dense_schur = False
+
+        if null_space is not None and solver_opt not in ['fixing','schur']:
+            solver_opt = 'null_space'
+
+        arrays = None
+        if self.cache is not None:
+            cache_key = self.cache.key(K,'dense_schur' if dense_schur else solver_opt,tol,null_space,interface_dofs)
+            arrays = self.cache.load(cache_key)
+
+        if arrays is not None:
+            factor, idf, R = arrays2factor(arrays)
+        else:
+            factor, idf, R = self.factorize(K,solver_opt,tol,null_space,interface_dofs,dense_schur)
+            if self.cache is not None:
+                self.cache.save(cache_key,factor2arrays(factor,idf,R))
+
+        self.pinv = self.build_pinv(solver_opt,factor_solve(factor),idf,R,K.shape[0])
+        self.factor = factor
+        self.factor_nnz = factor_nnz(factor)
+        self.free_index = idf
+        if R is not None:
+            self.null_space = R
+        else:
+            self.null_space = np.array([])
             
-            # add constraint in K matrix and applu SuperLu again
-            if len(idf):
-                Pr = lambda x : x - R.dot(R.T.dot(x))
-            else:
-                Pr = lambda x : x 
-                
-            K_pinv = lambda x : Pr(lu.solve(x))
+        return self
+
+    def factorize(self,K,solver_opt,tol,null_space=None,interface_dofs=None,dense_schur=False):
+        ''' factorization of K with the method solver_opt
+
+        return 
+            factor : object
+                factorization object, see factor_solve. For the 'spkernel' and 'fixing'
+                methods it is the factorization of the block of the dofs which are not fixed
+            idf : list
+                fixed dofs
+            R : np.array
+                null space
+        '''
+        if solver_opt=='splusps':
+            factor, idf, R = splusps(K,tol=tol)
             
         elif solver_opt=='cholsps':
             U,idf,R =cholsps(K,tol=tol)
-            U[idf,:] = 0.0
-            U[:,idf] = 0.0
-            U[idf,idf] = 1.0
-            K_pinv = lambda f : linalg.cho_solve((U,False),f) 
+            if issparse(U):
+                fixed = np.zeros(U.shape[0])
+                fixed[idf] = 1.0
+                D = sparse.diags(1.0 - fixed)
+                U = (D.dot(U).dot(D) + sparse.diags(fixed)).tocsc()
+            else:
+                U[idf,:] = 0.0
+                U[:,idf] = 0.0
+                U[idf,idf] = 1.0
+            factor = TriangularFactors(U.T,U)
             
         elif solver_opt=='svd':
             K_inv, R = pinv_and_null_space_svd(K,tol=tol)
-            K_pinv = np.array(K_inv).dot
+            factor = np.array(K_inv)
             idf = []
+
+        elif solver_opt=='spkernel':
+            factor, idf, R = spkernel(K,tol=tol)
+
+        elif solver_opt=='fixing':
+            factor, idf, R = fixing_dofs_factorization(K,null_space,tol=tol)
+
+        elif solver_opt=='null_space':
+            factor, idf, R = regularized_splu(K,null_space,tol=tol)
+
+        elif solver_opt=='schur':
+            factor, idf, R = schur_factorization(K,interface_dofs,tol=tol,dense=dense_schur)
         
         else:
             raise('Solver %s not implement. Check list_of_solvers.')
-        
-        self.pinv = K_pinv
-        self.free_index = idf
-        if R is not None:
-            self.null_space = R
+
+        return factor, idf, R
+
+    def build_pinv(self,solver_opt,solve,idf,R,n):
+        ''' build the pseudoinverse operator of the method solver_opt
+        with the solve function of the factorization
+        '''
+        if not len(idf):
+            return solve
+
+        Pr = lambda x : x - R.dot(R.T.dot(x))
+        idr = np.setdiff1d(np.arange(n),idf)
+
+        def solve_rr(f):
+            u = np.zeros(f.shape)
+            u[idr] = solve(f[idr])
+            return u
+
+        if solver_opt=='splusps':
+            K_pinv = lambda x : Pr(solve(x))
+
+        elif solver_opt=='cholsps':
+            def K_pinv(f):
+                # the zero pivot dofs are fixed, u[idf] = 0
+                f = np.array(f,dtype=float)
+                f[idf] = 0.0
+                return solve(f)
+
+        elif solver_opt=='spkernel':
+            # the projections give the Moore-Penrose pseudoinverse
+            K_pinv = lambda f : Pr(solve_rr(Pr(f)))
+
+        elif solver_opt=='fixing':
+            K_pinv = solve_rr
+
+        elif solver_opt=='null_space':
+            K_pinv = lambda f : Pr(solve(Pr(f)))
+
         else:
-            self.null_space = np.array([])
-            
-        return self
+            K_pinv = solve
+
+        return K_pinv
         
     def apply(self,f,alpha=np.array([]),check=False):
         ''' function to apply K_pinv
@@ -848,9 +1798,11 @@ class Pseudoinverse():
         
         argument  
             f : np.array
-                right hand side of the equation 
+                right hand side of the equation, 1D array or 2D array (n, m)
+                with m right hand sides which are solved by one call of 
+                the factorization
             alpha : np.array
-                combination of the kernel of K alpha*R
+                combination of the kernel of K alpha*R, (k,) or (k, m) 
             check : boolean
                 check if f is orthogonal to the null space
         '''
@@ -942,9 +1894,18 @@ class Matrix():
     '''
     counter = 0
 
-    def __init__(self,K,key_dict={},name=None,pseudoinverse_kargs={'method':'svd','tolerance':1.0E-8}):
+    def __init__(self,K,key_dict={},name=None,pseudoinverse_kargs={'method':'spkernel','tolerance':1.0E-8},
+                 coordinates=None,dof_map=None,interface_dofs=None):
         '''
         pseudoinverse_key_args=(method='splusps',tolerance=1.0E-8)
+
+        coordinates : np.array, Default = None
+            nodal coordinates (n_nodes, dim), if given the kernel is built from 
+            the rigid body modes instead of the numerical rank detection
+        dof_map : np.array or pandas.DataFrame, Default = None
+            dof index of every node and direction, see rigid_body_modes
+        interface_dofs : np.array, Default = None
+            dofs ordered last by the 'schur' pseudoinverse method
         '''
         Matrix.counter+=1
         self.id = Matrix.counter
@@ -958,6 +1919,10 @@ class Matrix():
         self.eliminated_id = set()
         self.psudeoinverve = Pseudoinverse(**pseudoinverse_kargs)
         self.inverse_computed = False
+        self.rigid_body_modes = None
+        self.interface_dofs = interface_dofs
+        if coordinates is not None:
+            self.rigid_body_modes = rigid_body_modes(coordinates,dof_map)
         if name is None:
             self.update_name()
         else:
@@ -1004,7 +1969,7 @@ class Matrix():
         based on the pseudoinverse algorithm
         '''
         if not self.inverse_computed:
-            self.psudeoinverve.compute(self.data)
+            self.psudeoinverve.compute(self.data,null_space=self.rigid_body_modes,interface_dofs=self.interface_dofs)
             self.inverse_computed = True
             
         return self.psudeoinverve.null_space
@@ -1013,7 +1978,7 @@ class Matrix():
     def apply_inverse(self, b):
         
         if not self.inverse_computed:
-            self.psudeoinverve.compute(self.data)
+            self.psudeoinverve.compute(self.data,null_space=self.rigid_body_modes,interface_dofs=self.interface_dofs)
             self.inverse_computed = True
     
         return self.psudeoinverve.pinv(b)
@@ -1220,6 +2185,226 @@ class  Test_linalg(TestCase):
             np.testing.assert_almost_equal(error,error_target,decimal=10)
             np.testing.assert_almost_equal(R.T.dot(x)/np.linalg.norm(x),0.0,decimal=10)
 
+    def test_spkernel(self):
+        K = load_object(pyfeti_dir(os.path.join('cases','matrices','case_162','K.pkl')))
+        n = K.shape[0]
+        f = np.random.RandomState(0).rand(n)
+
+        Kinv, R_svd = pinv_and_null_space_svd(K,tol=1.0E-8)
+        x_target = np.array(Kinv.dot(f)).flatten()
+
+        lu, idf, R = spkernel(K,tol=1.0E-8)
+        self.assertEqual(R.shape,R_svd.shape)
+        np.testing.assert_almost_equal(K.dot(R)/K.diagonal().max(),0.0,decimal=12)
+        np.testing.assert_almost_equal(R.T.dot(R),np.eye(R.shape[1]),decimal=12)
+        lu_K, idf_K, R_K = spkernel(K,tol=1.0E-8,kernel_only=True)
+        self.assertEqual(idf_K,idf)
+        self.assertEqual(lu_K.shape,K.shape)
+        self.assertIsNone(R_K)
+
+        pinv = Pseudoinverse(method='spkernel',tolerance=1.0E-8).compute(K)
+        x = pinv.apply(f)
+        np.testing.assert_almost_equal(x/np.linalg.norm(x_target),x_target/np.linalg.norm(x_target),decimal=8)
+
+        # symmetric permutations, the zero pivots are mapped back to the dofs
+        random_state = np.random.RandomState(1)
+        for i in range(20):
+            p = random_state.permutation(n)
+            K_perm = K[p,:][:,p].tocsc()
+            lu, idf, R = spkernel(K_perm,tol=1.0E-8)
+            self.assertEqual(R.shape,R_svd.shape)
+            np.testing.assert_almost_equal(K_perm.dot(R)/K.diagonal().max(),0.0,decimal=12)
+            x = Pseudoinverse(method='spkernel',tolerance=1.0E-8).compute(K_perm).apply(f[p])
+            np.testing.assert_almost_equal(x/np.linalg.norm(x_target),x_target[p]/np.linalg.norm(x_target),decimal=8)
+
+        # regular matrix
+        K_reg = K + sparse.diags(K.diagonal())
+        lu, idf, R = spkernel(K_reg)
+        self.assertEqual(idf,[])
+        np.testing.assert_almost_equal(K_reg.dot(lu.solve(f)),f,decimal=8)
+
+        # svd is not used for matrices larger than svd_max_size
+        pinv = Pseudoinverse(method='svd',svd_max_size=100).compute(K)
+        self.assertEqual(len(pinv.free_index),R_svd.shape[1])
+
+    def test_rigid_body_modes(self):
+        K = load_object(pyfeti_dir(os.path.join('cases','matrices','case_162','K.pkl')))
+        s = load_object(pyfeti_dir(os.path.join('cases','matrices','case_162','selectionOperator.pkl')))
+        n = K.shape[0]
+        f = np.random.RandomState(0).rand(n)
+
+        # 9 x 9 nodes of a square grid
+        node_id = np.arange(s.id_map_df.shape[0])
+        coordinates = np.array([node_id%9,node_id//9]).T
+        R = rigid_body_modes(coordinates,s.id_map_df)
+        self.assertEqual(R.shape,(n,3))
+        np.testing.assert_almost_equal(K.dot(R)/K.diagonal().max(),0.0,decimal=12)
+        np.testing.assert_almost_equal(rigid_body_modes(coordinates),R,decimal=12)
+
+        R_3D = rigid_body_modes(np.random.RandomState(1).rand(5,3))
+        self.assertEqual(R_3D.shape,(15,6))
+        self.assertEqual(np.linalg.matrix_rank(R_3D),6)
+
+        Kinv, R_svd = pinv_and_null_space_svd(K,tol=1.0E-8)
+        x_target = np.array(Kinv.dot(f)).flatten()
+        K_obj = Matrix(K,coordinates=coordinates,dof_map=s.id_map_df)
+        x = K_obj.apply_inverse(f)
+        self.assertEqual(len(K_obj.psudeoinverve.free_index),3)
+        np.testing.assert_almost_equal(x/np.linalg.norm(x_target),x_target/np.linalg.norm(x_target),decimal=8)
+
+        # with Dirichlet boundary conditions the rigid body modes are not in the kernel
+        K_dir = Matrix(K,s.selection_dict).eliminate_by_identity('left')
+        pinv = Pseudoinverse().compute(K_dir,null_space=R)
+        self.assertEqual(pinv.free_index,[])
+        np.testing.assert_almost_equal(K_dir.dot(pinv.apply(f)),f,decimal=8)
+
+    def test_fixing_dofs_factorization(self):
+        K = load_object(pyfeti_dir(os.path.join('cases','matrices','case_162','K.pkl')))
+        s = load_object(pyfeti_dir(os.path.join('cases','matrices','case_162','selectionOperator.pkl')))
+        n = K.shape[0]
+        node_id = np.arange(s.id_map_df.shape[0])
+        R_rbm = rigid_body_modes(np.array([node_id%9,node_id//9]).T,s.id_map_df)
+
+        f = np.random.RandomState(0).rand(n)
+        f -= R_rbm.dot(R_rbm.T.dot(f))
+        for null_space in [None,R_rbm]:
+            pinv = Pseudoinverse(method='fixing').compute(K,null_space=null_space)
+            R = pinv.null_space
+            self.assertEqual(R.shape,(n,3))
+            if null_space is None:
+                # the zero pivots of the kernel detection are fixed
+                self.assertEqual(pinv.free_index,spkernel(K,kernel_only=True)[1])
+            else:
+                self.assertEqual(pinv.free_index,select_fixing_dofs(R))
+            np.testing.assert_almost_equal(K.dot(R)/K.diagonal().max(),0.0,decimal=12)
+            u = pinv.apply(f)
+            np.testing.assert_almost_equal(u[pinv.free_index],0.0,decimal=12)
+            np.testing.assert_almost_equal(K.dot(u)/np.linalg.norm(f),f/np.linalg.norm(f),decimal=8)
+
+        # multiple right hand sides and a regular matrix
+        F = np.array([f,2.0*f]).T
+        np.testing.assert_almost_equal(pinv.apply(F)[:,1],2.0*u,decimal=10)
+        K_reg = K + sparse.diags(K.diagonal())
+        pinv = Pseudoinverse(method='fixing').compute(K_reg)
+        self.assertEqual(pinv.free_index,[])
+        np.testing.assert_almost_equal(K_reg.dot(pinv.apply(f)),f,decimal=8)
+
+    def test_cholsps(self):
+        K = load_object(pyfeti_dir(os.path.join('cases','matrices','case_162','K.pkl')))
+        n = K.shape[0]
+        K_max = K.diagonal().max()
+
+        # banded sparse path and dense path with several blocks
+        U_sparse, idf_sparse, R_sparse = cholsps(K,block_size=16)
+        U, idf, R = cholsps(K.toarray(),block_size=16)
+        self.assertTrue(issparse(U_sparse))
+        self.assertEqual(idf_sparse,idf)
+        self.assertEqual(len(idf),3)
+        np.testing.assert_almost_equal(U_sparse.toarray()/K_max,U/K_max,decimal=12)
+        np.testing.assert_almost_equal(U.T.dot(U)/K_max,K.toarray()/K_max,decimal=12)
+        np.testing.assert_almost_equal(K.dot(R)/K_max,0.0,decimal=10)
+        np.testing.assert_almost_equal(R_sparse,R,decimal=8)
+
+        f = np.random.RandomState(0).rand(n)
+        R_orth = linalg.orth(R)
+        f -= R_orth.dot(R_orth.T.dot(f))
+        for K_input in [K,K.toarray()]:
+            u = Pseudoinverse(method='cholsps').compute(K_input).apply(f)
+            np.testing.assert_almost_equal(K.dot(u)/np.linalg.norm(f),f/np.linalg.norm(f),decimal=8)
+
+        # not positive semi-definite
+        U, idf, R = cholsps(-np.eye(4))
+        self.assertEqual(idf,[])
+        self.assertIsNone(R)
+
+    def test_schur_factorization(self):
+        import tempfile, shutil
+        K = load_object(pyfeti_dir(os.path.join('cases','matrices','case_162','K.pkl')))
+        s = load_object(pyfeti_dir(os.path.join('cases','matrices','case_162','selectionOperator.pkl')))
+        n = K.shape[0]
+        node_id = np.arange(s.id_map_df.shape[0])
+        x, y = node_id%9, node_id//9
+        interface_dofs = s.id_map_df.values[(x==8) | (y==0)].ravel()
+        interior_dofs = np.setdiff1d(np.arange(n),interface_dofs)
+
+        pinv = Pseudoinverse(method='schur').compute(K,interface_dofs=interface_dofs)
+        R = pinv.null_space
+        self.assertEqual(R.shape,(n,3))
+        np.testing.assert_almost_equal(K.dot(R)/K.diagonal().max(),0.0,decimal=12)
+        f = np.random.RandomState(0).rand(n,2)
+        f -= R.dot(R.T.dot(f))
+        np.testing.assert_almost_equal(K.dot(pinv.apply(f))/np.linalg.norm(f),f/np.linalg.norm(f),decimal=8)
+
+        # the same factorization solves the interior problem and applies the Schur complement
+        factor = pinv.factor
+        Kii = K[np.ix_(interior_dofs,interior_dofs)].toarray()
+        Kib = K[np.ix_(interior_dofs,interface_dofs)].toarray()
+        S = K[np.ix_(interface_dofs,interface_dofs)].toarray() - Kib.T.dot(np.linalg.solve(Kii,Kib))
+        ub = np.random.RandomState(1).rand(len(interface_dofs))
+        np.testing.assert_allclose(factor.apply_schur(ub),S.dot(ub),rtol=1.0e-8,atol=1.0e-8*np.abs(S).max())
+        np.testing.assert_almost_equal(Kii.dot(factor.solve_interior(f[interior_dofs])),f[interior_dofs],decimal=8)
+
+        fb = S.dot(ub)
+        np.testing.assert_almost_equal(S.dot(factor.solve_schur(fb))/np.linalg.norm(fb),fb/np.linalg.norm(fb),decimal=8)
+
+        # the dense spectral S is opt-in and falls back to the sparse factors for large interfaces
+        self.assertIsInstance(factor,SparseSchurFactors)
+        dense_pinv = Pseudoinverse(method='schur',dense_schur=True).compute(K,interface_dofs=interface_dofs)
+        self.assertNotIsInstance(dense_pinv.factor,SparseSchurFactors)
+        np.testing.assert_allclose(dense_pinv.factor.apply_schur(ub),S.dot(ub),rtol=1.0e-8,atol=1.0e-8*np.abs(S).max())
+        with self.assertLogs(level='WARNING'):
+            dense_pinv = Pseudoinverse(method='schur',dense_schur=True,dense_schur_max_size=10).compute(K,interface_dofs=interface_dofs)
+        self.assertIsInstance(dense_pinv.factor,SparseSchurFactors)
+
+        # cached factors and the fallback without interface dofs
+        cache_dir = tempfile.mkdtemp()
+        for dense_schur in [False,False,True,True]:
+            pinv = Pseudoinverse(method='schur',dense_schur=dense_schur,cache_dir=cache_dir).compute(K,interface_dofs=interface_dofs)
+            self.assertEqual(isinstance(pinv.factor,SparseSchurFactors),not dense_schur)
+            np.testing.assert_allclose(pinv.factor.apply_schur(ub),S.dot(ub),rtol=1.0e-8,atol=1.0e-8*np.abs(S).max())
+            np.testing.assert_almost_equal(K.dot(pinv.apply(f))/np.linalg.norm(f),f/np.linalg.norm(f),decimal=8)
+        shutil.rmtree(cache_dir,ignore_errors=True)
+        pinv = Pseudoinverse(method='schur').compute(K)
+        self.assertFalse(isinstance(pinv.factor,SchurFactors))
+
+    def test_block_coo_matrix(self):
+        A = np.arange(6.0).reshape(2,3)
+        B = sparse.random(3,2,density=0.5,random_state=0)
+        M = block_coo_matrix([([0,2],[1,2,4],A),(np.array([1,3,4]),[0,3],B)],(5,5))
+        target = np.zeros((5,5))
+        target[np.ix_([0,2],[1,2,4])] = A
+        target[np.ix_([1,3,4],[0,3])] = B.toarray()
+        self.assertTrue(sparse.isspmatrix_csc(M))
+        np.testing.assert_array_equal(M.toarray(),target)
+        self.assertEqual(block_coo_matrix([],(2,2)).nnz,0)
+
+    def test_pseudoinverse_cache(self):
+        import tempfile, shutil
+        K = load_object(pyfeti_dir(os.path.join('cases','matrices','case_162','K.pkl')))
+        n = K.shape[0]
+        f = np.random.RandomState(0).rand(n,2)
+        node_id = np.arange(n//2)
+        R_rbm = rigid_body_modes(np.array([node_id%9,node_id//9]).T)
+        cache_dir = tempfile.mkdtemp()
+        try:
+            n_entries = 0
+            for method, null_space in [('spkernel',None),('fixing',None),('cholsps',None),('svd',None),('spkernel',R_rbm)]:
+                pinv = Pseudoinverse(method=method,cache_dir=cache_dir).compute(K,null_space=null_space)
+                n_entries += 1
+                self.assertEqual(len(pinv.cache.entries()),n_entries)
+
+                pinv_cached = Pseudoinverse(method=method,cache_dir=cache_dir).compute(K,null_space=null_space)
+                self.assertEqual(len(pinv.cache.entries()),n_entries)
+                self.assertEqual(pinv_cached.free_index,pinv.free_index)
+                np.testing.assert_almost_equal(pinv_cached.null_space,pinv.null_space,decimal=12)
+                np.testing.assert_almost_equal(pinv_cached.apply(f)/K.diagonal().max(),pinv.apply(f)/K.diagonal().max(),decimal=12)
+
+            # a different tolerance is a different entry
+            Pseudoinverse(tolerance=1.0E-9,cache_dir=cache_dir).compute(K)
+            self.assertEqual(len(pinv.cache.entries()),n_entries + 1)
+        finally:
+            shutil.rmtree(cache_dir,ignore_errors=True)
+
     def test_splusps_and_lu_2(self):
 
         from scipy.linalg import lu_factor, lu_solve
@@ -1,15 +1,24 @@
 from unittest import TestCase, main
 import numpy as np
+import scipy
 from scipy import sparse
+import scipy.linalg
+import scipy.linalg.blas
 from scipy.sparse.linalg import LinearOperator
-from pyfeti.src.linalg import ProjectorOperator
+from pyfeti.src.linalg import ProjectorOperator, coldot, blockdot, ivdot, ReductionRequest
+from pyfeti.src.telemetry import telemetry
 import logging
 from mpi4py import MPI
 import time
+import inspect
+import os
 
 def PCPG(F_action,residual,Projection_action=None,lambda_init=None,
         Precondicioner_action=None,tolerance=None,max_int=None,
-        callback=None,vdot= None,save_lambda=False,exact_norm=True):
+        callback=None,vdot= None,save_lambda=False,exact_norm=True,
+        full_reorthogonalization=False,max_stored_directions=None,directions_memory_budget=None,
+        recycle_store=None,checkpoint=None,primal_update=None,ProjectionPrecond_action=None,
+        block_vdot=None):
         ''' This function is a general interface for PCGP algorithms
 
         argument:
@@ -49,6 +58,44 @@ def PCPG(F_action,residual,Projection_action=None,lambda_init=None,
             if True compute the L2 norm of the projected residual sqrt(vdot(wk,wk)), if false compute 
             the sqrt(vdot(wk,yk)) where yk is the projected preconditioned array
 
+        full_reorthogonalization : Boolean, Default = False
+            if True the previous search directions pk and Fpk are stored in a DirectionStore
+            and every new search direction is F-conjugated against all of them
+
+        max_stored_directions : int, Default = None
+            maximum number of directions kept by the full reorthogonalization,
+            if None and directions_memory_budget is None, 50 directions are stored
+
+        directions_memory_budget : int, Default = None
+            maximum memory in bytes used to store the directions, the oldest
+            directions are overwritten when the store is full
+
+        recycle_store : KrylovRecycleStore, Default = None
+            store with F-conjugate directions of previous solves with the same F operator,
+            the stored directions are used to compute an initial guess and, if 
+            recycle_store.mode=='deflation', to deflate the new search directions.
+            At the end the directions of this solve are added to the store.
+            vdot must support column-wise products of 2D arrays, see linalg.coldot
+
+        checkpoint : PCPGCheckpoint, Default = None
+            the state is saved every checkpoint.interval iterations. If a state was
+            restored with checkpoint.restore the iterations are resumed from it
+            and lambda_init is ignored
+
+        primal_update : callable, Default = None
+            function called as primal_update(alpha_k) after alpha_k is computed, such that
+            the caller can carry iterates which are linear in lambda, e.g. the local primal
+            solutions of the last F action, without extra F applications
+
+        ProjectionPrecond_action : callable, Default = None
+            function which returns the pair P(r), P(Precond(P(r))) of the residual r, such
+            that the caller can compute the coarse data of both projections together. If 
+            given, it replaces the projection and the preconditioner of the iterations
+
+        block_vdot : callable, Default = None
+            function which returns the matrix V^T W of two 2D arrays with a single 
+            reduction, used by the recycle_store. If None and vdot is None, linalg.blockdot
+
         return 
             lampda_pcgp : np.array
                 last lambda
@@ -94,15 +141,30 @@ def PCPG(F_action,residual,Projection_action=None,lambda_init=None,
             P = Projection_action
             
         if vdot is None:
-            vdot = lambda v,w : np.dot(v,w)
+            vdot = coldot
+            if block_vdot is None:
+                block_vdot = blockdot
 
         # defining a norm based on vdot function
         norm_func =  lambda v : np.sqrt(vdot(v,v))
 
         F = F_action
 
-        logging.info('Setting PCPG tolerance = %4.2e' %tolerance)
-        logging.info('Setting PCPG max number of iterations = %i' %max_int)
+        logging.info('Setting PCPG tolerance = %4.2e', tolerance)
+        logging.info('Setting PCPG max number of iterations = %i', max_int)
+
+        direction_store = None
+        if full_reorthogonalization:
+            direction_store = DirectionStore(interface_size,max_directions=max_stored_directions,
+                                             memory_budget=directions_memory_budget,dtype=residual.dtype)
+            logging.info('Setting PCPG full reorthogonalization with %i stored directions', direction_store.max_directions)
+
+        deflate = False
+        if recycle_store is not None:
+            if direction_store is None:
+                # the directions of this solve must be collected for the recycle store
+                direction_store = DirectionStore(interface_size,max_directions=recycle_store.capacity,dtype=residual.dtype)
+            deflate = recycle_store.mode=='deflation' and recycle_store.size>0
 
         # initialize variables
         info_dict = {}
@@ -112,28 +174,65 @@ def PCPG(F_action,residual,Projection_action=None,lambda_init=None,
         wk1 = np.zeros(interface_size)
         proj_r_hist = []
         lambda_hist = []
+        lanczos_alpha = []
+        lanczos_beta = []
         rk = residual
-        k=0
-        for k in range(max_int):
+        if recycle_store is not None and recycle_store.size>0:
+            recycle_start = time.time()
+            lampda_pcpg, rk = recycle_store.initial_guess(lampda_pcpg,rk,vdot,F_action=F)
+            info_dict['elaspsed_time_recycling_initial_guess'] = time.time() - recycle_start
+            info_dict['recycled_directions'] = recycle_store.size
+            logging.info('Recycling %i Krylov directions', recycle_store.size)
+
+        k_start = 0
+        if checkpoint is not None and checkpoint.state is not None:
+            state = checkpoint.state
+            if len(state['lampda'])!=interface_size:
+                raise ValueError('Checkpoint interface size does not match the residual size')
+            k_start = int(state['iteration'])
+            lampda_pcpg = state['lampda'].copy()
+            rk = state['rk'].copy()
+            pk1 = state['pk1'].copy()
+            vn1 = float(state['vn1'])
+            proj_r_hist = list(state['proj_r_hist'])
+            lanczos_alpha = list(state['lanczos_alpha'])
+            lanczos_beta = list(state['lanczos_beta'])
+            if direction_store is not None and 'P' in state:
+                for pk, Fpk, pFpk in zip(state['P'].T,state['FP'].T,state['pFp']):
+                    direction_store.append(pk,Fpk,pFpk)
+            info_dict['restart_iteration'] = k_start
+            logging.info('Restarting PCPG from the checkpoint of iteration %i', k_start)
+
+        k=k_start
+        for k in range(k_start,max_int):
             
             logging.info('#'*60)
-            logging.info('PCPG Iteration = %i' %(k))
+            logging.info('PCPG Iteration = %i', k)
             info_dict[k] = {}
 
             proj_start = time.time()
-            wk = P(rk)  # projection action
+            if ProjectionPrecond_action is not None:
+                # both projections with one coarse reduction
+                wk, yk = ProjectionPrecond_action(rk)
+            else:
+                wk = P(rk)  # projection action
             proj_elapsed_time = time.time() - proj_start
-            logging.info('{"elaspsed_time_projection" : %2.4f} # Elapsed time' %(proj_elapsed_time))
+            logging.info('{"elaspsed_time_projection" : %2.4f} # Elapsed time', proj_elapsed_time)
             info_dict[k]["elaspsed_time_projection"] = proj_elapsed_time
+            telemetry.record('projection',info_dict[k]["elaspsed_time_projection"])
             # checking if precond will be applied, if not extra projection must be avoided
             t1 = time.time()
-            if apply_precond:
+            if ProjectionPrecond_action is not None:
+                pass # yk was computed with wk
+            elif apply_precond:
                 zk = Precond(wk)
                 yk = P(zk)
             else:
                 zk = wk
                 yk = zk
             info_dict[k]["elaspsed_time_precond"] = time.time() - t1
+            if apply_precond and ProjectionPrecond_action is None:
+                telemetry.record('precondition',info_dict[k]["elaspsed_time_precond"])
             
             beta_start = time.time()
             if k>1:
@@ -145,42 +244,72 @@ def PCPG(F_action,residual,Projection_action=None,lambda_init=None,
                 vn = vn1 
                 pk1 = yk
             beta_elapsed_time = time.time() - beta_start
-            logging.info('{"elaspsed_time_beta" : %2.4f} # Elapsed time' %(beta_elapsed_time))
+            logging.info('{"elaspsed_time_beta" : %2.4f} # Elapsed time', beta_elapsed_time)
             info_dict[k]["elaspsed_time_beta"] = beta_elapsed_time
 
             if exact_norm:
                 norm_wk = norm_func(wk)
-                logging.info('Iteration = %i, Norm of project residual wk = %2.5e.' %(k,norm_wk))
+                logging.info('Iteration = %i, Norm of project residual wk = %2.5e.', k,norm_wk)
                 if norm_wk<=tolerance:
-                    logging.info('PCG has converged after %i' %(k+1))
+                    logging.info('PCG has converged after %i', k+1)
                     break
             else:
                 norm_wk = np.sqrt(vn1)
-                logging.info('Iteration = %i, Norm of project preconditioned residual  sqrt(<yk,wk>) = %2.5e!' %(k,norm_wk))
+                logging.info('Iteration = %i, Norm of project preconditioned residual  sqrt(<yk,wk>) = %2.5e!', k,norm_wk)
                 if norm_wk<=tolerance:
                     #evaluate the exact norm
                     _norm_wk = norm_func(wk)
                     if _norm_wk<=tolerance:
-                        logging.info('PCG has converged after %i' %(k+1))
-                        logging.info('Iteration = %i, Norm of project residual wk = %2.5e!' %(k,_norm_wk))
+                        logging.info('PCG has converged after %i', k+1)
+                        logging.info('Iteration = %i, Norm of project residual wk = %2.5e!', k,_norm_wk)
                         break
 
             proj_r_hist.append(norm_wk)
             
             pk = yk + beta*pk1
 
+            if deflate:
+                deflation_start = time.time()
+                pk = pk - recycle_store.deflation_correction(pk,vdot)
+                if (k - k_start)%recycle_store.reprojection_interval==0:
+                    # pk and W are in range(P) only up to the round-off of the projected residual,
+                    # which grows as |P(rk)| decreases with respect to |rk|. F amplifies it and the
+                    # deflation feeds it back into pk, such that the iterations diverge without the 
+                    # reprojection, e.g. create_FETI_case(2,3,3) with a third load diverges for
+                    # reprojection_interval=2
+                    pk = P(pk)
+                info_dict[k]["elaspsed_time_deflation"] = time.time() - deflation_start
+
+            if full_reorthogonalization:
+                reorth_start = time.time()
+                pk = direction_store.conjugate(pk,vdot)
+                reorth_elapsed_time = time.time() - reorth_start
+                logging.info('{"elaspsed_time_reorthogonalization" : %2.4f} # Elapsed time', reorth_elapsed_time)
+                info_dict[k]["elaspsed_time_reorthogonalization"] = reorth_elapsed_time
+                info_dict[k]["reorthogonalization_directions"] = direction_store.size
+
             F_start = time.time()
             Fpk = F(pk)
             F_elapsed_time = time.time() - F_start
-            logging.info('{"elaspsed_time_F_action" : %2.4f} # Elapsed time' %(F_elapsed_time))
+            logging.info('{"elaspsed_time_F_action" : %2.4f} # Elapsed time', F_elapsed_time)
             info_dict[k]["elaspsed_time_F_action"] = F_elapsed_time
+            telemetry.record('F_action',info_dict[k]["elaspsed_time_F_action"])
 
             alpha_start = time.time()
             alpha_k = alpha_calc(vn1,pk,Fpk,vdot)
+            lanczos_alpha.append(alpha_k)
+            lanczos_beta.append(beta if k>1 else 0.0)
             alpha_elapsed_time = time.time() - alpha_start
-            logging.info('{"elaspsed_time_alpha" : %2.4f} # Elapsed time'  %(alpha_elapsed_time))
+            logging.info('{"elaspsed_time_alpha" : %2.4f} # Elapsed time', alpha_elapsed_time)
             info_dict[k]["elaspsed_time_alpha"] = alpha_elapsed_time
 
+            if primal_update is not None:
+                primal_update(alpha_k)
+
+            if direction_store is not None:
+                # vdot(pk,Fpk) = vn1/alpha_k, no extra reduction is needed
+                direction_store.append(pk,Fpk,vn1/alpha_k)
+
             lampda_pcpg = lampda_pcpg + alpha_k*pk
             
             if save_lambda:
@@ -196,40 +325,57 @@ def PCPG(F_action,residual,Projection_action=None,lambda_init=None,
             if callback is not None:
                 callback(lampda_pcpg)
 
+            if checkpoint is not None and (k+1) % checkpoint.interval==0:
+                checkpoint_start = time.time()
+                checkpoint.save(k+1,lampda_pcpg,rk,pk1,vn1,proj_r_hist,lanczos_alpha,lanczos_beta,
+                                direction_store if full_reorthogonalization else None)
+                info_dict[k]["elaspsed_time_checkpoint"] = time.time() - checkpoint_start
+
             elapsed_time = time.time() - proj_start
             
-            logging.info('{"elaspsed_time_PCPG_iteration" : %2.2f} # Elapsed time' %(elapsed_time))
+            logging.info('{"elaspsed_time_PCPG_iteration" : %2.2f} # Elapsed time', elapsed_time)
             info_dict[k]["elaspsed_time_iteration"] = elapsed_time
+            telemetry.record('iteration',info_dict[k]["elaspsed_time_iteration"])
 
         if (k>0) and k==(max_int-1):
-            logging.warning('Maximum iteration was reached, MAX_INT = %i, without converging!' %(k+1))
-            logging.warning('Projected norm = %2.5e , where the PCPG tolerance is set to %2.5e' %(norm_wk,tolerance))
+            logging.warning('Maximum iteration was reached, MAX_INT = %i, without converging!', k+1)
+            logging.warning('Projected norm = %2.5e , where the PCPG tolerance is set to %2.5e', norm_wk,tolerance)
 
         elapsed_time = time.time() - global_start_time
         logging.info('#'*60)
-        logging.info('{"Total_elaspsed_time_PCPG" : %2.2f} # Elapsed time [s]' %(elapsed_time))
-        logging.info('Number of PCPG Iterations = %i !' %(k+1))
+        logging.info('{"Total_elaspsed_time_PCPG" : %2.2f} # Elapsed time [s]', elapsed_time)
+        logging.info('Number of PCPG Iterations = %i !', k+1)
         avg_iteration_time = elapsed_time/(k+1)
-        logging.info('{"avg_iteration_time_PCPG" : %2.4f} # Elapsed time [s]' %(avg_iteration_time))
+        logging.info('{"avg_iteration_time_PCPG" : %2.4f} # Elapsed time [s]', avg_iteration_time)
         logging.info('#'*60)
 
         info_dict['avg_iteration_time'] = elapsed_time/(k+1)
         info_dict['Total_elaspsed_time_PCPG'] = elapsed_time
         info_dict['PCPG_iterations'] = k+1
+        info_dict['lanczos_alpha'] = lanczos_alpha
+        info_dict['lanczos_beta'] = lanczos_beta
+        rel_tolerance = tolerance/proj_r_hist[0] if proj_r_hist and proj_r_hist[0]>0 else None
+        info_dict.update(lanczos_spectrum_estimate(lanczos_alpha,lanczos_beta,rel_tolerance))
+        if recycle_store is not None:
+            recycle_store.update(direction_store,vdot,block_vdot)
+        if full_reorthogonalization:
+            reorth_time = sum(info_dict[i].get("elaspsed_time_reorthogonalization",0.0) for i in range(k_start,k+1))
+            info_dict['Total_elaspsed_time_reorthogonalization'] = reorth_time
+            info_dict['avg_reorthogonalization_time'] = reorth_time/(k+1-k_start)
+            info_dict['reorthogonalization_vdot_calls'] = direction_store.vdot_calls
+            info_dict['max_stored_directions'] = direction_store.max_directions
         return lampda_pcpg, rk, proj_r_hist, lambda_hist, info_dict
 
 
-def alpha_calc(vn1,pk,Fpk,vdot=None):
-    if vdot is None:
-        vdot = lambda v,w : np.dot(v,w)
-
-    aux2 = vdot(pk,Fpk)
-    alpha = float(vn1/aux2)
-    return alpha
-
-def pminres(F_action,residual,Projection_action=None,lambda_init=None,
-        Precondicioner_action=None,tolerance=1.e-10,max_int=500):
-        ''' This function is a general interface for Scipy MinRes algorithm
+def WorkspacePCPG(F_action,residual,Projection_action=None,lambda_init=None,
+        Precondicioner_action=None,tolerance=None,max_int=None,
+        callback=None,vdot= None,save_lambda=False,exact_norm=True,workspace=None,primal_update=None):
+        ''' Allocation-free version of PCPG. All the iteration vectors are allocated once
+        in a PCPGWorkspace and updated in place, such that no array is allocated 
+        inside the iteration loop. The F, Projection and Preconditioner actions 
+        write into the workspace buffers if they accept an out key arg, 
+        e.g. F_action(v,out=None), otherwise their result is copied into the buffers.
+        The iterations are the same as in PCPG.
 
         argument:
         F_action: callable function
@@ -248,84 +394,1425 @@ def pminres(F_action,residual,Projection_action=None,lambda_init=None,
         callable function to atcs as a preconditioner operator
         in the array w
 
-        tolerance: float
-        convergence tolerance
+        tolerance: float, Default= None
+            convergence tolerance, if None tolerance=1.e-10
 
-        max_int = int
-        maximum number of iterations
+        max_int : int, Default= None
+            maximum number of iterations, if None max_int = int(1.2*len(residual))
 
-        return 
-        lampda_pcgp : np.array
-            last lambda
-        rk : np.array
-            last projected residual
-        proj_r_hist : list
-            list of the history of the norm of the projected  residuals
-        lambda_hist : list
-            list of the 
+        callback : callable, Default None
+            function to be callabe at the and of each iteration
+
+        vdot : callable, Default None
+            function with the dot product of vdot(v,w) if none 
+            then, np.dot(v,w)
+
+        save_lambda : Booelan, Default = False
+            store lambda interations in the a list
+
+        exact_norm : Booelan, Default = True
+            if True compute the L2 norm of the projected residual sqrt(vdot(wk,wk)), if false compute 
+            the sqrt(vdot(wk,yk)) where yk is the projected preconditioned array
+
+        workspace : PCPGWorkspace, Default = None
+            preallocated iteration vectors, which can be shared by sequential solves 
+            with the same interface size. If None a new workspace is allocated
 
+        primal_update : callable, Default = None
+            function called as primal_update(alpha_k) after alpha_k is computed, see PCPG
+
+        return 
+            lampda_pcgp : np.array
+                last lambda
+            rk : np.array
+                last residual
+            proj_r_hist : list
+                list of the history of the norm of the projected residuals
+            lambda_hist : list
+                list of the lambda iterations if save_lambda is True
+            info_dict : dict
+                dict with elapsed times and number of iterations
         '''
-         
+
         interface_size = len(residual)
-         
-        if lambda_init is None:
-            lampda_pcpg = np.zeros(interface_size)
+
+        if tolerance is None:
+            tolerance=1.e-10
+
+        if max_int is None:
+            max_int = int(1.2*interface_size)
+
+        if vdot is None:
+            vdot = coldot
+
+        if workspace is None:
+            workspace = PCPGWorkspace(interface_size,dtype=np.result_type(residual.dtype,np.float64))
         else:
-            lampda_pcpg = lambda_init
-         
-        if Precondicioner_action is None:
-            Precond = np.eye(interface_size,interface_size).dot
+            workspace.check_size(interface_size)
+
+        lampda_pcpg = workspace.lampda
+        rk = workspace.r
+        wk = workspace.w
+        zk = workspace.z
+        pk = workspace.p
+        Fpk = workspace.Fp
+
+        F = out_action(F_action)
+        apply_precond = Precondicioner_action is not None
+        if apply_precond:
+            Precond = out_action(Precondicioner_action)
+            yk = workspace.y
         else:
-            Precond = Precondicioner_action
+            # without preconditioner yk is the projected residual
+            yk = wk
 
         if Projection_action is None:
-            P = np.eye(interface_size,interface_size).dot
+            P = lambda v, out : np.copyto(out,v)
         else:
-            P = Projection_action
-            
-        #F = F_action
-        F = sparse.linalg.LinearOperator((interface_size,interface_size), matvec=F_action)
-        P = sparse.linalg.LinearOperator((interface_size,interface_size), matvec=P, rmatvec = P)
+            P = out_action(Projection_action)
 
-        PF= ProjectorOperator(F,P,shape=(interface_size,interface_size))
-        b = residual - F.dot(lampda_pcpg)
-        #lampda_pcpg, info = sparse.linalg.minres(PF,b,x0=lampda_pcpg,tol=tolerance,maxiter=max_int,show=False,check=False)
-        lampda_pcpg, info = sparse.linalg.minres(F,b,x0=lampda_pcpg,M=P,tol=tolerance,maxiter=max_int,show=False,check=False)
+        axpy = scipy.linalg.blas.get_blas_funcs('axpy',(pk,lampda_pcpg))
 
-        rk, proj_r_hist, lambda_hist = PF.dot(lampda_pcpg) - b, None, None
+        logging.info('Setting PCPG tolerance = %4.2e', tolerance)
+        logging.info('Setting PCPG max number of iterations = %i', max_int)
 
-        if  info==0:
-            logging.info('Project MinRes has converged')
+        # initialize variables
+        info_dict = {}
+        global_start_time = time.time()
+        beta = 0.0
+        proj_r_hist = []
+        lambda_hist = []
+        lanczos_alpha = []
+        lanczos_beta = []
+        np.copyto(rk,residual)
+        if lambda_init is None:
+            lampda_pcpg.fill(0.0)
         else:
-            logging.info('Project MinRes has NOT converged after %i iterations' %info)
+            np.copyto(lampda_pcpg,lambda_init)
 
-        return lampda_pcpg, rk , proj_r_hist, lambda_hist
+        k=0
+        for k in range(max_int):
+            
+            logging.info('#'*60)
+            logging.info('PCPG Iteration = %i', k)
+            info_dict[k] = {}
 
+            proj_start = time.time()
+            P(rk,out=wk)  # projection action
+            proj_elapsed_time = time.time() - proj_start
+            logging.info('{"elaspsed_time_projection" : %2.4f} # Elapsed time', proj_elapsed_time)
+            info_dict[k]["elaspsed_time_projection"] = proj_elapsed_time
+            telemetry.record('projection',info_dict[k]["elaspsed_time_projection"])
 
-class  Test_solvers(TestCase):
+            t1 = time.time()
+            if apply_precond:
+                Precond(wk,out=zk)
+                P(zk,out=yk)
+            info_dict[k]["elaspsed_time_precond"] = time.time() - t1
+            if apply_precond:
+                telemetry.record('precondition',info_dict[k]["elaspsed_time_precond"])
 
-    def test_ProjectorOperator_with_minres(self):
-        A = 3*np.array([[2,-1,0],[-1,2,0],[0,-1,2]])
-        P = np.array([[1,0,0],[0,1,0],[0,0,0]])
-        b = np.array([-2,4,0])
-        Asingular = P.dot(A.dot(P))
+            beta_start = time.time()
+            if k>1:
+                vn = vdot(yk,wk)
+                beta = vn/vn1
+                vn1 = vn
+            else:
+                vn1 = vdot(yk,wk)
+                vn = vn1 
+            beta_elapsed_time = time.time() - beta_start
+            logging.info('{"elaspsed_time_beta" : %2.4f} # Elapsed time', beta_elapsed_time)
+            info_dict[k]["elaspsed_time_beta"] = beta_elapsed_time
 
-        F_action = lambda x : A.dot(x)
-        Projection_action = lambda x : P.dot(x)
-        residual = b
+            if exact_norm:
+                norm_wk = np.sqrt(vdot(wk,wk))
+                logging.info('Iteration = %i, Norm of project residual wk = %2.5e.', k,norm_wk)
+                if norm_wk<=tolerance:
+                    logging.info('PCG has converged after %i', k+1)
+                    break
+            else:
+                norm_wk = np.sqrt(vn1)
+                logging.info('Iteration = %i, Norm of project preconditioned residual  sqrt(<yk,wk>) = %2.5e!', k,norm_wk)
+                if norm_wk<=tolerance:
+                    #evaluate the exact norm
+                    _norm_wk = np.sqrt(vdot(wk,wk))
+                    if _norm_wk<=tolerance:
+                        logging.info('PCG has converged after %i', k+1)
+                        logging.info('Iteration = %i, Norm of project residual wk = %2.5e!', k,_norm_wk)
+                        break
 
-        x_minres, rk, proj_r_hist, lambda_hist = pminres(F_action,residual,Projection_action)
-        x_svd = (np.linalg.pinv(Asingular)).dot(b)
-        np.testing.assert_almost_equal(x_minres,x_svd,decimal=10)
+            proj_r_hist.append(norm_wk)
+            
+            # pk = yk + beta*pk1, where the search direction is restarted in the first two iterations as in PCPG
+            if k>1:
+                pk *= beta
+                pk += yk
+            else:
+                np.copyto(pk,yk)
 
-    def test_PCPG(self):
-        A = 3*np.array([[2,-1,0],[-1,2,-1],[0,-1,1]])
-        b = np.array([-2,4,0])
+            F_start = time.time()
+            F(pk,out=Fpk)
+            F_elapsed_time = time.time() - F_start
+            logging.info('{"elaspsed_time_F_action" : %2.4f} # Elapsed time', F_elapsed_time)
+            info_dict[k]["elaspsed_time_F_action"] = F_elapsed_time
+            telemetry.record('F_action',info_dict[k]["elaspsed_time_F_action"])
 
-        x_target = np.linalg.solve(A,b)
-        r = b
-        x_pcpg, rk , proj_r_hist, X_hist = PCPG(A.dot,r,max_int=6)
-        np.testing.assert_array_almost_equal(x_target,x_pcpg,decimal=10)
+            alpha_start = time.time()
+            alpha_k = alpha_calc(vn1,pk,Fpk,vdot)
+            lanczos_alpha.append(alpha_k)
+            lanczos_beta.append(beta if k>1 else 0.0)
+            alpha_elapsed_time = time.time() - alpha_start
+            logging.info('{"elaspsed_time_alpha" : %2.4f} # Elapsed time', alpha_elapsed_time)
+            info_dict[k]["elaspsed_time_alpha"] = alpha_elapsed_time
+
+            if primal_update is not None:
+                primal_update(alpha_k)
+
+            # lampda_pcpg += alpha_k*pk and rk -= alpha_k*Fpk
+            axpy(pk,lampda_pcpg,a=alpha_k)
+            axpy(Fpk,rk,a=-alpha_k)
+            
+            if save_lambda:
+                lambda_hist.append(lampda_pcpg.copy())
+
+            if callback is not None:
+                callback(lampda_pcpg)
+
+            elapsed_time = time.time() - proj_start
+            
+            logging.info('{"elaspsed_time_PCPG_iteration" : %2.2f} # Elapsed time', elapsed_time)
+            info_dict[k]["elaspsed_time_iteration"] = elapsed_time
+            telemetry.record('iteration',info_dict[k]["elaspsed_time_iteration"])
+
+        if (k>0) and k==(max_int-1):
+            logging.warning('Maximum iteration was reached, MAX_INT = %i, without converging!', k+1)
+            logging.warning('Projected norm = %2.5e , where the PCPG tolerance is set to %2.5e', norm_wk,tolerance)
+
+        elapsed_time = time.time() - global_start_time
+        logging.info('#'*60)
+        logging.info('{"Total_elaspsed_time_PCPG" : %2.2f} # Elapsed time [s]', elapsed_time)
+        logging.info('Number of PCPG Iterations = %i !', k+1)
+        logging.info('#'*60)
+
+        info_dict['avg_iteration_time'] = elapsed_time/(k+1)
+        info_dict['Total_elaspsed_time_PCPG'] = elapsed_time
+        info_dict['PCPG_iterations'] = k+1
+        info_dict['lanczos_alpha'] = lanczos_alpha
+        info_dict['lanczos_beta'] = lanczos_beta
+        rel_tolerance = tolerance/proj_r_hist[0] if proj_r_hist and proj_r_hist[0]>0 else None
+        info_dict.update(lanczos_spectrum_estimate(lanczos_alpha,lanczos_beta,rel_tolerance))
+        info_dict['workspace_nbytes'] = workspace.nbytes
+        # copies are returned, such that the workspace can be reused
+        return lampda_pcpg.copy(), rk.copy(), proj_r_hist, lambda_hist, info_dict
+
+
+class PCPGWorkspace():
+    ''' Preallocated iteration vectors of WorkspacePCPG, 
+    lambda, residual r, projected residual w, preconditioned residual z,
+    projected preconditioned residual y, search direction p and its F action Fp
+
+    Parameters:
+        interface_size : int
+            number of interface multipliers
+        dtype : np.dtype, Default = np.float64
+            type of the vectors
+    '''
+    vector_names = ['lampda','r','w','z','y','p','Fp']
+
+    def __init__(self,interface_size,dtype=np.float64):
+        self.interface_size = interface_size
+        self.dtype = dtype
+        for name in self.vector_names:
+            setattr(self,name,np.zeros(interface_size,dtype=dtype))
+
+    def check_size(self,interface_size):
+        if interface_size!=self.interface_size:
+            raise ValueError('Workspace with interface size %i cannot be used with an interface of size %i' 
+                             %(self.interface_size,interface_size))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self,name).nbytes for name in self.vector_names)
+
+
+def accepts_out(func):
+    ''' check if a callable has an out key arg to write
+    its result into a caller-provided buffer
+    '''
+    try:
+        return 'out' in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+
+def out_action(func):
+    ''' wraps a callable such that it can be called as func(v,out=buffer). 
+    If func does not accept the out key arg the result is copied into the buffer
+    '''
+    if accepts_out(func):
+        return func
+
+    def action(v,out):
+        np.copyto(out,func(v))
+        return out
+    return action
+
+
+def BlockPCPG(F_action,residual,Projection_action=None,lambda_init=None,
+        Precondicioner_action=None,tolerance=None,max_int=None,
+        callback=None,vdot= None,save_lambda=False,exact_norm=True):
+        ''' Block PCPG algorithm for multiple right hand sides. The residual
+        is a 2D array with shape (interface_size, n_rhs) and every column has its 
+        own conjugate gradient recurrence, but the F, Projection and Preconditioner
+        actions are called once per iteration with the 2D block of the columns
+        which have not converged yet.
+
+        argument:
+        F_action: callable function
+        callable function that acts in a 2D lambda block
+
+        residual: np.array
+        2D array with initial interface gaps, one column per rhs
+
+        lambda_init : np.array
+        intial 2D lambda array
+
+        Projection_action: callable function
+        callable function to project the residual block
+
+        Precondicioner_action : callable function
+        callable function to atcs as a preconditioner operator
+        in the 2D array w
+
+        tolerance: float or np.array, Default= None
+            convergence tolerance, scalar or one value per rhs, if None tolerance=1.e-10
+
+        max_int : int, Default= None
+            maximum number of iterations, if None max_int = int(1.2*interface_size)
+
+        callback : callable, Default None
+            function to be callabe at the and of each iteration
+
+        vdot : callable, Default None
+            column-wise dot product vdot(V,W) returning one value per column, 
+            if None then, coldot(V,W)
+
+        save_lambda : Booelan, Default = False
+            store lambda interations in the a list
+
+        exact_norm : Booelan, Default = True
+            if True compute the L2 norm of the projected residual sqrt(vdot(wk,wk)), if false compute 
+            the sqrt(vdot(wk,yk)) where yk is the projected preconditioned array
+
+        return 
+            lampda_pcgp : np.array
+                last 2D lambda
+            rk : np.array
+                last 2D residual
+            proj_r_hist : list
+                list with the history of the norm of the projected residuals of every rhs
+            lambda_hist : list
+                list of the 2D lambda iterations
+            info_dict : dict
+                dict with elapsed times and the number of iterations of every rhs in 
+                'PCPG_iterations_per_rhs'
+        '''
+        interface_size, n_rhs = residual.shape
+
+        if tolerance is None:
+            tolerance=1.e-10
+        tolerance = np.ones(n_rhs)*tolerance
+
+        if max_int is None:
+            max_int = int(1.2*interface_size)
+
+        if lambda_init is None:
+            lampda_pcpg = np.zeros((interface_size,n_rhs))
+        else:
+            lampda_pcpg = np.array(lambda_init,dtype=float)
+
+        apply_precond = Precondicioner_action is not None
+        Precond = Precondicioner_action
+
+        if Projection_action is None:
+            P = lambda x : x
+        else:
+            P = Projection_action
+
+        if vdot is None:
+            vdot = coldot
+
+        F = F_action
+
+        logging.info('Setting Block PCPG with %i right hand sides', n_rhs)
+        logging.info('Setting PCPG max number of iterations = %i', max_int)
+
+        # initialize variables
+        info_dict = {}
+        global_start_time = time.time()
+        rk = np.array(residual,dtype=float)
+        pk = np.zeros((interface_size,n_rhs))
+        vn1 = np.zeros(n_rhs)
+        active = np.arange(n_rhs)
+        proj_r_hist = [[] for i in range(n_rhs)]
+        lambda_hist = []
+        k=0
+        for k in range(max_int):
+
+            logging.info('#'*60)
+            logging.info('Block PCPG Iteration = %i, active rhs = %i', k,len(active))
+            info_dict[k] = {}
+
+            proj_start = time.time()
+            wk = P(rk[:,active])  # projection action
+            info_dict[k]["elaspsed_time_projection"] = time.time() - proj_start
+            telemetry.record('projection',info_dict[k]["elaspsed_time_projection"])
+
+            t1 = time.time()
+            if apply_precond:
+                yk = P(Precond(wk))
+            else:
+                yk = wk
+            info_dict[k]["elaspsed_time_precond"] = time.time() - t1
+            if apply_precond:
+                telemetry.record('precondition',info_dict[k]["elaspsed_time_precond"])
+
+            beta_start = time.time()
+            vn = vdot(yk,wk)
+            info_dict[k]["elaspsed_time_beta"] = time.time() - beta_start
+
+            if exact_norm:
+                norm_wk = np.sqrt(vdot(wk,wk))
+                converged = norm_wk<=tolerance[active]
+            else:
+                norm_wk = np.sqrt(vn)
+                converged = norm_wk<=tolerance[active]
+                if converged.any():
+                    #evaluate the exact norm
+                    _norm_wk = np.sqrt(vdot(wk[:,converged],wk[:,converged]))
+                    converged[converged] = _norm_wk<=tolerance[active][converged]
+
+            for j, rhs_id in enumerate(active):
+                if not converged[j]:
+                    proj_r_hist[rhs_id].append(norm_wk[j])
+
+            if converged.all():
+                logging.info('Block PCG has converged after %i', k+1)
+                break
+
+            not_converged = ~converged
+            active, wk, yk, vn = active[not_converged], wk[:,not_converged], yk[:,not_converged], vn[not_converged]
+
+            if k>0:
+                beta = vn/vn1[active]
+            else:
+                beta = np.zeros(len(active))
+
+            pk[:,active] = yk + beta*pk[:,active]
+            pk_active = pk[:,active]
+
+            F_start = time.time()
+            Fpk = F(pk_active)
+            info_dict[k]["elaspsed_time_F_action"] = time.time() - F_start
+            telemetry.record('F_action',info_dict[k]["elaspsed_time_F_action"])
+
+            alpha_start = time.time()
+            alpha_k = vn/vdot(pk_active,Fpk)
+            info_dict[k]["elaspsed_time_alpha"] = time.time() - alpha_start
+
+            lampda_pcpg[:,active] += alpha_k*pk_active
+            rk[:,active] -= alpha_k*Fpk
+            vn1[active] = vn
+
+            if save_lambda:
+                lambda_hist.append(np.copy(lampda_pcpg))
+
+            if callback is not None:
+                callback(lampda_pcpg)
+
+            info_dict[k]["elaspsed_time_iteration"] = time.time() - proj_start
+            telemetry.record('iteration',info_dict[k]["elaspsed_time_iteration"])
+
+        if (k>0) and k==(max_int-1):
+            logging.warning('Maximum iteration was reached, MAX_INT = %i, without converging %i rhs!', k+1,len(active))
+
+        elapsed_time = time.time() - global_start_time
+        logging.info('#'*60)
+        logging.info('{"Total_elaspsed_time_PCPG" : %2.2f} # Elapsed time [s]', elapsed_time)
+        logging.info('Number of Block PCPG Iterations = %i !', k+1)
+        logging.info('#'*60)
+
+        info_dict['avg_iteration_time'] = elapsed_time/(k+1)
+        info_dict['Total_elaspsed_time_PCPG'] = elapsed_time
+        info_dict['PCPG_iterations'] = k+1
+        info_dict['PCPG_iterations_per_rhs'] = [len(hist) + 1 for hist in proj_r_hist]
+        return lampda_pcpg, rk, proj_r_hist, lambda_hist, info_dict
+
+
+def PipelinedPCPG(F_action,residual,Projection_action=None,lambda_init=None,
+        Precondicioner_action=None,tolerance=None,max_int=None,
+        callback=None,vdot= None,save_lambda=False,exact_norm=True,ivdot=None):
+        ''' Pipelined PCPG algorithm, see Ghysels and Vanroose, "Hiding global synchronization 
+        latency in the preconditioned Conjugate Gradient algorithm". The three dot products
+        of an iteration, <r,u>, <w,u> and <r,r>, are computed by a single fused reduction
+        which is started before and finished after the actions
+
+            m = P(M(w)),  n = P(F(m))
+
+        such that the global communication overlaps with the local solves and the neighbor
+        exchange of F. The number of F, P and M actions per iteration is the same as in PCPG, 
+        but the projected residual, preconditioned residual and their F actions are updated by 
+        recurrences, where u = P(M(r)), w = P(F(u)) and r is the projected residual.
+
+        argument:
+        F_action: callable function
+        callable function that acts in lambda
+
+        residual: np.array
+        array with initial interface gap
+
+        lambda_init : np.array
+        intial lambda array
+
+        Projection_action: callable function
+        callable function to project the residual
+
+        Precondicioner_action : callable function
+        callable function to atcs as a preconditioner operator
+        in the array w
+
+        tolerance: float, Default= None
+            convergence tolerance, if None tolerance=1.e-10
+
+        max_int : int, Default= None
+            maximum number of iterations, if None max_int = int(1.2*len(residual))
+
+        callback : callable, Default None
+            function to be callabe at the and of each iteration
+
+        vdot : callable, Default None
+            function with the dot product of vdot(v,w), only used if ivdot is None
+
+        save_lambda : Booelan, Default = False
+            store lambda interations in the a list
+
+        exact_norm : Booelan, Default = True
+            if True the convergence is checked with sqrt(<r,r>), if False with 
+            sqrt(<r,u>). Both values are computed by the same fused reduction
+
+        ivdot : callable, Default None
+            function with fused dot products ivdot([(v1,w1),(v2,w2),...]) returning
+            a request object whose wait() method returns the array of dot products,
+            see linalg.ivdot and MPIlinalg.parivdot. If None, the dot products
+            are computed with vdot without overlapping
+
+        return 
+            lampda_pcgp : np.array
+                last lambda
+            rk : np.array
+                last projected residual
+            proj_r_hist : list
+                list of the history of the norm of the projected residuals
+            lambda_hist : list
+                list of the lambda iterations if save_lambda is True
+            info_dict : dict
+                dict with elapsed times and number of iterations
+        '''
+
+        interface_size = len(residual)
+        
+        if tolerance is None:
+            tolerance=1.e-10
+
+        if max_int is None:
+            max_int = int(1.2*interface_size)
+
+        if Projection_action is None:
+            P = lambda v : v
+        else:
+            P = Projection_action
+
+        if Precondicioner_action is None:
+            B = lambda v : v
+        else:
+            B = lambda v : P(Precondicioner_action(v))
+
+        if ivdot is None:
+            if vdot is None:
+                vdot = coldot
+            ivdot = lambda pairs : ReductionRequest(np.array([vdot(v,w) for v,w in pairs]))
+
+        F = F_action
+        
+        logging.info('Setting Pipelined PCPG tolerance = %4.2e', tolerance)
+        logging.info('Setting Pipelined PCPG max number of iterations = %i', max_int)
+
+        info_dict = {}
+        global_start_time = time.time()
+        proj_r_hist = []
+        lambda_hist = []
+        lanczos_alpha = []
+        lanczos_beta = []
+
+        if lambda_init is None:
+            lampda_pcpg = np.zeros(interface_size)
+            rk = P(residual)
+        else:
+            lampda_pcpg = np.array(lambda_init,dtype=float)
+            rk = P(residual - F(lampda_pcpg))
+
+        uk = B(rk)
+        wk = P(F(uk))
+        pk = np.zeros(interface_size)
+        sk = np.zeros(interface_size)
+        qk = np.zeros(interface_size)
+        zk = np.zeros(interface_size)
+        gamma_k1 = alpha_k1 = None
+
+        k=0
+        for k in range(max_int):
+
+            logging.info('#'*60)
+            logging.info('Pipelined PCPG Iteration = %i', k)
+            info_dict[k] = {}
+            iteration_start = time.time()
+
+            # starting the fused reduction of gamma = <r,u>, delta = <w,u> and <r,r>
+            request = ivdot([(rk,uk),(wk,uk),(rk,rk)])
+
+            # overlapping local work with the reduction
+            precond_start = time.time()
+            mk = B(wk)
+            info_dict[k]["elaspsed_time_precond"] = time.time() - precond_start
+            if Precondicioner_action is not None:
+                telemetry.record('precondition',info_dict[k]["elaspsed_time_precond"])
+
+            F_start = time.time()
+            nk = P(F(mk))
+            F_elapsed_time = time.time() - F_start
+            logging.info('{"elaspsed_time_F_action" : %2.4f} # Elapsed time', F_elapsed_time)
+            info_dict[k]["elaspsed_time_F_action"] = F_elapsed_time
+            telemetry.record('F_action',info_dict[k]["elaspsed_time_F_action"])
+
+            wait_start = time.time()
+            gamma_k, delta_k, rr_k = request.wait()
+            wait_elapsed_time = time.time() - wait_start
+            logging.info('{"elaspsed_time_reduction_wait" : %2.4f} # Elapsed time', wait_elapsed_time)
+            info_dict[k]["elaspsed_time_reduction_wait"] = wait_elapsed_time
+
+            norm_rk = np.sqrt(rr_k)
+            if exact_norm:
+                norm_wk = norm_rk
+                logging.info('Iteration = %i, Norm of project residual wk = %2.5e.', k,norm_wk)
+            else:
+                norm_wk = np.sqrt(gamma_k)
+                logging.info('Iteration = %i, Norm of project preconditioned residual  sqrt(<yk,wk>) = %2.5e!', k,norm_wk)
+
+            if norm_wk<=tolerance and norm_rk<=tolerance:
+                logging.info('Pipelined PCPG has converged after %i', k+1)
+                break
+
+            proj_r_hist.append(norm_wk)
+
+            if k>0:
+                beta_k = gamma_k/gamma_k1
+                alpha_k = gamma_k/(delta_k - beta_k*gamma_k/alpha_k1)
+            else:
+                beta_k = 0.0
+                alpha_k = gamma_k/delta_k
+            lanczos_alpha.append(alpha_k)
+            lanczos_beta.append(beta_k)
+
+            zk = nk + beta_k*zk
+            qk = mk + beta_k*qk
+            sk = wk + beta_k*sk
+            pk = uk + beta_k*pk
+
+            lampda_pcpg = lampda_pcpg + alpha_k*pk
+            rk = rk - alpha_k*sk
+            uk = uk - alpha_k*qk
+            wk = wk - alpha_k*zk
+
+            gamma_k1 = gamma_k
+            alpha_k1 = alpha_k
+
+            if save_lambda:
+                lambda_hist.append(lampda_pcpg)
+
+            if callback is not None:
+                callback(lampda_pcpg)
+
+            elapsed_time = time.time() - iteration_start
+            logging.info('{"elaspsed_time_PCPG_iteration" : %2.2f} # Elapsed time', elapsed_time)
+            info_dict[k]["elaspsed_time_iteration"] = elapsed_time
+            telemetry.record('iteration',info_dict[k]["elaspsed_time_iteration"])
+
+        if (k>0) and k==(max_int-1):
+            logging.warning('Maximum iteration was reached, MAX_INT = %i, without converging!', k+1)
+            logging.warning('Projected norm = %2.5e , where the PCPG tolerance is set to %2.5e', norm_wk,tolerance)
+
+        elapsed_time = time.time() - global_start_time
+        logging.info('#'*60)
+        logging.info('{"Total_elaspsed_time_PCPG" : %2.2f} # Elapsed time [s]', elapsed_time)
+        logging.info('Number of Pipelined PCPG Iterations = %i !', k+1)
+        logging.info('#'*60)
+
+        info_dict['avg_iteration_time'] = elapsed_time/(k+1)
+        info_dict['Total_elaspsed_time_PCPG'] = elapsed_time
+        info_dict['Total_elaspsed_time_reduction_wait'] = sum(info_dict[i].get("elaspsed_time_reduction_wait",0.0) for i in range(k+1))
+        info_dict['PCPG_iterations'] = k+1
+        info_dict['lanczos_alpha'] = lanczos_alpha
+        info_dict['lanczos_beta'] = lanczos_beta
+        rel_tolerance = tolerance/proj_r_hist[0] if proj_r_hist and proj_r_hist[0]>0 else None
+        info_dict.update(lanczos_spectrum_estimate(lanczos_alpha,lanczos_beta,rel_tolerance))
+        return lampda_pcpg, rk, proj_r_hist, lambda_hist, info_dict
+
+
+class DirectionStore():
+    ''' Ring buffer with the PCPG search directions pk and the
+    respective Fpk actions, used to F-conjugate new search directions
+    against the previous ones (full reorthogonalization).
+
+    The arrays are preallocated, so the memory is bounded by
+    the max number of directions or by a memory budget in bytes.
+    When the store is full the oldest direction is overwritten.
+    '''
+    def __init__(self,interface_size,max_directions=None,memory_budget=None,dtype=np.float64):
+        self.interface_size = interface_size
+        itemsize = np.dtype(dtype).itemsize
+        if max_directions is None:
+            if memory_budget is None:
+                max_directions = 50
+            else:
+                max_directions = int(memory_budget//(2*interface_size*itemsize))
+        elif memory_budget is not None:
+            max_directions = min(max_directions,int(memory_budget//(2*interface_size*itemsize)))
+
+        if max_directions<1:
+            raise ValueError('DirectionStore must be able to store at least one direction')
+
+        self.max_directions = max_directions
+        self.P = np.zeros((interface_size,max_directions),dtype=dtype)
+        self.FP = np.zeros((interface_size,max_directions),dtype=dtype)
+        self.pFp = np.zeros(max_directions,dtype=dtype)
+        self.coef = np.zeros(max_directions,dtype=dtype)
+        self.size = 0
+        self.head = 0
+        self.vdot_calls = 0
+
+    @property
+    def nbytes(self):
+        return self.P.nbytes + self.FP.nbytes + self.pFp.nbytes
+
+    def append(self,pk,Fpk,pFpk):
+        ''' store a new direction overwriting the oldest one if
+        the store is full
+        '''
+        self.P[:,self.head] = pk
+        self.FP[:,self.head] = Fpk
+        self.pFp[self.head] = pFpk
+        self.head = (self.head + 1) % self.max_directions
+        self.size = min(self.size + 1, self.max_directions)
+
+    def conjugate(self,pk,vdot=None):
+        ''' F-conjugate pk against all stored directions with
+        classical Gram-Schmidt :
+
+        pk = pk - sum_j  vdot(Fp_j,pk)/vdot(p_j,Fp_j) * p_j
+
+        all the vdot(Fp_j,pk) are computed with a single column-wise vdot 
+        call, i.e. one global reduction in parallel
+        '''
+        if self.size==0:
+            return pk
+
+        if vdot is None:
+            vdot = coldot
+
+        n = self.size
+        coef = self.coef[:n]
+        coef[:] = vdot(self.FP[:,:n],np.broadcast_to(pk[:,None],(len(pk),n)))
+        self.vdot_calls += 1
+        coef /= self.pFp[:n]
+        return pk - self.P[:,:n].dot(coef)
+
+    def clear(self):
+        self.size = 0
+        self.head = 0
+
+
+    def get_directions(self):
+        ''' return the stored pk, Fpk and vdot(pk,Fpk) arrays in chronological order
+        '''
+        order = (self.head - self.size + np.arange(self.size)) % self.max_directions
+        return self.P[:,order], self.FP[:,order], self.pFp[order]
+
+
+class PCPGCheckpoint():
+    ''' Periodic checkpoint of the PCPG state in a numpy .npz file, such that
+    an interrupted solve can be resumed at the last saved iteration.
+
+    Every interval iterations the PCPG saves lambda, rk, pk1, vn1, the iteration
+    counter, the residual history, the Lanczos coefficients and the stored
+    directions of the full reorthogonalization. The file is written to
+    filename + '.tmp' and then renamed, the previous checkpoint is kept in
+    filename + '.prev', such that an interrupted write never destroys
+    the last consistent state.
+
+    Parameters:
+        filename : str
+            name of the checkpoint file
+        interval : int, Default = 10
+            number of iterations between two checkpoints
+    '''
+    def __init__(self,filename,interval=10):
+        if interval<1:
+            raise ValueError('Checkpoint interval must be at least one iteration')
+        self.filename = filename
+        self.previous_filename = filename + '.prev'
+        self.interval = int(interval)
+        self.state = None
+
+    def save(self,iteration,lampda,rk,pk1,vn1,proj_r_hist,lanczos_alpha,lanczos_beta,direction_store=None):
+        ''' save the state of the PCPG at the end of iteration - 1
+        '''
+        arrays = dict(iteration=iteration,lampda=lampda,rk=rk,pk1=pk1,vn1=vn1,
+                      proj_r_hist=np.array(proj_r_hist),lanczos_alpha=np.array(lanczos_alpha),
+                      lanczos_beta=np.array(lanczos_beta))
+        if direction_store is not None:
+            arrays['P'], arrays['FP'], arrays['pFp'] = direction_store.get_directions()
+
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename,'wb') as f:
+            np.savez(f,**arrays)
+        if os.path.exists(self.filename):
+            os.replace(self.filename,self.previous_filename)
+        os.replace(tmp_filename,self.filename)
+
+    def _read(self,filename):
+        try:
+            with np.load(filename) as data:
+                return {key : data[key] for key in data.files}
+        except (IOError,ValueError):
+            return None
+
+    def latest_iteration(self):
+        ''' iteration of the last checkpoint or -1 if there is no checkpoint
+        '''
+        state = self._read(self.filename)
+        if state is None:
+            return -1
+        return int(state['iteration'])
+
+    def restore(self,iteration=None):
+        ''' load the checkpoint of an iteration, the last and the previous
+        checkpoints are searched. If iteration is None the last checkpoint
+        is loaded
+
+        return
+            state : dict or None
+                the loaded state, which is used by the next PCPG call,
+                None if there is no checkpoint of the iteration
+        '''
+        self.state = None
+        for filename in [self.filename,self.previous_filename]:
+            state = self._read(filename)
+            if state is not None and (iteration is None or int(state['iteration'])==iteration):
+                self.state = state
+                break
+        return self.state
+
+    def clear(self):
+        self.state = None
+        for filename in [self.filename,self.previous_filename]:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+
+class KrylovRecycleStore():
+    ''' Store with search directions W = [p_1, ..., p_m] and the respective
+    F actions FW of previous PCPG solves with the same F operator (same K_dict 
+    and B_dict, different loads). The stored directions are used as initial guess
+    space
+
+    lambda_0 = W (W^T F W)^-1 W^T r_0
+
+    and, if mode=='deflation', the new search directions are F-conjugated against
+    the stored ones:
+
+    p_k = P(y_k + beta*p_k-1 - W (W^T F W)^-1 (FW)^T (y_k + beta*p_k-1))
+
+    where the extra projection P removes the round-off of the stored directions.
+
+    Parameters:
+        capacity : int, Default = 100
+            max number of stored directions
+        eviction : str, Default = 'fifo'
+            policy to remove directions when the store is full, 'fifo' removes the 
+            oldest directions, 'lru' removes the directions with the oldest use, where 
+            a direction is used if it has a relevant coefficient in the initial guess
+        mode : str, Default = 'deflation'
+            'deflation' or 'initial_guess'
+        tolerance : float, Default = 1.0E-8
+            relative tolerance to drop directions with negligible F-energy, for the pseudo 
+            inverse of W^T F W and to mark the used directions
+        reprojection_interval : int, Default = 1
+            number of PCPG iterations between the projections of the deflated search 
+            direction, every projection costs one coarse solve
+    '''
+    list_of_eviction_policies = ['fifo','lru']
+    list_of_modes = ['deflation','initial_guess']
+
+    def __init__(self,capacity=100,eviction='fifo',mode='deflation',tolerance=1.0E-8,reprojection_interval=1):
+        if eviction not in self.list_of_eviction_policies:
+            raise ValueError('Eviction policy %s not supported. Please select one of %s' %(eviction,self.list_of_eviction_policies))
+        if mode not in self.list_of_modes:
+            raise ValueError('Recycling mode %s not supported. Please select one of %s' %(mode,self.list_of_modes))
+
+        self.capacity = int(capacity)
+        self.reprojection_interval = max(int(reprojection_interval),1)
+        self.eviction = eviction
+        self.mode = mode
+        self.tolerance = tolerance
+        self.interface_size = None
+        self.size = 0
+        self.run_counter = 0
+        self.W = None
+        self.FW = None
+        self.WtFW = None
+        self.inserted = np.zeros(self.capacity,dtype=int)
+        self.last_used = np.zeros(self.capacity,dtype=int)
+        self._WtFW_pinv = None
+
+    def _allocate(self,interface_size,dtype=np.float64):
+        self.interface_size = interface_size
+        self.W = np.zeros((interface_size,self.capacity),dtype=dtype)
+        self.FW = np.zeros((interface_size,self.capacity),dtype=dtype)
+        self.WtFW = np.zeros((self.capacity,self.capacity),dtype=dtype)
+
+    def _check_size(self,v):
+        if self.interface_size is not None and v.shape[0]!=self.interface_size:
+            raise ValueError('Recycle store with interface size %i cannot be used with an interface of size %i' 
+                             %(self.interface_size,v.shape[0]))
+
+    @property
+    def WtFW_pinv(self):
+        if self._WtFW_pinv is None:
+            n = self.size
+            self._WtFW_pinv = scipy.linalg.pinvh(self.WtFW[:n,:n],rtol=self.tolerance)
+        return self._WtFW_pinv
+
+    def project(self,V,v,vdot):
+        ''' compute V^T v for the stored directions with a single 
+        column-wise vdot call
+        '''
+        n = self.size
+        return vdot(V[:,:n],np.broadcast_to(v[:,None],(v.shape[0],n)))
+
+    def block_project(self,V,U,vdot,block_vdot=None):
+        ''' compute V^T U with a single block_vdot call, e.g. linalg.blockdot 
+        or MPIlinalg.parblockdot. If block_vdot is None, V^T U is computed 
+        with one column-wise vdot call per column of U
+        '''
+        m, k = V.shape[1], U.shape[1]
+        if m==0 or k==0:
+            return np.zeros((m,k),dtype=V.dtype)
+        if block_vdot is not None:
+            return np.reshape(block_vdot(V,U),(m,k))
+        return np.array([vdot(V,np.broadcast_to(u[:,None],V.shape)) for u in U.T]).T
+
+    def initial_guess(self,lambda_init,residual,vdot,F_action=None):
+        ''' update lambda and residual with the projection of the residual
+        in the stored space
+
+        lambda = lambda_init + W c
+        r = residual - FW c
+
+        where c = (W^T F W)^-1 W^T residual. If F_action is given the residual is
+        updated with F (W c), because the round-off of the stored FW of directions 
+        with small F-energy would limit the accuracy of the solve
+        '''
+        self._check_size(residual)
+        n = self.size
+        c = self.WtFW_pinv.dot(self.project(self.W,residual,vdot))
+        used = np.abs(c)>self.tolerance*np.abs(c).max() if n>0 and np.abs(c).max()>0 else np.zeros(n,dtype=bool)
+        self.last_used[:n][used] = self.run_counter + 1
+        Wc = self.W[:,:n].dot(c)
+        if F_action is not None:
+            return lambda_init + Wc, residual - F_action(Wc)
+        return lambda_init + Wc, residual - self.FW[:,:n].dot(c)
+
+    def deflation_correction(self,y,vdot):
+        ''' compute W (W^T F W)^-1 (FW)^T y
+        '''
+        n = self.size
+        mu = self.WtFW_pinv.dot(self.project(self.FW,y,vdot))
+        return self.W[:,:n].dot(mu)
+
+    def _evict(self,number_of_directions):
+        ''' remove number_of_directions based on the eviction policy
+        '''
+        n = self.size
+        if self.eviction=='lru':
+            order = np.lexsort((self.inserted[:n],self.last_used[:n]))
+        else:
+            order = np.argsort(self.inserted[:n],kind='stable')
+        keep = np.sort(order[number_of_directions:])
+        m = len(keep)
+        self.W[:,:m] = self.W[:,keep]
+        self.FW[:,:m] = self.FW[:,keep]
+        self.WtFW[:m,:m] = self.WtFW[np.ix_(keep,keep)]
+        self.inserted[:m] = self.inserted[keep]
+        self.last_used[:m] = self.last_used[keep]
+        self.size = m
+
+    def update(self,direction_store,vdot,block_vdot=None):
+        ''' add the directions of a DirectionStore to the recycle store,
+        the matrix products are reduced with block_vdot, see block_project
+        '''
+        self.run_counter += 1
+        P, FP, pFp = direction_store.get_directions()
+        if P.shape[1]==0:
+            return
+
+        if self.W is None:
+            self._allocate(P.shape[0],P.dtype)
+        self._check_size(P)
+
+        # keep the latest directions if there are more than the capacity
+        P, FP, pFp = P[:,-self.capacity:], FP[:,-self.capacity:], pFp[-self.capacity:]
+        n_evict = self.size + P.shape[1] - self.capacity
+        if n_evict>0:
+            self._evict(n_evict)
+
+        # new directions are F-orthogonalized against the stored ones and
+        # compressed by the eigen decomposition of N^T F N, such that W^T F W stays
+        # close to the identity. Numerically dependent directions are dropped
+        n_old = self.size
+        N, FN = P, FP
+        if n_old>0:
+            W, FW = self.W[:,:n_old], self.FW[:,:n_old]
+            coef = self.block_project(FW,N,vdot,block_vdot)
+            N = N - W.dot(coef)
+            FN = FN - FW.dot(coef)
+
+        NtFN = self.block_project(FN,N,vdot,block_vdot)
+        eigval, eigvec = np.linalg.eigh(0.5*(NtFN + NtFN.T))
+        keep = eigval>self.tolerance*eigval.max()
+        T = eigvec[:,keep]/np.sqrt(eigval[keep])
+        n_new = T.shape[1]
+        self.W[:,n_old:n_old+n_new] = N.dot(T)
+        self.FW[:,n_old:n_old+n_new] = FN.dot(T)
+        self.inserted[n_old:n_old+n_new] = self.run_counter
+        self.last_used[n_old:n_old+n_new] = self.run_counter
+        self.size = n_old + n_new
+
+        # the block of the new directions is symmetrized with its upper triangle
+        WtFW_new = self.block_project(self.W[:,:self.size],self.FW[:,n_old:self.size],vdot,block_vdot)
+        WtFW_new[n_old:] = np.triu(WtFW_new[n_old:]) + np.triu(WtFW_new[n_old:],1).T
+        self.WtFW[:self.size,n_old:self.size] = WtFW_new
+        self.WtFW[n_old:self.size,:self.size] = WtFW_new.T
+        self._WtFW_pinv = None
+
+    def clear(self):
+        self.size = 0
+        self._WtFW_pinv = None
+
+    def save(self,filename):
+        ''' save the store in a numpy .npz file
+        '''
+        n = self.size
+        with open(filename,'wb') as f:
+            np.savez(f,W=self.W[:,:n] if n>0 else np.zeros((0,0)),
+                     FW=self.FW[:,:n] if n>0 else np.zeros((0,0)),
+                     WtFW=self.WtFW[:n,:n] if n>0 else np.zeros((0,0)),
+                     inserted=self.inserted[:n],last_used=self.last_used[:n],
+                     capacity=self.capacity,eviction=self.eviction,mode=self.mode,
+                     tolerance=self.tolerance,run_counter=self.run_counter)
+
+    @classmethod
+    def load(cls,filename,**kwargs):
+        ''' load a store saved with the save method, key args overwrite
+        the saved capacity, eviction, mode or tolerance
+        '''
+        with np.load(filename) as data:
+            options = dict(capacity=int(data['capacity']),eviction=str(data['eviction']),
+                           mode=str(data['mode']),tolerance=float(data['tolerance']))
+            options.update(kwargs)
+            store = cls(**options)
+            store.run_counter = int(data['run_counter'])
+            W = data['W']
+            n = min(W.shape[1],store.capacity)
+            if W.shape[0]>0:
+                store._allocate(W.shape[0],W.dtype)
+                store.W[:,:n] = W[:,-n:]
+                store.FW[:,:n] = data['FW'][:,-n:]
+                store.WtFW[:n,:n] = data['WtFW'][-n:,-n:]
+                store.inserted[:n] = data['inserted'][-n:]
+                store.last_used[:n] = data['last_used'][-n:]
+                store.size = n
+        return store
+
+
+def alpha_calc(vn1,pk,Fpk,vdot=None):
+    if vdot is None:
+        vdot = lambda v,w : np.dot(v,w)
+
+    aux2 = vdot(pk,Fpk)
+    alpha = float(vn1/aux2)
+    return alpha
+
+def lanczos_tridiagonal(lanczos_alpha,lanczos_beta):
+    ''' Lanczos tridiagonal matrix T of the preconditioned and projected operator
+    defined by the conjugate gradient coefficients, where lanczos_beta[j] is the
+    coefficient used to build the search direction p_j = y_j + beta_j*p_j-1
+
+        T_jj = 1/alpha_j + beta_j/alpha_j-1
+        T_j-1,j = sqrt(beta_j)/alpha_j-1
+
+    return
+        diagonal : np.array
+        off_diagonal : np.array
+    '''
+    alpha = np.asarray(lanczos_alpha,dtype=float)
+    beta = np.asarray(lanczos_beta,dtype=float)
+    diagonal = 1.0/alpha
+    diagonal[1:] += beta[1:]/alpha[:-1]
+    off_diagonal = np.sqrt(np.abs(beta[1:]))/alpha[:-1]
+    return diagonal, off_diagonal
+
+def predicted_iterations(condition_number,rel_tolerance):
+    ''' number of conjugate gradient iterations to reduce the error by rel_tolerance
+    based on the classical bound 2*((sqrt(k) - 1)/(sqrt(k) + 1))^m
+    '''
+    if not np.isfinite(condition_number):
+        return np.inf
+    return int(np.ceil(0.5*np.sqrt(max(condition_number,1.0))*np.log(2.0/rel_tolerance)))
+
+def lanczos_spectrum_estimate(lanczos_alpha,lanczos_beta,rel_tolerance=None):
+    ''' extreme Ritz values and condition number estimate of the preconditioned
+    and projected operator from the Lanczos tridiagonal matrix of the
+    conjugate gradient coefficients, see lanczos_tridiagonal.
+    The Ritz values are inside the spectrum, such that the condition
+    number estimate is a lower bound which improves with the iterations
+
+    Parameters:
+        lanczos_alpha : list
+            alpha coefficients of the iterations
+        lanczos_beta : list
+            beta coefficients of the iterations
+        rel_tolerance : float, Default = None
+            target reduction of the residual for the predicted number of iterations
+
+    return
+        info : dict
+            dict with ritz_min, ritz_max, condition_number and, if rel_tolerance is
+            given, predicted_iterations. Empty if there is no coefficient
+    '''
+    if len(lanczos_alpha)==0:
+        return {}
+
+    diagonal, off_diagonal = lanczos_tridiagonal(lanczos_alpha,lanczos_beta)
+    ritz_values = scipy.linalg.eigvalsh_tridiagonal(diagonal,off_diagonal)
+    ritz_min, ritz_max = ritz_values[0], ritz_values[-1]
+    if ritz_min>0:
+        condition_number = ritz_max/ritz_min
+    else:
+        condition_number = np.inf
+
+    info = {'ritz_min' : ritz_min, 'ritz_max' : ritz_max, 'condition_number' : condition_number}
+    if rel_tolerance is not None:
+        info['predicted_iterations'] = predicted_iterations(condition_number,rel_tolerance)
+    return info
+
+def pminres(F_action,residual,Projection_action=None,lambda_init=None,
+        Precondicioner_action=None,tolerance=1.e-10,max_int=500):
+        ''' This function is a general interface for Scipy MinRes algorithm
+
+        argument:
+        F_action: callable function
+        callable function that acts in lambda
+
+        residual: np.array
+        array with initial interface gap
+
+        lambda_init : np.array
+        intial lambda array
+
+        Projection_action: callable function
+        callable function to project the residual
+
+        Precondicioner_action : callable function
+        callable function to atcs as a preconditioner operator
+        in the array w
+
+        tolerance: float
+        convergence tolerance
+
+        max_int = int
+        maximum number of iterations
+
+        return 
+        lampda_pcgp : np.array
+            last lambda
+        rk : np.array
+            last projected residual
+        proj_r_hist : list
+            list of the history of the norm of the projected  residuals
+        lambda_hist : list
+            list of the 
+
+        '''
+         
+        interface_size = len(residual)
+         
+        if lambda_init is None:
+            lampda_pcpg = np.zeros(interface_size)
+        else:
+            lampda_pcpg = lambda_init
+         
+        if Precondicioner_action is None:
+            Precond = np.eye(interface_size,interface_size).dot
+        else:
+            Precond = Precondicioner_action
+
+        if Projection_action is None:
+            P = np.eye(interface_size,interface_size).dot
+        else:
+            P = Projection_action
+            
+        #F = F_action
+        F = sparse.linalg.LinearOperator((interface_size,interface_size), matvec=F_action)
+        P = sparse.linalg.LinearOperator((interface_size,interface_size), matvec=P, rmatvec = P)
+
+        PF= ProjectorOperator(F,P,shape=(interface_size,interface_size))
+        b = residual - F.dot(lampda_pcpg)
+        #lampda_pcpg, info = sparse.linalg.minres(PF,b,x0=lampda_pcpg,tol=tolerance,maxiter=max_int,show=False,check=False)
+        lampda_pcpg, info = sparse.linalg.minres(F,b,x0=lampda_pcpg,M=P,tol=tolerance,maxiter=max_int,show=False,check=False)
+
+        rk, proj_r_hist, lambda_hist = PF.dot(lampda_pcpg) - b, None, None
+
+        if  info==0:
+            logging.info('Project MinRes has converged')
+        else:
+            logging.info('Project MinRes has NOT converged after %i iterations', info)
+
+        return lampda_pcpg, rk , proj_r_hist, lambda_hist
+
+
+class  Test_solvers(TestCase):
+
+    def test_ProjectorOperator_with_minres(self):
+        A = 3*np.array([[2,-1,0],[-1,2,0],[0,-1,2]])
+        P = np.array([[1,0,0],[0,1,0],[0,0,0]])
+        b = np.array([-2,4,0])
+        Asingular = P.dot(A.dot(P))
+
+        F_action = lambda x : A.dot(x)
+        Projection_action = lambda x : P.dot(x)
+        residual = b
+
+        x_minres, rk, proj_r_hist, lambda_hist = pminres(F_action,residual,Projection_action)
+        x_svd = (np.linalg.pinv(Asingular)).dot(b)
+        np.testing.assert_almost_equal(x_minres,x_svd,decimal=10)
+
+    def test_PCPG(self):
+        A = 3*np.array([[2,-1,0],[-1,2,-1],[0,-1,1]])
+        b = np.array([-2,4,0])
+
+        x_target = np.linalg.solve(A,b)
+        r = b
+        x_pcpg, rk , proj_r_hist, X_hist = PCPG(A.dot,r,max_int=6)
+        np.testing.assert_array_almost_equal(x_target,x_pcpg,decimal=10)
+
+    def test_PCPG_full_reorthogonalization(self):
+        n = 60
+        A = np.diag(np.logspace(0,4,n))
+        Q, _ = np.linalg.qr(np.random.RandomState(1).rand(n,n))
+        A = Q.dot(A).dot(Q.T)
+        b = np.ones(n)
+        x_target = np.linalg.solve(A,b)
+
+        x, rk, proj_r_hist, X_hist, info_dict = PCPG(A.dot,b,max_int=n,tolerance=1.0e-10)
+        x_reorth, rk, proj_r_hist_reorth, X_hist, info_dict_reorth = PCPG(A.dot,b,max_int=n,tolerance=1.0e-10,
+                                                                          full_reorthogonalization=True,
+                                                                          max_stored_directions=n)
+        np.testing.assert_array_almost_equal(x_target,x_reorth,decimal=8)
+        self.assertTrue(info_dict_reorth['PCPG_iterations']<=info_dict['PCPG_iterations'])
+        self.assertTrue('Total_elaspsed_time_reorthogonalization' in info_dict_reorth)
+
+    def test_WorkspacePCPG(self):
+        n = 40
+        A = np.diag(np.logspace(0,2,n))
+        Q, _ = np.linalg.qr(np.random.RandomState(2).rand(n,n))
+        A = Q.dot(A).dot(Q.T)
+        G = np.random.RandomState(4).rand(2,n)
+        P = np.eye(n) - G.T.dot(np.linalg.solve(G.dot(G.T),G))
+        M = np.diag(1.0/A.diagonal())
+        workspace = PCPGWorkspace(n)
+
+        for i, precond in enumerate([None,M.dot]):
+            b = np.random.RandomState(i).rand(n)
+            x, rk, proj_r_hist, X_hist, info_dict = PCPG(A.dot,b,Projection_action=P.dot,
+                                                         Precondicioner_action=precond,tolerance=1.0e-6)
+            # projection which writes in a caller-provided buffer
+            projection = lambda v, out=None : np.dot(P,v,out=out)
+            x_ws, rk_ws, proj_r_hist_ws, X_hist, info_dict_ws = WorkspacePCPG(A.dot,b,Projection_action=projection,
+                                                                              Precondicioner_action=precond,
+                                                                              tolerance=1.0e-6,workspace=workspace)
+            np.testing.assert_array_almost_equal(x,x_ws,decimal=10)
+            np.testing.assert_array_almost_equal(rk,rk_ws,decimal=10)
+            self.assertEqual(info_dict_ws['PCPG_iterations'],info_dict['PCPG_iterations'])
+            self.assertFalse(np.shares_memory(x_ws,workspace.lampda))
+
+        self.assertEqual(workspace.nbytes,7*n*8)
+        self.assertRaises(ValueError,WorkspacePCPG,A.dot,np.ones(n+1),workspace=workspace)
+
+    def test_PipelinedPCPG(self):
+        n = 40
+        A = np.diag(np.logspace(0,2,n))
+        Q, _ = np.linalg.qr(np.random.RandomState(2).rand(n,n))
+        A = Q.dot(A).dot(Q.T)
+        b = np.random.RandomState(3).rand(n)
+        G = np.random.RandomState(4).rand(2,n)
+        P = np.eye(n) - G.T.dot(np.linalg.solve(G.dot(G.T),G))
+        M = np.diag(1.0/A.diagonal())
+
+        for precond in [None,M.dot]:
+            x, rk, proj_r_hist, X_hist, info_dict = PCPG(A.dot,b,Projection_action=P.dot,
+                                                         Precondicioner_action=precond,tolerance=1.0e-6)
+            x_pipe, rk_pipe, proj_r_hist_pipe, X_hist, info_dict_pipe = PipelinedPCPG(A.dot,b,Projection_action=P.dot,
+                                                                                      Precondicioner_action=precond,
+                                                                                      tolerance=1.0e-6,ivdot=ivdot)
+            np.testing.assert_array_almost_equal(x,x_pipe,decimal=5)
+            np.testing.assert_array_almost_equal(P.dot(x_pipe),x_pipe,decimal=10)
+            self.assertTrue(abs(info_dict_pipe['PCPG_iterations'] - info_dict['PCPG_iterations'])<=2)
+            self.assertTrue(np.linalg.norm(rk_pipe)<=1.0e-6)
+            self.assertTrue('Total_elaspsed_time_reduction_wait' in info_dict_pipe)
+
+    def test_lanczos_spectrum_estimate(self):
+        n = 60
+        eigval = np.logspace(0,3,n)
+        Q, _ = np.linalg.qr(np.random.RandomState(5).rand(n,n))
+        A = Q.dot(np.diag(eigval)).dot(Q.T)
+        b = np.random.RandomState(6).rand(n)
+
+        for method in [PCPG,WorkspacePCPG,PipelinedPCPG]:
+            kwargs = {'ivdot' : ivdot} if method is PipelinedPCPG else {}
+            x, rk, proj_r_hist, X_hist, info_dict = method(A.dot,b,tolerance=1.0e-8,max_int=10,**kwargs)
+            self.assertEqual(len(info_dict['lanczos_alpha']),10)
+            self.assertTrue(info_dict['ritz_min']>=eigval[0]*(1.0 - 1.0e-8))
+            self.assertTrue(info_dict['ritz_max']<=eigval[-1]*(1.0 + 1.0e-8))
+            self.assertTrue(info_dict['predicted_iterations']>10)
+
+            x, rk, proj_r_hist, X_hist, info_dict = method(A.dot,b,tolerance=1.0e-8,max_int=3*n,**kwargs)
+            self.assertAlmostEqual(info_dict['condition_number']/1.0e3,1.0,places=3)
+
+        self.assertEqual(lanczos_spectrum_estimate([],[]),{})
+        self.assertEqual(predicted_iterations(np.inf,1.0e-6),np.inf)
+
+    def test_PCPG_checkpoint(self):
+        n = 40
+        Q, _ = np.linalg.qr(np.random.RandomState(7).rand(n,n))
+        A = Q.dot(np.diag(np.logspace(0,2,n))).dot(Q.T)
+        b = np.random.RandomState(8).rand(n)
+        M = np.diag(1.0/A.diagonal())
+
+        for full_reorthogonalization in [False,True]:
+            kwargs = dict(Precondicioner_action=M.dot,tolerance=1.0e-8,full_reorthogonalization=full_reorthogonalization)
+            x, rk, proj_r_hist, X_hist, info_dict = PCPG(A.dot,b,**kwargs)
+
+            checkpoint = PCPGCheckpoint('pcpg_checkpoint_test.npz',interval=4)
+            try:
+                # interrupted solve
+                PCPG(A.dot,b,max_int=10,checkpoint=checkpoint,**kwargs)
+                self.assertEqual(checkpoint.latest_iteration(),8)
+                self.assertEqual(int(checkpoint.restore(4)['iteration']),4)
+                self.assertEqual(checkpoint.restore(6),None)
+
+                checkpoint.restore()
+                x_restart, rk, proj_r_hist_restart, X_hist, info_dict_restart = PCPG(A.dot,b,checkpoint=checkpoint,**kwargs)
+                self.assertEqual(info_dict_restart['restart_iteration'],8)
+                self.assertEqual(info_dict_restart['PCPG_iterations'],info_dict['PCPG_iterations'])
+                np.testing.assert_array_almost_equal(proj_r_hist,proj_r_hist_restart,decimal=12)
+                np.testing.assert_array_almost_equal(x,x_restart,decimal=12)
+            finally:
+                checkpoint.clear()
+
+    def test_BlockPCPG(self):
+        A = 3*np.array([[2,-1,0],[-1,2,-1],[0,-1,1]])
+        b = np.array([[-2,1],[4,0],[0,1]])
+        P = np.array([[1,0,0],[0,1,0],[0,0,0]])
+
+        x_target = np.linalg.solve(A,b)
+        x_pcpg, rk , proj_r_hist, X_hist, info_dict = BlockPCPG(A.dot,b,max_int=6)
+        np.testing.assert_array_almost_equal(x_target,x_pcpg,decimal=10)
+        self.assertEqual(len(proj_r_hist),2)
+
+        # every column must match the single rhs algorithm
+        x_block, rk , proj_r_hist, X_hist, info_dict = BlockPCPG(A.dot,b,Projection_action=P.dot,
+                                                                 Precondicioner_action=np.diag(1.0/A.diagonal()).dot)
+        for i in range(2):
+            x, rk , proj_r_hist, X_hist, info_dict = PCPG(A.dot,b[:,i],Projection_action=P.dot,
+                                                          Precondicioner_action=np.diag(1.0/A.diagonal()).dot)
+            np.testing.assert_array_almost_equal(x,x_block[:,i],decimal=10)
+
+    def test_PCPG_with_KrylovRecycleStore(self):
+        n = 200
+        Q, _ = np.linalg.qr(np.random.RandomState(2).rand(n,n))
+        A = Q.dot(np.diag(np.logspace(0,2,n))).dot(Q.T)
+        b1 = np.ones(n)
+        b2 = np.ones(n) + 0.1*np.random.RandomState(3).rand(n)
+
+        x, rk, proj_r_hist, X_hist, info_dict = PCPG(A.dot,b2,tolerance=1.0e-8,max_int=n)
+        for mode in KrylovRecycleStore.list_of_modes:
+            store = KrylovRecycleStore(capacity=n,mode=mode)
+            PCPG(A.dot,b1,tolerance=1.0e-8,max_int=n,recycle_store=store)
+            self.assertTrue(store.size>0)
+
+            x_recycle, rk, proj_r_hist, X_hist, info_dict_recycle = PCPG(A.dot,b2,tolerance=1.0e-8,max_int=n,recycle_store=store)
+            np.testing.assert_array_almost_equal(np.linalg.solve(A,b2),x_recycle,decimal=6)
+            self.assertTrue(info_dict_recycle['PCPG_iterations']<info_dict['PCPG_iterations'])
+
+    def test_KrylovRecycleStore_eviction_and_persistence(self):
+        import tempfile, os, shutil
+        n = 6
+        vdot = coldot
+        for eviction in KrylovRecycleStore.list_of_eviction_policies:
+            store = KrylovRecycleStore(capacity=3,eviction=eviction)
+            for run in range(2):
+                run_store = DirectionStore(n,max_directions=2)
+                for i in range(2):
+                    p = np.zeros(n)
+                    p[2*run+i] = 1.0
+                    run_store.append(p,p,1.0)
+                store.update(run_store,vdot)
+            self.assertEqual(store.size,3)
+            np.testing.assert_array_almost_equal(store.WtFW[:3,:3],np.eye(3))
+            V, U = np.random.RandomState(0).rand(n,3), np.random.RandomState(1).rand(n,2)
+            np.testing.assert_array_almost_equal(store.block_project(V,U,vdot),V.T.dot(U))
+            np.testing.assert_array_almost_equal(store.block_project(V,U,vdot,blockdot),V.T.dot(U))
+
+            temp_dir = tempfile.mkdtemp()
+            try:
+                filename = os.path.join(temp_dir,'recycle.npz')
+                store.save(filename)
+                new_store = KrylovRecycleStore.load(filename)
+                np.testing.assert_array_equal(store.W[:,:3],new_store.W[:,:3])
+                self.assertEqual(new_store.eviction,eviction)
+            finally:
+                shutil.rmtree(temp_dir,ignore_errors=True)
+
+    def test_DirectionStore_ring_buffer(self):
+        store = DirectionStore(4,max_directions=10,memory_budget=2*2*4*8)
+        self.assertEqual(store.max_directions,2)
+        for i in range(3):
+            p = np.zeros(4)
+            p[i] = 1.0
+            store.append(p,p,1.0)
+
+        self.assertEqual(store.size,2)
+        np.testing.assert_array_equal(store.P[:,0],[0.0,0.0,1.0,0.0])
+        np.testing.assert_array_almost_equal(store.conjugate(np.ones(4)),[1.0,0.0,0.0,1.0])
 
 
 if __name__ == '__main__':
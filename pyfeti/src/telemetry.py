@@ -0,0 +1,209 @@
+from unittest import TestCase, main
+import numpy as np
+import time
+import os
+
+
+class Telemetry():
+    ''' Low overhead timers and counters for the FETI solvers.
+    Every record of an event is stored in preallocated arrays, such that
+    timing an event costs one time.perf_counter call and a few array
+    assignments, and no string is built during the iterations.
+
+    t0 = telemetry.start()
+    ...
+    telemetry.stop('projection',t0)
+
+    The records are summarized with summary(), aggregated over mpi ranks with
+    aggregate() and exported as one .npz file with export().
+
+    Parameters:
+        capacity : int, Default = 4096
+            number of stored records per event, when it is reached the oldest
+            records are overwritten, but counts and totals are still updated
+        enabled : Boolean, Default = True
+            if False start and stop do nothing
+    '''
+    list_of_events = ['projection','precondition','F_action','exchange','reduction','local_solve','local_F','coarse_setup','coarse_solve','iteration']
+
+    def __init__(self,capacity=4096,enabled=True):
+        self.capacity = int(capacity)
+        self.enabled = enabled
+        self.event_index = {event : i for i, event in enumerate(self.list_of_events)}
+        n_events = len(self.list_of_events)
+        self.durations = np.zeros((n_events,self.capacity))
+        self.counts = np.zeros(n_events,dtype=int)
+        self.totals = np.zeros(n_events)
+        self.max_durations = np.zeros(n_events)
+
+    def start(self):
+        if self.enabled:
+            return time.perf_counter()
+        return 0.0
+
+    def stop(self,event,t0):
+        ''' record the elapsed time since t0 for the event
+        '''
+        if self.enabled:
+            self.record(event,time.perf_counter() - t0)
+
+    def record(self,event,elapsed_time):
+        ''' record an elapsed time for the event
+        '''
+        if not self.enabled:
+            return
+        i = self.event_index[event]
+        n = self.counts[i]
+        self.durations[i,n % self.capacity] = elapsed_time
+        self.counts[i] = n + 1
+        self.totals[i] += elapsed_time
+        if elapsed_time>self.max_durations[i]:
+            self.max_durations[i] = elapsed_time
+
+    def reset(self):
+        self.durations[:] = 0.0
+        self.counts[:] = 0
+        self.totals[:] = 0.0
+        self.max_durations[:] = 0.0
+
+    def summary(self):
+        ''' summary of the recorded events
+
+        return
+            summary : dict
+                dict with event as key and a dict with count, total, mean and max
+                elapsed time as value. Events without records are not included
+        '''
+        summary = {}
+        for event, i in self.event_index.items():
+            count = int(self.counts[i])
+            if count>0:
+                summary[event] = {'count' : count,
+                                  'total' : float(self.totals[i]),
+                                  'mean' : float(self.totals[i]/count),
+                                  'max' : float(self.max_durations[i])}
+        return summary
+
+    def get_records(self,event):
+        ''' stored records of an event in chronological order
+        '''
+        i = self.event_index[event]
+        n = self.counts[i]
+        if n<=self.capacity:
+            return self.durations[i,:n].copy()
+        start = n % self.capacity
+        return np.concatenate((self.durations[i,start:],self.durations[i,:start]))
+
+    def export(self,filename,comm=None,root=0):
+        ''' export the records of all ranks in one .npz file. If comm is given the
+        records are gathered in the root rank, which writes the file
+
+        The file has the arrays events, counts (n_ranks, n_events), totals (n_ranks, n_events),
+        max_durations (n_ranks, n_events) and durations (n_ranks, n_events, capacity)
+
+        Parameters:
+            filename : str
+                name of the .npz file
+            comm : mpi4py.MPI.Comm, Default = None
+                communicator of the ranks
+            root : int, Default = 0
+                rank which writes the file
+
+        return
+            filename : str or None
+                the file name in the root rank and None in the others
+        '''
+        local_data = (self.counts,self.totals,self.max_durations,self.durations)
+        if comm is None:
+            all_data = [local_data]
+        else:
+            all_data = comm.gather(local_data,root=root)
+            if comm.Get_rank()!=root:
+                return None
+
+        counts, totals, max_durations, durations = [np.array(data) for data in zip(*all_data)]
+        with open(filename,'wb') as f:
+            np.savez(f,events=np.array(self.list_of_events),counts=counts,totals=totals,
+                     max_durations=max_durations,durations=durations,capacity=self.capacity)
+        return filename
+
+
+def aggregate(summary_list):
+    ''' aggregate the summaries of several mpi ranks
+
+    Parameters:
+        summary_list : list
+            list of Telemetry.summary() dicts, one per rank
+
+    return
+        summary : dict
+            dict with event as key and a dict with the total number of records (count),
+            the max, mean and min total elapsed time over the ranks (total, total_mean, total_min)
+            and the max elapsed time of a single record (max)
+    '''
+    summary = {}
+    for event in Telemetry.list_of_events:
+        event_summaries = [rank_summary[event] for rank_summary in summary_list if event in rank_summary]
+        if not event_summaries:
+            continue
+        totals = np.array([item['total'] for item in event_summaries])
+        summary[event] = {'count' : int(sum(item['count'] for item in event_summaries)),
+                          'total' : float(totals.max()),
+                          'total_mean' : float(totals.mean()),
+                          'total_min' : float(totals.min()),
+                          'max' : float(max(item['max'] for item in event_summaries)),
+                          'ranks' : len(event_summaries)}
+    return summary
+
+
+# telemetry object of the process, used by solvers, MPIlinalg and feti_solver
+telemetry = Telemetry()
+
+
+class  Test_telemetry(TestCase):
+    def test_records_and_summary(self):
+        tel = Telemetry(capacity=3)
+        for i in range(5):
+            tel.record('projection',float(i))
+        t0 = tel.start()
+        tel.stop('reduction',t0)
+
+        summary = tel.summary()
+        self.assertEqual(summary['projection']['count'],5)
+        self.assertEqual(summary['projection']['total'],10.0)
+        self.assertEqual(summary['projection']['max'],4.0)
+        self.assertEqual(summary['reduction']['count'],1)
+        self.assertFalse('F_action' in summary)
+        np.testing.assert_array_equal(tel.get_records('projection'),[2.0,3.0,4.0])
+
+        tel.enabled = False
+        tel.record('projection',1.0)
+        self.assertEqual(tel.summary()['projection']['count'],5)
+
+        tel.reset()
+        self.assertEqual(tel.summary(),{})
+
+    def test_aggregate_and_export(self):
+        tel1, tel2 = Telemetry(capacity=4), Telemetry(capacity=4)
+        tel1.record('F_action',1.0)
+        tel2.record('F_action',3.0)
+        tel2.record('exchange',0.5)
+
+        summary = aggregate([tel1.summary(),tel2.summary()])
+        self.assertEqual(summary['F_action']['count'],2)
+        self.assertEqual(summary['F_action']['total'],3.0)
+        self.assertEqual(summary['F_action']['total_min'],1.0)
+        self.assertEqual(summary['exchange']['ranks'],1)
+
+        filename = 'telemetry_test.npz'
+        try:
+            tel2.export(filename)
+            data = np.load(filename)
+            self.assertEqual(data['counts'].shape,(1,len(Telemetry.list_of_events)))
+            self.assertEqual(data['durations'].shape,(1,len(Telemetry.list_of_events),4))
+        finally:
+            os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 
 import sys 
+import os
 import numpy as np
 from unittest import TestCase, main
 from collections import OrderedDict
@@ -8,8 +9,8 @@ import time
 sys.path.append('../..')
 from pyfeti.src.utils import OrderedSet, Get_dofs, save_object, MapDofs
 from pyfeti.src.linalg import Matrix, Vector,  elimination_matrix_from_map_dofs, expansion_matrix_from_map_dofs
-from pyfeti.src.feti_solver import ParallelFETIsolver, SerialFETIsolver
-from pyfeti.src.solvers import PCPG
+from pyfeti.src.feti_solver import ParallelFETIsolver, SerialFETIsolver, SerialFETIDPsolver, SolverManager, LocalProblem
+from pyfeti.src.solvers import PCPG, KrylovRecycleStore
 from pyfeti.src.MPIlinalg import ParallelRetangularLinearOperator
 from pyfeti.src.linalg import RetangularLinearOperator
 from pyfeti.cases.case_generator import create_FETI_case
@@ -711,7 +712,404 @@ class  Test_FETIsolver(TestCase):
         for key, G in G_dict.items():
             np.testing.assert_array_equal(G,G_calc_dict[key].A)
 
-        
+    def test_block_solver_multiple_rhs(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        f_dict_2 = {key : 2.0*np.roll(f.data,3) for key, f in f_dict.items()}
+
+        sol_list = SerialFETIsolver(K_dict,B_dict,[f_dict,f_dict_2],precond_type='Dirichlet',tolerance=1.0E-10).solve()
+        sol_list_par = ParallelFETIsolver(K_dict,B_dict,[f_dict,f_dict_2],precond_type='Dirichlet',tolerance=1.0E-10).solve()
+        self.assertEqual(len(sol_list),2)
+        self.assertEqual(len(sol_list_par),2)
+
+        for f, sol_obj, sol_obj_par in zip([f_dict,f_dict_2],sol_list,sol_list_par):
+            sol_target = SerialFETIsolver(K_dict,B_dict,f,precond_type='Dirichlet',tolerance=1.0E-10).solve()
+            norm = np.linalg.norm(sol_target.displacement)
+            np.testing.assert_almost_equal(sol_target.displacement/norm,sol_obj.displacement/norm,decimal=8)
+            np.testing.assert_almost_equal(sol_target.displacement/norm,sol_obj_par.displacement/norm,decimal=8)
+            self.assertEqual(sol_obj.PCGP_iterations,sol_obj_par.PCGP_iterations)
+
+        # every PCPG variant solves the right hand sides with the BlockPCPG
+        for dual_interface_algorithm in ['WorkspacePCPG','PipelinedPCPG']:
+            sol_list_alg = SerialFETIsolver(K_dict,B_dict,[f_dict,f_dict_2],precond_type='Dirichlet',tolerance=1.0E-10,
+                                            dual_interface_algorithm=dual_interface_algorithm).solve()
+            for sol_obj, sol_obj_alg in zip(sol_list,sol_list_alg):
+                np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_alg.displacement,decimal=10)
+
+        solver = SerialFETIsolver(K_dict,B_dict,[f_dict,f_dict_2],dual_interface_algorithm='pminres')
+        self.assertRaises(ValueError,solver.solve)
+
+    def test_serial_solver_full_reorthogonalization(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,3)
+        sol_obj = SerialFETIsolver(K_dict,B_dict,f_dict,precond_type=None).solve()
+        sol_obj_reorth = SerialFETIsolver(K_dict,B_dict,f_dict,precond_type=None,full_reorthogonalization=True,
+                                          max_stored_directions=20).solve()
+
+        np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_reorth.displacement,decimal=10)
+        self.assertTrue(sol_obj_reorth.PCGP_iterations<=sol_obj.PCGP_iterations)
+
+    def test_pipelined_pcpg(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        sol_obj = SerialFETIsolver(K_dict,B_dict,f_dict,precond_type='Dirichlet').solve()
+        for algorithm in [SerialFETIsolver, ParallelFETIsolver]:
+            sol_obj_pipe = algorithm(K_dict,B_dict,f_dict,precond_type='Dirichlet',
+                                     dual_interface_algorithm='PipelinedPCPG').solve()
+
+            np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_pipe.displacement,decimal=8)
+            self.assertTrue(abs(sol_obj.PCGP_iterations - sol_obj_pipe.PCGP_iterations)<=2)
+            self.assertTrue('Total_elaspsed_time_reduction_wait' in sol_obj_pipe.info_dict)
+
+    def test_workspace_pcpg(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        sol_obj = SerialFETIsolver(K_dict,B_dict,f_dict,precond_type='Dirichlet').solve()
+        for algorithm in [SerialFETIsolver, ParallelFETIsolver]:
+            sol_obj_ws = algorithm(K_dict,B_dict,f_dict,precond_type='Dirichlet',
+                                   dual_interface_algorithm='WorkspacePCPG').solve()
+
+            np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_ws.displacement,decimal=10)
+            self.assertEqual(sol_obj.PCGP_iterations,sol_obj_ws.PCGP_iterations)
+
+    def test_solution_telemetry(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,2,2)
+        for algorithm, n_ranks in [(SerialFETIsolver,1), (ParallelFETIsolver,4)]:
+            sol_obj = algorithm(K_dict,B_dict,f_dict,precond_type='Dirichlet').solve()
+            telemetry = sol_obj.telemetry
+
+            for event in ['projection','precondition','F_action','local_solve','iteration']:
+                self.assertTrue(telemetry[event]['count']>0)
+                self.assertEqual(telemetry[event]['ranks'],n_ranks)
+            self.assertEqual(telemetry['F_action']['count'],n_ranks*(sol_obj.PCGP_iterations))
+
+        self.assertTrue('reduction' in telemetry)
+        self.assertTrue('exchange' in telemetry)
+
+    def test_spectrum_estimate_and_auto_preconditioner(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        sol_obj = SerialFETIsolver(K_dict,B_dict,f_dict,precond_type='Dirichlet').solve()
+        sol_obj_lumped = SerialFETIsolver(K_dict,B_dict,f_dict,precond_type='Lumped').solve()
+        for key in ['ritz_min','ritz_max','condition_number','predicted_iterations']:
+            self.assertTrue(key in sol_obj.info_dict)
+        self.assertTrue(sol_obj.info_dict['condition_number']<=sol_obj_lumped.info_dict['condition_number'])
+
+        for algorithm in [SerialFETIsolver, ParallelFETIsolver]:
+            sol_obj_auto = algorithm(K_dict,B_dict,f_dict,precond_type='auto',precond_probe_iterations=5).solve()
+            precond_probe = sol_obj_auto.info_dict['precond_probe']
+            self.assertEqual(set(precond_probe),set(SolverManager.list_of_preconditioners))
+            np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_auto.displacement,decimal=8)
+
+    def test_checkpoint_restart(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        sol_obj = SerialFETIsolver(K_dict,B_dict,f_dict,precond_type='Dirichlet').solve()
+        for algorithm in [SerialFETIsolver, ParallelFETIsolver]:
+            kwargs = dict(precond_type='Dirichlet',checkpoint_file='checkpoint',checkpoint_interval=2)
+            try:
+                # interrupted solve
+                algorithm(K_dict,B_dict,f_dict,max_int=3,**kwargs).solve()
+                sol_obj_restart = algorithm(K_dict,B_dict,f_dict,restart=True,**kwargs).solve()
+            finally:
+                for filename in os.listdir('.'):
+                    if filename.startswith('checkpoint'):
+                        os.remove(filename)
+
+            self.assertEqual(sol_obj_restart.info_dict['restart_iteration'],2)
+            self.assertEqual(sol_obj.PCGP_iterations,sol_obj_restart.PCGP_iterations)
+            np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_restart.displacement,decimal=8)
+
+    def test_serial_solver_session(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        f_dict_2 = {key : np.roll(np.asarray(f),3) for key, f in f_dict.items()}
+
+        solver = SerialFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10)
+        sol_obj = solver.solve()
+        setup_time = solver.setup_time
+        sol_obj_2 = solver.solve(f_dict_2)
+        self.assertEqual(solver.setup_time,setup_time)
+        self.assertEqual(solver.manager.tolerance,1.0e-10)
+
+        sol_obj_target = SerialFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10).solve()
+        sol_obj_target_2 = SerialFETIsolver(K_dict,B_dict,f_dict_2,tolerance=1.0e-10).solve()
+        np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=10)
+        np.testing.assert_almost_equal(sol_obj_2.displacement,sol_obj_target_2.displacement,decimal=10)
+        self.assertEqual(sol_obj_2.PCGP_iterations,sol_obj_target_2.PCGP_iterations)
+
+        # warm start from the solution and from the lambda of other loads
+        sol_obj_warm = solver.solve(f_dict_2,lambda0=sol_obj_2.interface_lambda)
+        self.assertTrue(sol_obj_warm.PCGP_iterations<=2)
+        np.testing.assert_almost_equal(sol_obj_warm.displacement,sol_obj_target_2.displacement,decimal=10)
+        sol_obj_warm = solver.solve(f_dict,lambda0=sol_obj_2.interface_lambda)
+        np.testing.assert_almost_equal(sol_obj_warm.displacement,sol_obj_target.displacement,decimal=8)
+
+        # multiple right hand sides with the same setup
+        sol_list = solver.solve([f_dict,f_dict_2])
+        np.testing.assert_almost_equal(sol_list[1].displacement,sol_obj_target_2.displacement,decimal=8)
+
+    def test_rigid_body_modes_kernel(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        # every subdomain of case_162 is a grid of 9 x 9 nodes
+        node_id = np.arange(81)
+        coordinates = np.array([node_id%9,node_id//9]).T
+        coordinates_dict = {key : coordinates for key in K_dict}
+        for algorithm in [SerialFETIsolver, ParallelFETIsolver]:
+            sol_obj = algorithm(K_dict,B_dict,f_dict,tolerance=1.0e-10).solve()
+            sol_obj_rbm = algorithm(K_dict,B_dict,f_dict,tolerance=1.0e-10,coordinates_dict=coordinates_dict).solve()
+            np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_rbm.displacement,decimal=8)
+            self.assertEqual(sol_obj.alpha.shape,sol_obj_rbm.alpha.shape)
+
+    def test_fixing_dofs_pseudoinverse(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        sol_obj = SerialFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10).solve()
+        for algorithm in [SerialFETIsolver, ParallelFETIsolver]:
+            sol_obj_fixing = algorithm(K_dict,B_dict,f_dict,tolerance=1.0e-10,
+                                       pseudoinverse_kargs={'method':'fixing','tolerance':1.0E-8}).solve()
+            np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_fixing.displacement,decimal=8)
+
+    def test_factorization_cache(self):
+        import tempfile, shutil
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        cache_dir = tempfile.mkdtemp()
+        pseudoinverse_kargs = {'method':'spkernel','tolerance':1.0E-8,'cache_dir':cache_dir}
+        try:
+            sol_obj = SerialFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10).solve()
+            for algorithm in [SerialFETIsolver, ParallelFETIsolver, SerialFETIsolver]:
+                sol_obj_cache = algorithm(K_dict,B_dict,f_dict,tolerance=1.0e-10,
+                                          pseudoinverse_kargs=pseudoinverse_kargs).solve()
+                np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_cache.displacement,decimal=8)
+                # the Dirichlet and the floating subdomain matrices
+                self.assertEqual(len(os.listdir(cache_dir)),2)
+        finally:
+            shutil.rmtree(cache_dir,ignore_errors=True)
+
+    def test_shared_local_matrices(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        solver = SerialFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10)
+        sol_obj = solver.solve()
+        K_local_list = [local_problem.K_local for local_problem in solver.manager.local_problem_dict.values()]
+        # Dirichlet and floating subdomains
+        self.assertEqual(len(set(map(id,K_local_list))),2)
+
+        sol_obj_target = SerialFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10,share_local_matrices=False).solve()
+        np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=10)
+
+        matrix_tags = {key : key%2 for key in K_dict}
+        solver = SerialFETIsolver(K_dict,B_dict,f_dict,matrix_tags=matrix_tags)
+        self.assertEqual(solver.manager.local_problem_dict[1].K_local,solver.manager.local_problem_dict[3].K_local)
+
+        # mpi ranks of a node share the factorizations through the cache in the temporary folder
+        solver = ParallelFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10)
+        sol_obj = solver.solve()
+        np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=10)
+        self.assertEqual(len(os.listdir(os.path.join(solver.manager.temp_folder,'factorizations'))),2)
+
+        # matrices which are unique in the node are not written to the cache
+        K_dict_unique = {key : (1.0 + 0.1*key)*K for key, K in K_dict.items()}
+        solver = ParallelFETIsolver(K_dict_unique,B_dict,f_dict,tolerance=1.0e-10)
+        solver.solve()
+        self.assertFalse(os.path.exists(os.path.join(solver.manager.temp_folder,'factorizations')))
+
+    def test_local_problem_multiple_rhs(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,3)
+        domain_id = 5
+        n_columns = 4
+        random_state = np.random.RandomState(0)
+        for method in ['spkernel','fixing','cholsps','svd']:
+            local_problem = LocalProblem(K_dict[domain_id],B_dict[domain_id],f_dict[domain_id],id=domain_id,
+                                         pseudoinverse_kargs={'method':method,'tolerance':1.0E-8})
+            lambda_dict = {}
+            for (local_id, nei_id), B in local_problem.B_local.items():
+                lambda_dict[min(local_id,nei_id),max(local_id,nei_id)] = random_state.rand(B.shape[0],n_columns)
+
+            u = local_problem.solve(lambda_dict)
+            gap_dict = local_problem.get_interface_dict(u)
+            self.assertEqual(u.shape,(local_problem.length,n_columns))
+            for precond_type in ['Lumped','SuperLumped','Dirichlet']:
+                force_dict = local_problem.apply_schur_complement(lambda_dict,precond_type=precond_type)
+                for i in range(n_columns):
+                    lambda_i = {key : value[:,i] for key, value in lambda_dict.items()}
+                    force_dict_i = local_problem.apply_schur_complement(lambda_i,precond_type=precond_type)
+                    for key, force in force_dict.items():
+                        np.testing.assert_allclose(force[:,i],force_dict_i[key],rtol=1.0e-10)
+
+            for i in range(n_columns):
+                u_i = local_problem.solve({key : value[:,i] for key, value in lambda_dict.items()})
+                np.testing.assert_almost_equal(u[:,i],u_i,decimal=10)
+                for key, gap in local_problem.get_interface_dict(u_i).items():
+                    np.testing.assert_almost_equal(gap_dict[key][:,i],gap,decimal=10)
+
+    def test_stacked_interface_operator(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,3)
+        local_problem = LocalProblem(K_dict[5],B_dict[5],f_dict[5],id=5)
+        self.assertEqual(local_problem.B_stack.dtype,np.float64)
+        self.assertEqual(local_problem.B_stack.shape,(local_problem.interface_size,local_problem.length))
+
+        x = np.random.RandomState(0).rand(local_problem.length)
+        gap_dict = local_problem.get_interface_dict(x)
+        u_target = np.zeros(local_problem.length)
+        for (local_id, nei_id), B in B_dict[5].items():
+            np.testing.assert_almost_equal(gap_dict[local_id,nei_id],B.dot(x),decimal=12)
+            u_target += B.T.dot(gap_dict[local_id,nei_id])
+
+        gap_dict = {(min(key),max(key)) : gap for key, gap in gap_dict.items()}
+        np.testing.assert_almost_equal(local_problem.expand_interface_gap(gap_dict),u_target/local_problem.scalling,decimal=12)
+
+    def test_explicit_local_operator(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,3)
+        local_problem = LocalProblem(K_dict[5],B_dict[5],f_dict[5],id=5,local_operator='explicit')
+        lambda_dict = {}
+        for (local_id, nei_id), B in local_problem.B_local.items():
+            lambda_dict[min(local_id,nei_id),max(local_id,nei_id)] = np.random.RandomState(nei_id).rand(B.shape[0],3)
+        gap_dict = local_problem.get_interface_dict(local_problem.solve(lambda_dict))
+        for key, gap in local_problem.apply_local_F(lambda_dict).items():
+            np.testing.assert_almost_equal(gap,gap_dict[key],decimal=10)
+
+        local_problem = LocalProblem(K_dict[5],B_dict[5],f_dict[5],id=5,local_operator='auto',expected_iterations=1)
+        self.assertFalse(local_problem.use_explicit_operator())
+        local_problem = LocalProblem(K_dict[5],B_dict[5],f_dict[5],id=5,local_operator='auto',expected_iterations=1000)
+        self.assertTrue(local_problem.use_explicit_operator())
+
+        sol_obj_target = SerialFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10).solve()
+        for algorithm in [SerialFETIsolver, ParallelFETIsolver]:
+            sol_obj = algorithm(K_dict,B_dict,f_dict,tolerance=1.0e-10,local_operator='explicit').solve()
+            np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=8)
+            self.assertTrue(abs(sol_obj.PCGP_iterations - sol_obj_target.PCGP_iterations)<=2)
+
+    def test_interface_last_dirichlet_preconditioner(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,3)
+        kwargs = dict(precond_type='Dirichlet',tolerance=1.0e-10)
+        sol_obj_target = SerialFETIsolver(K_dict,B_dict,f_dict,**kwargs).solve()
+
+        solver = SerialFETIsolver(K_dict,B_dict,f_dict,pseudoinverse_kargs={'method':'schur','tolerance':1.0E-8},**kwargs)
+        sol_obj = solver.solve()
+        np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=8)
+        self.assertTrue(abs(sol_obj.PCGP_iterations - sol_obj_target.PCGP_iterations)<=2)
+        for local_problem in solver.manager.local_problem_dict.values():
+            # the Dirichlet preconditioner reuses the factorization of K_local
+            self.assertIsNotNone(local_problem.get_schur_factors())
+            self.assertFalse(hasattr(local_problem,'_lu'))
+
+        sol_obj = SerialFETIsolver(K_dict,B_dict,f_dict,dense_schur=True,**kwargs).solve()
+        np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=8)
+
+        sol_obj = ParallelFETIsolver(K_dict,B_dict,f_dict,pseudoinverse_kargs={'method':'schur','tolerance':1.0E-8},
+                                     local_operator='explicit',**kwargs).solve()
+        np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=8)
+
+    def test_parallel_coarse_strategies(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        sol_obj_target = SerialFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10).solve()
+        for coarse_strategy in ['redundant','master','node','iterative']:
+            sol_obj = ParallelFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10,coarse_strategy=coarse_strategy).solve()
+            np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=8)
+            self.assertTrue(abs(sol_obj.PCGP_iterations - sol_obj_target.PCGP_iterations)<=2)
+            self.assertTrue(sol_obj.telemetry['coarse_solve']['count']>0)
+            self.assertTrue(sol_obj.telemetry['coarse_setup']['count']>0)
+            if coarse_strategy=='iterative':
+                coarse_iterations = sol_obj.info_dict['coarse_iterations']
+                self.assertTrue(len(coarse_iterations)>0)
+                self.assertTrue(max(coarse_iterations)>0)
+
+        # the two columns of the combined projection share the G G^T actions of the block conjugate gradient
+        sol_obj = ParallelFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10,coarse_strategy='iterative',
+                                     precond_type='Dirichlet',combined_projection=True).solve()
+        sol_obj_target = SerialFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10,precond_type='Dirichlet').solve()
+        np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=8)
+
+    def test_coarse_methods(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        sol_obj_target = SerialFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10).solve()
+        for coarse_method in ['inv','cholesky','qr','auto']:
+            solver = SerialFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10,coarse_method=coarse_method)
+            sol_obj = solver.solve()
+            np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=8)
+            np.testing.assert_almost_equal(sol_obj.alpha,sol_obj_target.alpha,decimal=8)
+            self.assertTrue(abs(sol_obj.PCGP_iterations - sol_obj_target.PCGP_iterations)<=2)
+
+        # the small coarse problem uses the orthonormal basis of G.T
+        Q = solver.manager.course_problem.Q
+        np.testing.assert_almost_equal(Q.T.dot(Q),np.eye(Q.shape[1]),decimal=10)
+
+        sol_obj = ParallelFETIsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10,coarse_method='qr').solve()
+        np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=8)
+
+    def test_combined_projection(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        kwargs = dict(precond_type='Dirichlet',tolerance=1.0e-10)
+        sol_obj_target = SerialFETIsolver(K_dict,B_dict,f_dict,**kwargs).solve()
+        sol_obj = SerialFETIsolver(K_dict,B_dict,f_dict,combined_projection=True,**kwargs).solve()
+        np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=8)
+        self.assertTrue(abs(sol_obj.PCGP_iterations - sol_obj_target.PCGP_iterations)<=2)
+
+        sol_obj_parallel = ParallelFETIsolver(K_dict,B_dict,f_dict,**kwargs).solve()
+        sol_obj = ParallelFETIsolver(K_dict,B_dict,f_dict,combined_projection=True,**kwargs).solve()
+        np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=8)
+        # one coarse solve per iteration instead of two
+        self.assertTrue(sol_obj.telemetry['coarse_solve']['count']<0.6*sol_obj_parallel.telemetry['coarse_solve']['count'])
+
+        # the preconditioner is applied to G^T in chunks of columns
+        sol_obj = SerialFETIsolver(K_dict,B_dict,f_dict,combined_projection=True,projected_precond_chunk_size=2,**kwargs).solve()
+        np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=8)
+
+    def test_carry_primal_iterates(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        n_domains = len(K_dict)
+        for algorithm in [SerialFETIsolver, ParallelFETIsolver]:
+            for dual_interface_algorithm in ['PCPG','WorkspacePCPG']:
+                kwargs = dict(precond_type='Dirichlet',dual_interface_algorithm=dual_interface_algorithm)
+                sol_obj = algorithm(K_dict,B_dict,f_dict,**kwargs).solve()
+                sol_obj_carry = algorithm(K_dict,B_dict,f_dict,carry_primal_iterates=True,**kwargs).solve()
+
+                np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_carry.displacement,decimal=8)
+                np.testing.assert_almost_equal(sol_obj.alpha,sol_obj_carry.alpha,decimal=8)
+                self.assertEqual(sol_obj_carry.telemetry['local_solve']['count'],
+                                 sol_obj.telemetry['local_solve']['count'] - n_domains)
+
+        solver = SerialFETIsolver(K_dict,B_dict,f_dict,carry_primal_iterates=True)
+        sol_obj = solver.solve()
+        sol_obj_warm = solver.solve(lambda0=0.5*sol_obj.interface_lambda)
+        np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_warm.displacement,decimal=8)
+
+    def test_serial_solver_krylov_recycling(self):
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,3)
+        f_dict_list = [f_dict,
+                       {key : 1.1*np.asarray(f) for key, f in f_dict.items()},
+                       {key : np.roll(np.asarray(f),4) for key, f in f_dict.items()}]
+
+        for mode in KrylovRecycleStore.list_of_modes:
+            recycle_store = KrylovRecycleStore(capacity=200,mode=mode)
+            for i, f in enumerate(f_dict_list):
+                sol_obj = SerialFETIsolver(K_dict,B_dict,f).solve()
+                sol_obj_recycled = SerialFETIsolver(K_dict,B_dict,f,recycle_store=recycle_store).solve()
+
+                np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_recycled.displacement,decimal=8)
+                if i>0:
+                    self.assertTrue(sol_obj_recycled.PCGP_iterations<sol_obj.PCGP_iterations)
+            self.assertTrue(recycle_store.size>0)
+
+    def test_feti_dp(self):
+        for domains_x, domains_y in [(3,2),(3,3)]:
+            K_dict, B_dict, f_dict = create_FETI_case(2,domains_x,domains_y)
+            kwargs = dict(precond_type='Dirichlet',tolerance=1.0e-10)
+            sol_obj_target = SerialFETIsolver(K_dict,B_dict,f_dict,**kwargs).solve()
+            solver = SerialFETIDPsolver(K_dict,B_dict,f_dict,coarse_method='cholesky',**kwargs)
+            sol_obj = solver.solve()
+            np.testing.assert_almost_equal(sol_obj.displacement,sol_obj_target.displacement,decimal=8)
+
+            # the crosspoints are primal dofs and the primal coarse problem is regular
+            manager = solver.manager
+            for key, local_problem in manager.local_problem_dict.items():
+                self.assertEqual(np.asarray(local_problem.kernel).size,0)
+            crosspoint_classes = manager.detect_crosspoint_classes(f_dict)
+            self.assertTrue(len(crosspoint_classes)>0)
+            for (key, dof), dof_class in manager.dof_class.items():
+                if dof_class in crosspoint_classes:
+                    self.assertIn(dof,manager.primal_dofs_dict[key])
+            self.assertTrue(manager.primal_coarse_size>0)
+
+        K_dict, B_dict, f_dict = create_FETI_case(2,3,2)
+        f_dict_2 = {key : 2.0*np.asarray(f) for key, f in f_dict.items()}
+        sol_obj_list = SerialFETIDPsolver(K_dict,B_dict,f_dict,tolerance=1.0e-10).solve([f_dict,f_dict_2])
+        sol_obj_target = SerialFETIsolver(K_dict,B_dict,f_dict_2,tolerance=1.0e-10).solve()
+        np.testing.assert_almost_equal(sol_obj_list[1].displacement,sol_obj_target.displacement,decimal=8)
+        np.testing.assert_almost_equal(sol_obj_list[1].displacement,2.0*sol_obj_list[0].displacement,decimal=8)
+
 
 
 if __name__=='__main__':
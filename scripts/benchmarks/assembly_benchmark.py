@@ -0,0 +1,110 @@
+''' Benchmark of the assembly of G, GGT, the global B and the global R.
+
+Grids of subdomains are built with case_generator.FETIcase_builder, then the
+block matrices are assembled with the COO triplet assembly of the solver
+manager and, up to lil_max_domains subdomains, with the former lil_matrix
+assembly, which loops over all the pairs of row and column keys.
+
+usage:
+    python assembly_benchmark.py [case_id=1] [grids=[(5,2),(10,10),(40,25)]] [lil_max_domains=100]
+
+case_id is the case of pyfeti.cases.case_generator.
+'''
+import sys
+import time
+import numpy as np
+from scipy import sparse
+
+from pyfeti.src.utils import sysargs2keydict
+from pyfeti.src.feti_solver import SerialSolverManager
+from pyfeti.cases.case_generator import FETIcase_builder, get_case_matrices
+
+
+def lil_block_matrix(M_dict,row_map_dict,column_map_dict,shape):
+    M = sparse.lil_matrix(shape)
+    for row_key, row_dofs in row_map_dict.items():
+        for col_key, column_dofs in column_map_dict.items():
+            if isinstance(col_key,int):
+                column_key = col_key
+            else:
+                if row_key not in col_key:
+                    continue
+                l_key = list(col_key)
+                l_key.remove(row_key)
+                column_key = l_key[0]
+            try:
+                M[np.ix_(row_dofs,column_dofs)] = M_dict[row_key,column_key]
+            except:
+                continue
+    return M.tocsc()
+
+
+def lil_global_B(manager):
+    B = sparse.lil_matrix((manager.lambda_size,manager.primal_size))
+    for local_id in manager.local_problem_id_list:
+        local_problem = manager.local_problem_dict[local_id]
+        idx = manager.local2global_primal_dofs[local_id]
+        for nei_id in local_problem.neighbors_id:
+            idy = manager.local2global_lambda_dofs[min(local_id,nei_id),max(local_id,nei_id)]
+            B[np.ix_(idy,idx)] = local_problem.B_local[local_id,nei_id]
+    return B.tocsc()
+
+
+def lil_global_kernel(manager):
+    R = sparse.lil_matrix((manager.primal_size,manager.alpha_size))
+    for local_id, idy in manager.local2global_alpha_dofs.items():
+        idx = manager.local2global_primal_dofs[local_id]
+        R[np.ix_(idx,idy)] = manager.local_problem_dict[local_id].kernel
+    return R.tocsc()
+
+
+def build_manager(case_id,domains_x,domains_y):
+    K, f, B_left, B_right, B_bottom, B_top, s = get_case_matrices(case_id)
+    B_dict = {'left' : B_left, 'right' : B_right, 'bottom' : B_bottom, 'top' : B_top}
+    K_dict, B_dict, f_dict = FETIcase_builder(domains_x,domains_y,K,f,B_dict,s).build_subdomain_matrices()
+    manager = SerialSolverManager(K_dict,B_dict,f_dict)
+    manager.assemble_local_G_GGT_and_e()
+    manager.assemble_cross_GGT()
+    manager.build_local_to_global_mapping()
+    return manager
+
+
+def time_call(func,*args):
+    start_time = time.time()
+    func(*args)
+    return time.time() - start_time
+
+
+def run_benchmark(case_id=1,grids=[(5,2),(10,10),(40,25)],lil_max_domains=100):
+    header = '%10s %8s %14s %14s' %('domains','matrix','coo [s]','lil [s]')
+    print(header)
+    print('-'*len(header))
+    results = {}
+    for domains_x, domains_y in grids:
+        n_domains = domains_x*domains_y
+        manager = build_manager(case_id,domains_x,domains_y)
+        course_problem = manager.course_problem
+        alpha_map = manager.local2global_alpha_dofs
+        lambda_map = manager.local2global_lambda_dofs
+        G_shape = (manager.alpha_size,manager.lambda_size)
+        GGT_shape = (manager.alpha_size,manager.alpha_size)
+
+        coo_calls = {'G' : manager.assemble_G, 'GGT' : manager.assemble_GGT,
+                     'B' : manager.assemble_global_B, 'R' : manager.assemble_global_kernel}
+        lil_calls = {'G' : lambda : lil_block_matrix(course_problem.G_dict,alpha_map,lambda_map,G_shape),
+                     'GGT' : lambda : lil_block_matrix(course_problem.GGT_dict,alpha_map,alpha_map,GGT_shape),
+                     'B' : lambda : lil_global_B(manager), 'R' : lambda : lil_global_kernel(manager)}
+
+        for name in ['G','GGT','B','R']:
+            coo_time = time_call(coo_calls[name])
+            lil_time = np.nan
+            if n_domains<=lil_max_domains:
+                lil_time = time_call(lil_calls[name])
+            results[n_domains,name] = (coo_time,lil_time)
+            print('%10i %8s %14.4e %14.4e' %(n_domains,name,coo_time,lil_time))
+    return results
+
+
+if __name__ == '__main__':
+    kwargs = sysargs2keydict(sys.argv)
+    run_benchmark(**kwargs)
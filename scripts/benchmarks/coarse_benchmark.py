@@ -0,0 +1,60 @@
+''' Benchmark of the coarse methods of the CoarseProblem.
+
+The coarse problem of a case with domains x domains subdomains is assembled,
+then the factorization of GGT and the application of the projection
+P r = r - G^T (G G^T)^-1 G r are timed for every coarse method.
+
+usage:
+    python coarse_benchmark.py [case_id=1] [domains=[4,8,12,16]] [methods=['splu','inv','cholesky','qr']] [repeat=100]
+
+case_id is the case of pyfeti.cases.case_generator.
+'''
+import sys
+import time
+import numpy as np
+
+from pyfeti.src.utils import sysargs2keydict
+from pyfeti.src.feti_solver import SerialSolverManager
+from pyfeti.cases.case_generator import create_FETI_case
+
+
+def build_coarse_problem(K_dict,B_dict,f_dict,coarse_method):
+    manager = SerialSolverManager(K_dict,B_dict,f_dict,coarse_method=coarse_method)
+    manager.assemble_local_G_GGT_and_e()
+    manager.assemble_cross_GGT()
+    manager.build_local_to_global_mapping()
+    manager.assemble_G()
+    manager.assemble_GGT()
+    return manager
+
+
+def time_coarse_method(manager,repeat=100):
+    start_time = time.time()
+    manager.GGT_inv
+    setup_time = time.time() - start_time
+
+    projection = manager.get_projection()
+    r = np.random.RandomState(0).rand(manager.lambda_size)
+    start_time = time.time()
+    for i in range(repeat):
+        projection(r)
+    return setup_time, (time.time() - start_time)/repeat
+
+
+def run_benchmark(case_id=1,domains=[4,8,12,16],methods=['splu','inv','cholesky','qr'],repeat=100):
+    header = '%8s %8s %10s %14s %14s' %('alphas','lambdas','method','setup [s]','projection [s]')
+    print(header)
+    print('-'*len(header))
+    results = {}
+    for n_domains in domains:
+        K_dict, B_dict, f_dict = create_FETI_case(case_id,n_domains,n_domains)
+        for method in methods:
+            manager = build_coarse_problem(K_dict,B_dict,f_dict,method)
+            results[n_domains,method] = time_coarse_method(manager,repeat)
+            print('%8i %8i %10s %14.4e %14.4e' %(manager.alpha_size,manager.lambda_size,method,*results[n_domains,method]))
+    return results
+
+
+if __name__ == '__main__':
+    kwargs = sysargs2keydict(sys.argv)
+    run_benchmark(**kwargs)
@@ -0,0 +1,63 @@
+''' Benchmark of the local solves with blocks of right hand sides.
+
+The interior subdomain of a 3 x 3 case solves K u = f - B^T lambda and
+gathers B u for a block of lambda columns, as the Block PCPG does in every
+F application. The cost per right hand side is reported for every block
+width and every Pseudoinverse method.
+
+usage:
+    python multi_rhs_benchmark.py [case_id=4] [methods=['spkernel','fixing','cholsps']] [widths=[1,2,4,8,16,32,64]] [repeat=5]
+
+case_id is the case of pyfeti.cases.case_generator, e.g. 4 is case_800.
+'''
+import sys
+import time
+import numpy as np
+
+from pyfeti.src.utils import sysargs2keydict
+from pyfeti.src.feti_solver import LocalProblem
+from pyfeti.cases.case_generator import create_FETI_case
+
+
+def interface_block(local_problem,width,random_state):
+    lambda_dict = {}
+    for (local_id, nei_id), B in local_problem.B_local.items():
+        lambda_dict[min(local_id,nei_id),max(local_id,nei_id)] = random_state.rand(B.shape[0],width)
+    return lambda_dict
+
+
+def time_block_solve(local_problem,width,repeat=5):
+    lambda_dict = interface_block(local_problem,width,np.random.RandomState(0))
+    start_time = time.time()
+    for i in range(repeat):
+        u = local_problem.solve(lambda_dict)
+        local_problem.get_interface_dict(u)
+    return (time.time() - start_time)/repeat
+
+
+def run_benchmark(case_id=4,methods=['spkernel','fixing','cholsps'],widths=[1,2,4,8,16,32,64],repeat=5):
+    K_dict, B_dict, f_dict = create_FETI_case(case_id,3,3)
+    domain_id = 5
+
+    header = '%10s %8s %14s %14s %10s' %('method','width','block [s]','per rhs [s]','speedup')
+    print(header)
+    print('-'*len(header))
+    results = {}
+    for method in methods:
+        local_problem = LocalProblem(K_dict[domain_id],B_dict[domain_id],f_dict[domain_id],id=domain_id,
+                                     pseudoinverse_kargs={'method':method,'tolerance':1.0E-8})
+        # factorization is not measured
+        local_problem.get_kernel()
+        time_block_solve(local_problem,1,repeat=1)
+
+        for width in widths:
+            block_time = time_block_solve(local_problem,width,repeat)
+            results[method,width] = block_time/width
+            print('%10s %8i %14.4e %14.4e %10.2f' %(method,width,block_time,results[method,width],
+                  results[method,widths[0]]/results[method,width]))
+    return results
+
+
+if __name__ == '__main__':
+    kwargs = sysargs2keydict(sys.argv)
+    run_benchmark(**kwargs)
@@ -0,0 +1,78 @@
+''' Benchmark of the Pseudoinverse methods on the pyfeti/cases/matrices set.
+
+For every case with a K.pkl file the factorization time, the null space size,
+the null space residual ||K R|| / max(diag(K)) and the relative residual of
+K K_pinv f = f (with f orthogonal to the null space) are reported.
+
+usage:
+    python pseudoinverse_benchmark.py [methods=['spkernel','fixing','splusps','svd']] [svd_max_size=3200]
+
+The dense svd is skipped for matrices larger than svd_max_size.
+'''
+import os
+import sys
+import time
+import logging
+import numpy as np
+
+from pyfeti.src.utils import load_object, pyfeti_dir, sysargs2keydict
+from pyfeti.src.linalg import Pseudoinverse
+
+
+def benchmark_case(K,method,svd_max_size=None):
+    n = K.shape[0]
+    start_time = time.time()
+    pinv = Pseudoinverse(method=method,svd_max_size=svd_max_size).compute(K)
+    factorization_time = time.time() - start_time
+
+    R = pinv.null_space
+    f = np.random.RandomState(0).rand(n)
+    if R.size>0:
+        f -= R.dot(np.linalg.lstsq(R,f,rcond=None)[0])
+        kernel_residual = np.linalg.norm(K.dot(R))/K.diagonal().max()
+        kernel_size = R.shape[1]
+    else:
+        kernel_residual = 0.0
+        kernel_size = 0
+
+    start_time = time.time()
+    u = pinv.apply(f)
+    solve_time = time.time() - start_time
+    solution_residual = np.linalg.norm(K.dot(u) - f)/np.linalg.norm(f)
+
+    return {'factorization_time' : factorization_time, 'solve_time' : solve_time,
+            'kernel_size' : kernel_size, 'kernel_residual' : kernel_residual,
+            'solution_residual' : solution_residual}
+
+
+def run_benchmark(methods=['spkernel','fixing','splusps','svd'],svd_max_size=3200):
+    matrices_folder = pyfeti_dir(os.path.join('cases','matrices'))
+    case_list = []
+    for case_name in os.listdir(matrices_folder):
+        K_path = os.path.join(matrices_folder,case_name,'K.pkl')
+        if os.path.exists(K_path):
+            case_list.append((int(case_name.split('_')[-1]),K_path))
+
+    header = '%10s %10s %10s %12s %12s %12s %12s' %('case','method','kernel','fact. [s]','solve [s]','||KR||','||Ku-f||')
+    print(header)
+    print('-'*len(header))
+    results = {}
+    for case_size, K_path in sorted(case_list):
+        K = load_object(K_path)
+        for method in methods:
+            if method=='svd' and K.shape[0]>svd_max_size:
+                continue
+            try:
+                result = benchmark_case(K,method)
+            except Exception as e:
+                logging.warning('%s failed for case %i : %s' %(method,case_size,str(e)))
+                continue
+            results[case_size,method] = result
+            print('%10i %10s %10i %12.4e %12.4e %12.4e %12.4e' %(case_size,method,result['kernel_size'],
+                  result['factorization_time'],result['solve_time'],result['kernel_residual'],result['solution_residual']))
+    return results
+
+
+if __name__ == '__main__':
+    kwargs = sysargs2keydict(sys.argv)
+    run_benchmark(**kwargs)